@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from .config_versions import get_config_versions
+from .models import AssistantConfiguration
+from .tasks import build_prompt_webhook
+from .tool_schemas import compile_agent_tools
+from backend.settings import logger
+
+
+AGENT_SNAPSHOT_CACHE_ENABLED = os.getenv("AGENT_SNAPSHOT_CACHE_ENABLED", "true").lower() != "false"
+AGENT_SNAPSHOT_TTL = int(os.getenv("AGENT_SNAPSHOT_TTL", 3600))  # Seconds a snapshot is kept in Redis
+AGENT_SNAPSHOT_LOCAL_MAX_ENTRIES = int(os.getenv("AGENT_SNAPSHOT_LOCAL_MAX_ENTRIES", 1000))  # Snapshots kept per process
+USER_EMAIL_CACHE_TTL = int(os.getenv("USER_EMAIL_CACHE_TTL", 3600))  # Seconds an email -> user id lookup is kept
+
+_snapshots = OrderedDict()  # (agent_uuid, user_id) -> (expiry, snapshot), least recently used first
+_snapshots_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class AgentSnapshot:
+    """
+    Everything a webhook turn reads about an agent, loaded together: the configuration with its knowledge base,
+    the user the agent acts for, the agent's tools and its static system prompt.
+    Snapshots are shared between requests and must be treated as read-only, model instances included.
+    `version` holds the ("agent", "user") config versions the snapshot was built at.
+    """
+
+    agent_uuid: str
+    version: Tuple[int, int]
+    config: AssistantConfiguration
+    user: object
+    tools: tuple
+    prompt: str
+
+    @property
+    def knowledge_base(self):
+        return self.config.knowledge_base
+
+
+def user_email_key(email: str) -> str:
+    return f"user_id_by_email:{email}"
+
+
+def get_user_id_by_email(email: str) -> Optional[int]:
+    """
+    Returns the id of the user with an email, cached in Redis. Unknown emails are not cached.
+    """
+    key = user_email_key(email)
+    try:
+        user_id = cache.get(key)
+    except Exception as e:
+        logger.warning(f"User email cache lookup failed: {e}")
+        user_id = None
+    if user_id is not None:
+        return user_id
+    user_id = get_user_model().objects.filter(email=email).values_list("pk", flat=True).first()
+    if user_id is not None:
+        try:
+            cache.set(key, user_id, timeout=USER_EMAIL_CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"User email cache store failed: {e}")
+    return user_id
+
+
+def forget_user_email(email: str) -> None:
+    try:
+        cache.delete(user_email_key(email))
+    except Exception as e:
+        logger.warning(f"Failed to forget cached user of {email}: {e}")
+
+
+def build_agent_snapshot(agent_uuid, user_id=None, version: tuple = (0, 0)) -> Optional[AgentSnapshot]:
+    """
+    Loads an agent snapshot from the database, or returns None if the agent doesn't exist.
+    """
+    config = AssistantConfiguration.objects.select_related("knowledge_base").filter(assistant_uuid=agent_uuid).first()
+    if not config:
+        return None
+    user = get_user_model().objects.filter(pk=user_id).first() if user_id is not None else None
+    tools = compile_agent_tools(agent_uuid, user, webhook=True, agent=config)
+    return AgentSnapshot(
+        agent_uuid=str(agent_uuid),
+        version=version,
+        config=config,
+        user=user,
+        tools=tuple(tools),
+        prompt=build_prompt_webhook(config),
+    )
+
+
+def get_agent_snapshot(agent_uuid, user_id=None) -> Optional[AgentSnapshot]:
+    """
+    Returns the snapshot of an agent acting for a user.
+    Snapshots are kept in Redis and in an in-process LRU (AGENT_SNAPSHOT_LOCAL_MAX_ENTRIES entries, each kept at
+    most AGENT_SNAPSHOT_TTL seconds) under the agent's and the user's config versions, so a warm
+    agent costs one cache round trip (the version check) and no database query. Signals bump the versions when
+    the configuration, its knowledge base or data files, the user, or the user's tools or integrations change.
+    Args:
+        agent_uuid: The agent's assistant_uuid.
+        user_id: The id of the user the agent acts for, if any.
+    Returns:
+        AgentSnapshot: The snapshot, or None if the agent doesn't exist.
+    """
+    versions = get_config_versions(("agent", agent_uuid), ("user", user_id)) if AGENT_SNAPSHOT_CACHE_ENABLED else None
+    if versions is None:
+        return build_agent_snapshot(agent_uuid, user_id)
+
+    local_key = (str(agent_uuid), user_id)
+    now = time.monotonic()
+    with _snapshots_lock:
+        entry = _snapshots.get(local_key)
+        if entry is not None and entry[0] > now and entry[1].version == versions:
+            _snapshots.move_to_end(local_key)
+            return entry[1]
+        if entry is not None:
+            del _snapshots[local_key]
+
+    key = f"agent_snapshot:{agent_uuid}:{versions[0]}:{user_id}:{versions[1]}"
+    try:
+        snapshot = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Agent snapshot cache lookup failed: {e}")
+        snapshot = None
+    if snapshot is None:
+        snapshot = build_agent_snapshot(agent_uuid, user_id, versions)
+        if snapshot is None:
+            return None
+        try:
+            cache.set(key, snapshot, timeout=AGENT_SNAPSHOT_TTL)
+        except Exception as e:
+            logger.warning(f"Agent snapshot cache store failed: {e}")
+        logger.info(f"Built snapshot of agent {agent_uuid} for user {user_id} at version {versions}")
+    with _snapshots_lock:
+        _snapshots[local_key] = (now + AGENT_SNAPSHOT_TTL, snapshot)
+        _snapshots.move_to_end(local_key)
+        while len(_snapshots) > AGENT_SNAPSHOT_LOCAL_MAX_ENTRIES:
+            _snapshots.popitem(last=False)
+    return snapshot
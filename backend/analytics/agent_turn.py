@@ -0,0 +1,110 @@
+import os
+import time
+from typing import Callable, List
+from backend.settings import logger
+
+
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", 8))  # Model calls allowed per user turn
+
+
+def serialize_tool_calls(tool_calls) -> List[dict]:
+    """
+    Converts the tool calls of a model message into the dicts the chat history stores.
+    """
+    return [
+        {
+            "id": tool_call.id,
+            "type": getattr(tool_call, "type", "function"),
+            "function": {
+                "name": tool_call.function.name,
+                "arguments": tool_call.function.arguments
+            }
+        }
+        for tool_call in tool_calls
+    ]
+
+
+class AgentTurn:
+    """
+    One user turn of an agent, as an explicit state machine:
+
+        CALL_MODEL --tool calls--> RUN_TOOLS --> CALL_MODEL
+        CALL_MODEL --reply-------> DONE
+
+    Every CALL_MODEL step makes exactly one model request, whose completion is always used, so a turn with n
+    tool rounds costs n + 1 model calls. The last of `max_steps` calls is made with tool_choice="none", so a turn
+    always ends with a reply.
+
+    `call_model(messages, tool_choice)` returns a chat completion; `run_tools(tool_calls)` executes the tool
+    calls of one step and returns their "tool" messages. Both the assistant tool-call messages and the tool
+    results are appended to `messages`.
+    """
+
+    CALL_MODEL = "call_model"
+    RUN_TOOLS = "run_tools"
+    DONE = "done"
+
+    def __init__(
+        self,
+        messages: List[dict],
+        call_model: Callable,
+        run_tools: Callable,
+        max_steps: int = AGENT_MAX_STEPS
+    ):
+        self.messages = messages
+        self.call_model = call_model
+        self.run_tools = run_tools
+        self.max_steps = max(max_steps, 1)
+        self.state = self.CALL_MODEL
+        self.model_calls = 0
+        self.tool_rounds = 0
+        self.reply = None
+        self.finish_reason = None
+        self.steps = []
+        self._tool_calls = None
+
+    def run(self) -> str:
+        """
+        Runs the turn to completion.
+        Returns:
+            str: The model's reply.
+        """
+        handlers = {self.CALL_MODEL: self._call_model, self.RUN_TOOLS: self._run_tools}
+        while self.state != self.DONE:
+            state = self.state
+            start = time.perf_counter()
+            self.state = handlers[state]()
+            self.steps.append((state, time.perf_counter() - start))
+        logger.info(f"Agent turn finished: {self.summary()}")
+        return self.reply
+
+    def summary(self) -> dict:
+        return {
+            "model_calls": self.model_calls,
+            "tool_rounds": self.tool_rounds,
+            "finish_reason": self.finish_reason,
+            "model_seconds": round(sum(seconds for state, seconds in self.steps if state == self.CALL_MODEL), 3),
+            "tool_seconds": round(sum(seconds for state, seconds in self.steps if state == self.RUN_TOOLS), 3),
+        }
+
+    def _call_model(self) -> str:
+        tool_choice = "none" if self.model_calls + 1 >= self.max_steps else "auto"
+        completion = self.call_model(self.messages, tool_choice)
+        self.model_calls += 1
+        choice = completion.choices[0]
+        self.finish_reason = choice.finish_reason
+        tool_calls = getattr(choice.message, "tool_calls", None)
+        if tool_calls:
+            self.messages.append({"role": "assistant", "content": None, "tool_calls": serialize_tool_calls(tool_calls)})
+            self._tool_calls = tool_calls
+            return self.RUN_TOOLS
+        if choice.finish_reason != "stop":
+            logger.warning(f"Agent reply ended with finish_reason={choice.finish_reason}")
+        self.reply = choice.message.content or ""
+        return self.DONE
+
+    def _run_tools(self) -> str:
+        tool_calls, self._tool_calls = self._tool_calls, None
+        self.messages.extend(self.run_tools(tool_calls))
+        self.tool_rounds += 1
+        return self.CALL_MODEL
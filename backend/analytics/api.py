@@ -7,30 +7,22 @@ from openai import OpenAI
 from django.utils import timezone
 from uuid import uuid4
 
-from analytics.integrations import get_integration_details
-from .tools import (analytics_tools,
-                    AGENT_TOOLS,
-                    WEBHOOK_TOOLS,
-                    INTEGRATION_TOOLS
-                    )
+from .tools import analytics_tools
 from .constants import (
     ANALYTICS_SYSTEM_PROMPT,
     GENERATE_TEST_SUITE_PROMPT,
     TEST_GENERATION_MODEL
 )
-import requests
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from .models import (
     AssistantConfiguration,
     IntegrationFeature,
     Integrations,
-    KnowledgeBase,
     TestSuite,
     WebsiteLink,
     KnowledgeFile,
     KnowledgeExcel,
-    UserTool
 )
 from .serializers import (
     AssistantConfigurationSerializer,
@@ -57,32 +49,29 @@ from rest_framework.decorators import (
 import redis
 from django.conf import settings
 from .tasks import (
-    fetch_all_products,
-    get_fulfillment_line_items_by_order_id,
-    get_order_id_by_name,
-    get_product_recommendation,
-    order_tracking_with_order_id,
-    get_shopify_orders,
-    remove_prefix_and_suffix,
-    return_processing,
     run_test_task,
     build_final_prompt,
     index_knowledge_base_task,
-    refine_query,
-    get_data_from_excel,
+    get_index_lock_key,
 )
 from celery.result import AsyncResult
-from pinecone import Pinecone
+from django.core.cache import cache
 import time
-from .indexing import retrieve
+from .indexing import delete_source_vectors
+from .retrieval import retrieve_for_knowledge_base
+from .tool_calls import execute_tool_calls
+from .tool_registry import ToolContext, get_tool_registry
+from .config_versions import bump_config_version
+from .tool_schemas import get_compiled_agent_tools
 from backend.settings import logger
-from .functions import user_tool_to_openai_tool, execute_user_tool
+from .functions import execute_user_tool
 from django.contrib.auth import get_user_model
 from .tasks import export_all_rooms_data_to_excel
 
 User = get_user_model()
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+TEST_SUITE_TEMPLATE = Template(GENERATE_TEST_SUITE_PROMPT)
 
 # Setup Redis connection
 redis_client = redis.StrictRedis(
@@ -150,248 +139,15 @@ def get_response(messages):
                 if finish_reason == "tool_calls":
                     logger.info(f"Finish reason 'tool_calls' detected. Processing {len(current_tool_calls)} tool calls.")
                     tool_call_results = []
-                    for index, tool_call in current_tool_calls.items():
-                        tool_call_id = tool_call.get("id", f"unknown_id_{index}")
-                        tool_name = tool_call.get("name", "unknown_name")
-                        tool_args_str = tool_call.get("arguments", "")
-                        logger.info(f"""
-                                    Processing collected tool call: id={tool_call_id}, name={tool_name}, args='{tool_args_str}'
-                                    """)
-
-                        if tool_name == "get_data_from_database":
-                            try:
-                                logger.debug(f"Attempting to parse JSON arguments for tool call {tool_call_id}")
-                                args = json.loads(tool_args_str)
-                                description = args.get("description", "Fetching data from database...")
-                                query = args.get("query")
-                                logger.info(f"Parsed arguments for {tool_name}: description='{description}', query='{query}'")
-
-                                logger.debug(f"Yielding 'thinking' state for tool call {tool_call_id}")
-                                yield json.dumps({"type": "thinking", "description": description}) + "\n"
-
-                                if query:
-                                    api_url = os.getenv("WHATSAPP_ANALYTICS_URL")
-                                    headers = {
-                                        'Content-Type': 'application/json',
-                                        'Cookie': 'multidb_pin_writes=y'
-                                    }
-                                    data = {"query": query}
-                                    logger.info(f"Executing API call for {tool_name} to {api_url}")
-                                    logger.debug(f"Request Headers: {headers}")
-                                    logger.debug(f"Request Data: {data}")
-
-                                    try:
-                                        response = requests.post(api_url, headers=headers, json=data, timeout=30)
-                                        logger.info(
-                                            f"""
-                                            API call to {api_url} completed with status code: {response.status_code}
-                                            """
-                                        )
-                                        logger.debug(f"API Response Headers: {response.headers}")
-                                        result_data = response.json()
-                                        logger.debug(f"API Response JSON Data: {result_data}")
-                                        response.raise_for_status()
-
-                                        if isinstance(result_data, dict) and ("table_data" in result_data):
-                                            table = result_data.get("table") or result_data.get("table_data")
-                                            yield json.dumps({"type": "table_data", "data": table}) + "\n"
-                                        if isinstance(result_data, dict) and ("graph_data" in result_data):
-                                            graph = result_data.get("graph") or result_data.get("graph_data")
-                                            yield json.dumps({"type": "graph_data", "data": graph}) + "\n"
-
-                                        tool_call_results.append({
-                                            "role": "tool",
-                                            "tool_call_id": tool_call_id,
-                                            "content": json.dumps(result_data)
-                                        })
-                                        logger.info(f"Successfully processed tool call {tool_call_id} and got result.")
-
-                                    except requests.exceptions.Timeout:
-                                        logger.error(f"API call to {api_url} timed out.", exc_info=True)
-                                        tool_call_results.append({
-                                            "role": "tool", "tool_call_id": tool_call_id,
-                                            "content": json.dumps({"error": "API call timed out."})
-                                        })
-                                    except requests.exceptions.RequestException as e:
-                                        logger.error(f"API call to {api_url} failed: {e}", exc_info=True)
-                                        tool_call_results.append({
-                                            "role": "tool", "tool_call_id": tool_call_id,
-                                            "content": json.dumps({"error": "API call failed."})
-                                        })
-                                    except json.JSONDecodeError as e:
-                                        logger.error(f"Failed to decode JSON from {api_url}: {e}", exc_info=True)
-                                        logger.debug(f"Raw API response text: {response.text}")
-                                        tool_call_results.append({
-                                            "role": "tool",
-                                            "tool_call_id": tool_call_id,
-                                            "content": json.dumps({"error": "Invalid API JSON response."})
-                                        })
-                                else:
-                                    logger.warning(f"Tool {tool_call_id} ({tool_name}) missing 'query'.")
-                                    tool_call_results.append(
-                                        {
-                                            "role": "tool", "tool_call_id": tool_call_id,
-                                            "content": json.dumps({"error": "Missing query argument"})
-                                        }
-                                    )
-
-                            except json.JSONDecodeError as e:
-                                logger.error(
-                                    f"Error decoding args for {tool_call_id}: '{tool_args_str}'. Err: {e}",
-                                    exc_info=True
-                                )
-                                yield json.dumps({"type": "thinking", "description": "Error processing tool args..."}) + "\n"
-                                tool_call_results.append({
-                                    "role": "tool", "tool_call_id": tool_call_id,
-                                    "content": json.dumps({"error": "Invalid args format."})
-                                })
-                            except Exception as e:
-                                logger.error(
-                                    f"Unexpected error processing tool {tool_call_id} ({tool_name}): {e}",
-                                    exc_info=True
-                                )
-                                tool_call_results.append({
-                                    "role": "tool", "tool_call_id": tool_call_id,
-                                    "content": json.dumps({"error": f"Unexpected tool processing error: {e}"})
-                                })
-                        elif tool_name == "make_graph":
-                            try:
-                                logger.debug(f"Attempting to parse JSON arguments for tool call {tool_call_id}")
-                                args = json.loads(tool_args_str)
-                                x_label = args.get("x_label", "X Axis")
-                                y_label = args.get("y_label", "Y Axis")
-                                x_coordinates = args.get("x_coordinates", [])
-                                y_coordinates = args.get("y_coordinates", [])
-                                description = args.get("description", "Graph")
-                                logger.info(
-                                    f"""
-                                    arguments for make_graph:
-                                    x_label='{x_label}',
-                                    y_label='{y_label}',
-                                    description='{description}'
-                                    """
-                                )
-
-                                yield json.dumps({
-                                    "type": "graph_data",
-                                    "data": {
-                                        "x_label": x_label,
-                                        "y_label": y_label,
-                                        "x_coordinates": x_coordinates,
-                                        "y_coordinates": y_coordinates
-                                    }
-                                }) + "\n"
-
-                                tool_call_results.append({
-                                    "role": "tool",
-                                    "tool_call_id": tool_call_id,
-                                    "content": json.dumps({
-                                        "x_label": x_label,
-                                        "y_label": y_label,
-                                        "x_coordinates": x_coordinates,
-                                        "y_coordinates": y_coordinates
-                                    })
-                                })
-                                logger.info(f"Successfully processed make_graph tool call {tool_call_id}.")
-                            except Exception as e:
-                                logger.error(
-                                    f"Error processing make_graph tool call {tool_call_id}: {e}",
-                                    exc_info=True
-                                )
-                                tool_call_results.append({
-                                    "role": "tool", "tool_call_id": tool_call_id,
-                                    "content": json.dumps({"error": f"Unexpected error in make_graph: {e}"})
-                                })
-                        elif tool_name == "make_bar_graph":
-                            try:
-                                args = json.loads(tool_args_str)
-                                yield json.dumps({
-                                    "type": "bar_graph_data",
-                                    "data": args
-                                }) + "\n"
-                                tool_call_results.append({
-                                    "role": "tool", "tool_call_id": tool_call_id,
-                                    "content": json.dumps(args)
-                                })
-                            except Exception as e:
-                                logger.error(
-                                    f"Error processing make_bar_graph tool call {tool_call_id}: {e}",
-                                    exc_info=True
-                                )
-                                tool_call_results.append({
-                                    "role": "tool", "tool_call_id": tool_call_id,
-                                    "content": json.dumps({"error": f"Unexpected error in make_bar_graph: {e}"})
-                                })
-                        elif tool_name == "make_line_graph":
-                            try:
-                                args = json.loads(tool_args_str)
-                                yield json.dumps({
-                                    "type": "line_graph_data",
-                                    "data": args
-                                }) + "\n"
-                                tool_call_results.append({
-                                    "role": "tool", "tool_call_id": tool_call_id,
-                                    "content": json.dumps(args)
-                                })
-                            except Exception as e:
-                                logger.error(
-                                    f"Error processing make_line_graph tool call {tool_call_id}: {e}",
-                                    exc_info=True
-                                )
-                                tool_call_results.append({
-                                    "role": "tool", "tool_call_id": tool_call_id,
-                                    "content": json.dumps({"error": f"Unexpected error in make_line_graph: {e}"})
-                                })
-                        elif tool_name == "make_area_graph":
-                            try:
-                                args = json.loads(tool_args_str)
-                                yield json.dumps({
-                                    "type": "area_graph_data",
-                                    "data": args
-                                }) + "\n"
-                                tool_call_results.append({
-                                    "role": "tool", "tool_call_id": tool_call_id,
-                                    "content": json.dumps(args)
-                                })
-                            except Exception as e:
-                                logger.error(
-                                    f"Error processing make_area_graph tool call {tool_call_id}: {e}",
-                                    exc_info=True
-                                )
-                                tool_call_results.append({
-                                    "role": "tool", "tool_call_id": tool_call_id,
-                                    "content": json.dumps(
-                                        {
-                                            "error": f"Unexpected error in make_area_graph: {e}"
-                                        }
-                                    )
-                                })
-                        elif tool_name == "make_doughnut_graph":
-                            try:
-                                args = json.loads(tool_args_str)
-                                yield json.dumps({
-                                    "type": "doughnut_graph_data",
-                                    "data": args
-                                }) + "\n"
-                                tool_call_results.append({
-                                    "role": "tool", "tool_call_id": tool_call_id,
-                                    "content": json.dumps(args)
-                                })
-                            except Exception as e:
-                                logger.error(
-                                    f"Error processing make_doughnut_graph tool call {tool_call_id}: {e}",
-                                    exc_info=True
-                                )
-                                tool_call_results.append({
-                                    "role": "tool", "tool_call_id": tool_call_id,
-                                    "content": json.dumps({"error": f"Unexpected error in make_doughnut_graph: {e}"})
-                                })
-                        else:
-                            logger.warning(f"Unhandled tool call: id={tool_call_id}, name={tool_name}")
-                            tool_call_results.append({
-                                "role": "tool", "tool_call_id": tool_call_id,
-                                "content": json.dumps({"error": f"Tool '{tool_name}' not implemented."})
-                            })
+                    registry = get_tool_registry(kind="analytics")
+                    for tool_call in current_tool_calls.values():
+                        logger.info(f"Processing collected tool call: id={tool_call['id']}, name={tool_call['name']}")
+                        for event in registry.announce(tool_call):
+                            yield json.dumps(event) + "\n"
+                        context = ToolContext(messages=messages)
+                        tool_call_results.extend(registry.dispatch(tool_call, context))
+                        for event in context.events:
+                            yield json.dumps(event) + "\n"
 
                     if tool_call_results:
                         logger.info("Finished processing tool calls for this round. Preparing to send results back to OpenAI.")
@@ -441,55 +197,11 @@ def get_response(messages):
 
 # Helper to get all tools for a user (static + dynamic)
 def get_agent_tools_for_user(user, webhook=False, agent_uuid=None):
-    logger.info(f"get-agent_tools | Fetching agent tools for user, webhook: {webhook}")
-    static_tools = []
-    static_tools.extend(AGENT_TOOLS)
-    if webhook:
-        tools = static_tools + WEBHOOK_TOOLS
-    else:
-        tools = static_tools
-
-    agent = AssistantConfiguration.objects.filter(assistant_uuid=agent_uuid).first()
-    if not agent:
-        logger.warning(f"No agent found for UUID: {agent_uuid}")
-        return tools
-
-    user_tools = []
-    integration_tools = []
-
-    for tool_uuid in agent.selected_tools:
-        logger.debug(f"Checking tool UUID: {tool_uuid}")
-
-        if user:
-            user_tool = UserTool.objects.filter(user=user, uuid=tool_uuid).first()
-            if user_tool:
-                logger.debug(f"Found user tool: {user_tool.name}")
-                user_tools.append(user_tool)
-    if user:
-        user_integrations = Integrations.objects.filter(user=user)
-        all_features = IntegrationFeature.objects.filter(integration__in=user_integrations, is_active=True)
-
-        for tool in agent.integration_tools:
-            logger.debug(f"Integration tool selected by agent: {agent.integration_tools}")
-            matching_feature = all_features.filter(hash=tool).first()
-
-            if matching_feature:
-                integration_tool = INTEGRATION_TOOLS.get(tool)
-
-                if integration_tool:
-                    integration_tools.append(integration_tool)
-                else:
-                    logger.warning(f"No static tool definition found for feature: {tool}")
-            else:
-                logger.warning(f"Feature '{tool}' not active for user: {user}")
-
-    # Convert user tools to OpenAI format
-    for tool in user_tools:
-        tools.append(user_tool_to_openai_tool(tool))
-
-    # Add all function definitions from integration tools
-    tools += integration_tools
-
+    """
+    Returns the OpenAI tools of an agent for a user, compiled once per agent and user and cached until the
+    agent, the user's tools or their integration features change (see tool_schemas).
+    """
+    tools = get_compiled_agent_tools(agent_uuid, user, webhook=webhook)
     logger.debug(f"get_agent_tools_for_user | Final tools registered with OpenAI: {[t.get('function', {}).get('name') for t in tools]}")
     return tools
 
@@ -693,6 +405,8 @@ class AssistantConfigRetrieveUpdateView(APIView):
             integration = feature.integration
             IntegrationFeature.objects.filter(integration=integration).update(is_active=False)
             IntegrationFeature.objects.filter(integration=integration, hash__in=feature_hashes).update(is_active=True)
+            # update() sends no signals
+            bump_config_version("user", integration.user_id)
 
         if serializer.is_valid():
             organisation_description = request.data.get("organisationDescription")
@@ -907,319 +621,23 @@ class WhatsAppChatView(APIView):
             else:
                 yield buffer.encode()
 
-    def process_tool_calls(self, tool_calls, messages):
-        """Process tool calls and return results"""
-        tool_call_results = []
+    def process_tool_calls(self, tool_calls, messages, agent_uuid=None):
+        """Process tool calls concurrently and return their results in tool call order"""
         user = None
         logger.debug(f"process_tool_calls called with {len(tool_calls)} tool_calls")
         # try request.user if available
         if hasattr(self, 'request') and hasattr(self.request, 'user'):
             user = getattr(self.request, 'user', None)
             logger.debug(f"process_tool_calls: user from request: {user}")
+        registry = get_tool_registry(user, agent_uuid=agent_uuid, kind="chat")
+        tool_call_results = execute_tool_calls(tool_calls, lambda tool_call: self.process_tool_call(tool_call, registry, user, messages))
+        logger.debug(f"process_tool_calls returning {len(tool_call_results)} results")
+        return tool_call_results
 
-        for tool_call in tool_calls:
-            logger.debug(f"Processing tool_call: {tool_call}")
-            if hasattr(tool_call, 'id'):
-                tool_call_id = tool_call.id
-                tool_name = tool_call.function.name
-                tool_args_str = tool_call.function.arguments or ""
-            else:
-                tool_call_id = tool_call.get("id", "unknown_id")
-                tool_name = tool_call.get("name", "unknown_name")
-                tool_args_str = tool_call.get("arguments", "")
-            logger.debug(f"tool_call_id={tool_call_id}, tool_name={tool_name}, tool_args_str={tool_args_str}")
-
-            # Check if this is a user tool
-            if user:
-                user_tools = UserTool.objects.filter(user=user, name=tool_name)
-                logger.info(f"the user tools for process user tools : {user_tools}")
-                try:
-                    user_tool = user_tools.first()
-                except Exception as e:
-                    logger.exception(f"[Tool Call] Failed to retrieve user tool '{tool_name}' for user '{user}': {e}")
-                    user_tool = None
-
-                if user_tool:
-                    logger.debug(f"Executing user tool: {tool_name} for user: {user}")
-                    try:
-                        args = json.loads(tool_args_str)
-                    except Exception as e:
-                        logger.error(f"Error parsing arguments for user tool {tool_name}: {e}")
-                        args = {}
-                    result = execute_user_tool(tool_name, user, args)
-                    logger.debug(f"User tool {tool_name} result: {result}")
-                    tool_call_results.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call_id,
-                        "content": json.dumps({"result": result})
-                    })
-
-                elif tool_name == "refine_query":
-                    logger.debug(f"Processing refine_query tool call: {tool_call_id}")
-                    try:
-                        args = json.loads(tool_args_str)
-                        query = args.get("query")
-                        logger.debug(f"refine_query args: {args}")
-                        if query:
-                            refined_query = refine_query(query, messages)
-                            logger.debug(f"refined_query result: {refined_query}")
-                            tool_call_results.append({
-                                "role": "tool",
-                                "tool_call_id": tool_call_id,
-                                "content": json.dumps({"refined_query": refined_query})
-                            })
-                    except Exception as e:
-                        logger.error(f"Error in refine_query tool call {tool_call_id}: {e}")
-                        tool_call_results.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call_id,
-                            "content": json.dumps({"error": str(e)})
-                        })
-                # ------------------  get relevant images tool is to be added-------------
-                elif tool_name == "get_data_from_excel":
-                    logger.debug(f"Processing get_data_from_excel tool call: {tool_call_id}")
-                    try:
-                        args = json.loads(tool_args_str)
-                        file_id = args.get("file_id")
-                        logger.debug(f"get_data_from_excel args: {args}")
-                        if not file_id:
-                            logger.error(f"get_data_from_excel missing file_id in args: {args}")
-                            raise ValueError("file_id is required")
-                        excel_data = get_data_from_excel(file_id)
-                        logger.debug(f"get_data_from_excel result: {excel_data}")
-                        if excel_data:
-                            tool_call_results.append({
-                                "role": "tool",
-                                "tool_call_id": tool_call_id,
-                                "content": json.dumps(excel_data)
-                            })
-                        else:
-                            logger.warning(f"No data found in Excel for file_id: {file_id}")
-                            tool_call_results.append({
-                                "role": "tool",
-                                "tool_call_id": tool_call_id,
-                                "content": json.dumps({"error": "No data found in Excel."})
-                            })
-                    except Exception as e:
-                        logger.error(f"Error in get_data_from_excel tool call {tool_call_id}: {e}")
-                        tool_call_results.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call_id,
-                            "content": json.dumps({"error": str(e)})
-                        })
-
-                elif tool_name == "order_tracking_with_order_id":
-                    logger.debug(f"Processing order_tracking_with_order_id tool_call: {tool_call_id}")
-                    try:
-                        args = json.loads(tool_args_str)
-                        order_number = args.get("order_id")
-                        logger.debug(f"order_number: {order_number}")
-                        shopify_config = Integrations.objects.filter(user=user, name='shopify', feature_name='order_tracking').first()
-                        prefix = shopify_config.details.get("prefix") if shopify_config and shopify_config.details else None
-                        suffix = shopify_config.details.get("suffix") if shopify_config and shopify_config.details else None
-                        order_id = remove_prefix_and_suffix(order_number=order_number, prefix=prefix, suffix=suffix)
-                        logger.debug(f"order_tracking_with_order_id args: {args}, order_id: {order_id}")
-
-                        if not order_id:
-                            logger.error(f"order_tracking_with_order_id missing order_id in args: {args}")
-                            raise ValueError("order_id is required")
-
-                        shopify = Integrations.objects.get(user=user, name='shopify', feature_name='order_tracking')
-                        client_api_key = user.api_key
-                        logger.info(f"client_api_key: {client_api_key}")
-                        email = user.email if user else None
-                        technology = get_integration_details(email, technology='shopify', api_key=client_api_key)
-
-                        shopify_domain = technology.get('api_domain')
-                        access_token = technology.get('access_token')
-                        logger.debug(f"shopify_domain: {shopify_domain}, access_token: {access_token}")
-                        shopify_id = get_order_id_by_name(order_number, shopify_domain, access_token)
-                        logger.debug(f"shopify_id: {shopify_id}")
-                        order_status = order_tracking_with_order_id(order_id=shopify_id, shopify_domain=shopify_domain, access_token=access_token)
-                        logger.debug(f"order_tracking_with_order_id result : {order_status}")
-                        if order_status:
-                            tool_call_results.append({
-                                "role": "tool",
-                                "tool_call_id": tool_call_id,
-                                "content": json.dumps(order_status)
-                            })
-                            logger.info(f" Order status for order_id {order_id} processed successfully.")
-                        else:
-                            logger.warning(f"No order status found for order : {order_id}")
-                            tool_call_results.append({
-                                "role": "tool",
-                                "tool_call_id": tool_call_id,
-                                "content": json.dumps({"error": "No order status found."})
-                            })
-                    except Exception as e:
-                        logger.error(f"Error in order_tracking_with_order_id tool call {tool_call_id}: {e}")
-                        tool_call_results.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call_id,
-                            "content": json.dumps({"error": str(e)})
-                        })
-
-                elif tool_name == "get_shopify_orders":
-                    logger.debug(f"Processing shopify_orders_with_customer_email tool_call: {tool_call_id}")
-                    shopify_config = Integrations.objects.filter(user=user, name='shopify', feature_name='list_orders').first()
-                    logger.info(f"shopify_config for list_orders : {shopify_config}")
-                    email = user.email
-                    logger.info(f"email: {email}")
-
-                    if not email:
-                        raise ValueError("User email is required.")
-
-                    shopify = Integrations.objects.get(user=user, name='shopify', feature_name='list_orders')
-                    if not shopify:
-                        raise ValueError("Shopify integration not found.")
-
-                    client_api_key = user.api_key
-                    technology = get_integration_details(email=email, technology='shopify', api_key=client_api_key)
-
-                    shopify_domain = technology.get("api_domain")
-                    access_token = technology.get("access_token")
-
-                    orders = get_shopify_orders(
-                        shopify_api_domain=shopify_domain,
-                        shopify_access_token=access_token,
-                        email=email
-                    )
-                    logger.info(f"orders associated with email: {orders}")
-                    if orders:
-                        tool_call_results.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call_id,
-                            "content": json.dumps(orders)
-                        })
-                    else:
-                        tool_call_results.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call_id,
-                            "content": json.dumps({"error": "No orders found."})
-                        })
-
-                elif tool_name == "return_processing":
-                    logger.info("tool for return called")
-                    logger.debug(f"Processing initiate_shopify_return tool_call: {tool_call_id}")
-
-                    shopify_config = Integrations.objects.filter(user=user, name='shopify', feature_name='return_processing').first()
-
-                    if not shopify_config:
-                        raise ValueError("Shopify integration for return processing not found.")
-                    args = json.loads(tool_args_str)
-                    order_name = args.get("order_name")
-                    return_reason = args.get("reason") or "OTHER"
-
-                    if not order_name:
-                        raise ValueError("Order name is required.")
-
-                    client_api_key = user.api_key
-                    email = user.email
-
-                    shopify = Integrations.objects.get(user=user, name='shopify', feature_name='return_processing')
-                    technology = get_integration_details(email=email, technology='shopify', api_key=client_api_key)
-                    shopify_domain = technology.get("api_domain")
-                    access_token = technology.get("access_token")
-
-                    logger.info(f"Initiating return for order: {order_name} | reason: {return_reason}")
-
-                    try:
-                        # Step 1: Get Order GID
-                        order_gid = get_order_id_by_name(order_name, shopify_domain, access_token, return_gid=True)
-                        if not order_gid:
-                            raise ValueError(f"Order not found for name {order_name}")
-
-                        # Step 2: Get fulfillment line item(s)
-                        fulfillment_line_items = get_fulfillment_line_items_by_order_id(order_gid, shopify_domain, access_token)
-                        if not fulfillment_line_items:
-                            raise ValueError(f"No fulfillment line items found for order {order_name}")
-
-                        # We'll assume return is for the first fulfilled item
-                        fulfillment_line_item = fulfillment_line_items[0]
-                        fulfillment_line_item_id = fulfillment_line_item["fulfillmentLineItemId"]
-
-                        # Step 3: Call return processing
-                        return_response = return_processing(
-                            shop_domain=shopify_domain,
-                            access_token=access_token,
-                            order_id=order_gid,
-                            fulfillment_line_item_id=fulfillment_line_item_id,
-                            quantity=1,
-                            return_reason=return_reason,
-                            notify_customer=True,
-                            restock=True
-                        )
-
-                        logger.info(f"Return processed successfully: {return_response}")
-                        tool_call_results.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call_id,
-                            "content": json.dumps({"success": True, "return": return_response})
-                        })
-
-                    except Exception as e:
-                        logger.exception("Error processing Shopify return")
-                        tool_call_results.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call_id,
-                            "content": json.dumps({"error": str(e)})
-                        })
-
-                elif tool_name == "get_product_recommendations":
-                    logger.info("Processing product_recommendation tool call")
-                    shopify_config = Integrations.objects.filter(user=user, name='shopify', feature_name='product_recommendation').first()
-
-                    if not shopify_config:
-                        raise ValueError("Shopify integration for return product recommendation not found.")
-                    args = json.loads(tool_args_str)
-                    query = args.get("query")
-                    logger.debug(f"get_product_recommendations args: {args}, query: {query}")
-                    email = user.email if user else None
-                    logger.debug(f" customer_email: {email}")
-
-                    shopify = Integrations.objects.filter(user=user, name='shopify', feature_name='product_recommendation')
-                    # logger.info(f"shopify integrations {shopify}")
-                    client_api_key = user.api_key
-                    logger.info(f"client_api_key: {client_api_key}")
-                    technology = get_integration_details(email, technology='shopify', api_key=client_api_key)
-
-                    shopify_domain = technology.get('api_domain')
-                    access_token = technology.get('access_token')
-
-                    # Load products data — replace this with actual data fetch logic
-                    products_data = fetch_all_products(shopify_domain=shopify_domain, access_token=access_token)
-                    logger.debug(f"Fetched products data: {len(products_data)}, type: {type(products_data)}")
-                    if not products_data:
-                        raise ValueError("No product data available")
-                    # history = user_history[-10] if user_history else ""
-                    # logger.debug(f"User history for product recommendation: {history}")
-                    recommendations = get_product_recommendation(products=products_data, query=query)
-                    logger.debug(f"Product recommendations: {recommendations}")
-                    if recommendations:
-                        logger.info(f"Product recommendations found: {len(recommendations)}")
-                        tool_call_results.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call_id,
-                            "content": json.dumps({"recommendations": recommendations})
-                        })
-                    else:
-                        logger.error(f"Error in product_recommendation tool call {tool_call_id}: No recommendations found.")
-                        tool_call_results.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call_id,
-                            "content": json.dumps({"error": "No recommendations found."})
-                        })
-
-            else:
-                logger.warning(f"Unhandled tool call: id={tool_call_id}, name={tool_name}")
-                tool_call_results.append({
-                    "role": "tool",
-                    "tool_call_id": tool_call_id,
-                    "content": json.dumps({"error": f"Tool '{tool_name}' not implemented."})
-                })
-
-            logger.debug(f"process_tool_calls returning {len(tool_call_results)} results")
-            return tool_call_results
+    def process_tool_call(self, tool_call, registry, user, messages):
+        """Process one tool call and return its results"""
+        logger.debug(f"Processing tool_call: {tool_call}")
+        return registry.dispatch(tool_call, ToolContext(user, messages))
 
     def make_openai_request(self, messages, config, system_prompt):
         """Make OpenAI API request"""
@@ -1277,16 +695,12 @@ class WhatsAppChatView(APIView):
         rag_context = ""
         if config.knowledge_base:
             try:
-                kb = KnowledgeBase.objects.get(uuid=config.knowledge_base.uuid)
+                kb = config.knowledge_base
                 logger.info(f"WhatsAppChatView: KnowledgeBase found with uuid={kb.uuid}")
-                retrieval_method = kb.retrieval_method or 'dense'
-                pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-                index = pc.Index(os.getenv("PINECONE_INDEX"))
                 user_query = messages[-1]["content"] if messages else ""
-                result = retrieve(user_query, str(config.knowledge_base.uuid), index, k=2, retrieval_method=retrieval_method)
-                if result and "matches" in result:
-                    contexts = [match["metadata"].get("context", "") for match in result["matches"]]
-                    rag_context = "\n".join(contexts)
+                result = retrieve_for_knowledge_base(user_query, kb)
+                contexts = [match["metadata"].get("context", "") for match in result["matches"]]
+                rag_context = "\n".join(contexts)
             except Exception as e:
                 logger.error(f"RAG retrieval failed: {e}")
                 rag_context = ""
@@ -1378,7 +792,9 @@ class WhatsAppChatView(APIView):
                             })
 
                             # Process tool calls
-                            tool_call_results = self.process_tool_calls(tool_calls=list(current_tool_calls.values()), messages=messages)
+                            tool_call_results = self.process_tool_calls(
+                                tool_calls=list(current_tool_calls.values()), messages=messages, agent_uuid=config.assistant_uuid
+                            )
                             messages.extend(tool_call_results)
                             logger.debug(f"Tool call results processed, updated messages: {len(messages)} total messages")
 
@@ -1437,7 +853,9 @@ class WhatsAppChatView(APIView):
                     })
 
                     # Process tool calls
-                    tool_call_results = self.process_tool_calls(tool_calls=message.tool_calls, messages=messages)
+                    tool_call_results = self.process_tool_calls(
+                        tool_calls=message.tool_calls, messages=messages, agent_uuid=config.assistant_uuid
+                    )
                     logger.debug(f"Tool call results processed, updating messages with {len(tool_call_results)} results")
                     messages.extend(tool_call_results)
                     logger.debug(f"Final messages after tool call processing: {len(messages)} total messages")
@@ -1507,14 +925,13 @@ def generate_test_suite(request):
         "extensive": "Extensive: Generate a comprehensive set (52) of questions, including rare and complex cases."
     }
     mode_description = mode_descriptions.get(mode, "")
-    test_suite_prompt = GENERATE_TEST_SUITE_PROMPT
     context = {
         "mode_description": mode_description,
         "count": count,
         "final_prompt": final_prompt
     }
 
-    prompt = Template(test_suite_prompt).render(**context).strip()
+    prompt = TEST_SUITE_TEMPLATE.render(**context).strip()
     try:
         completion = client.chat.completions.create(
             model=TEST_GENERATION_MODEL,
@@ -1719,6 +1136,10 @@ class WebsiteLinkUpdateDeleteView(APIView):
     def delete(self, request, pk):
         logger.debug(f"WebsiteLinkUpdateDeleteView DELETE called for pk={pk}")
         link = get_object_or_404(WebsiteLink, pk=pk)
+        try:
+            delete_source_vectors(link)
+        except Exception as e:
+            logger.error(f"Error deleting Pinecone chunks for link {pk}: {e}")
         link.delete()
         logger.info(f"Link deleted for pk={pk}")
         return Response(status=204)
@@ -1738,6 +1159,10 @@ class KnowledgeFileDeleteView(APIView):
 
     def delete(self, request, pk):
         file = get_object_or_404(KnowledgeFile, pk=pk)
+        try:
+            delete_source_vectors(file)
+        except Exception as e:
+            logger.error(f"Error deleting Pinecone chunks for file {pk}: {e}")
         file.delete()
         return Response(status=204)
 
@@ -1756,8 +1181,12 @@ class KnowledgeExcelDeleteView(APIView):
 
     def delete(self, request, pk):
         file = get_object_or_404(KnowledgeExcel, pk=pk)
+        try:
+            delete_source_vectors(file)
+        except Exception as e:
+            logger.error(f"Error deleting Pinecone chunks for file {pk}: {e}")
         file.delete()
-        return Response(status - 204)
+        return Response(status=204)
 
 
 class IndexDocumentsAPIView(APIView):
@@ -1767,6 +1196,10 @@ class IndexDocumentsAPIView(APIView):
         kb_uuid = request.data.get("kb_id")
         if not kb_uuid:
             return Response({"error": "kb_id is required"}, status=400)
+        running_task_id = cache.get(get_index_lock_key(kb_uuid))
+        if running_task_id:
+            # Poll the job already indexing this knowledge base instead of queueing one that would be skipped
+            return Response({"status": "Indexing already in progress", "task_id": running_task_id})
         # Start background indexing task
         task = index_knowledge_base_task.delay(kb_uuid)
         return Response(
@@ -1864,12 +1297,15 @@ def get_task_status(request, task_id):
         request (): _http request object containing the task_id in GET parameters.
         task_id (str): ID of the Celery task to check.
     Returns:
-        Response: Response object containing the task status and result if available.
+        Response: Response object containing the task status and result if available, and the progress
+            (sources done, chunks embedded and upserted, ETA) of a running indexing job.
     """
     result = AsyncResult(task_id)
     status = result.status
     response = {"task_id": task_id, "status": status}
-    if status == "SUCCESS":
+    if status == "PROGRESS":
+        response["progress"] = result.info
+    elif status == "SUCCESS":
         response["result"] = result.result
     elif status == "FAILURE":
         response["error"] = str(result.result)
@@ -0,0 +1,228 @@
+import os
+import re
+from typing import Callable, Iterable, Iterator, List
+import numpy as np
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter, TokenTextSplitter
+from backend.settings import logger
+
+
+SEMANTIC_CHUNKING_ENCODER = os.getenv("SEMANTIC_CHUNKING_ENCODER", "openai")  # "openai" or "tfidf"
+SEMANTIC_BREAKPOINT_PERCENTILE = 95
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+
+
+def build_token_splitter(chunk_size: int, chunk_overlap: int) -> TextSplitter:
+    """
+    Token splitter with the gpt2 tokenizer. tiktoken downloads the tokenizer on first use; if it cannot be loaded
+    (e.g. offline), falls back to splitting on a 4-characters-per-token estimate.
+    """
+    try:
+        return TokenTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable, splitting on estimated token counts: {e}")
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=lambda text: len(text) // 4 + 1
+        )
+
+
+def fits_chunk(text: str, chunk_size: int) -> bool:
+    """
+    True if `text` certainly fits in `chunk_size` tokens: a BPE token covers at least one byte.
+    """
+    return len(text.encode("utf-8")) <= chunk_size
+
+
+def openai_sentence_encoder(sentences: List[str]) -> list:
+    """
+    Embeds sentences with the indexing embedding model, in batches and through the embedding cache.
+    Sentences that later become single-sentence chunks therefore reuse their vector when the chunk is embedded.
+    """
+    from .indexing import EMBEDDING_BATCH_SIZE, get_dense_vectors
+    vectors = []
+    for start in range(0, len(sentences), EMBEDDING_BATCH_SIZE):
+        vectors.extend(get_dense_vectors(sentences[start:start + EMBEDDING_BATCH_SIZE]))
+    return vectors
+
+
+def tfidf_sentence_encoder(sentences: List[str]):
+    """
+    Offline sentence encoder: L2-normalized TF-IDF vectors fitted on the sentences of one document.
+    """
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    return TfidfVectorizer().fit_transform(sentences)
+
+
+SENTENCE_ENCODERS = {
+    "openai": openai_sentence_encoder,
+    "tfidf": tfidf_sentence_encoder,
+}
+
+
+def consecutive_distances(vectors) -> np.ndarray:
+    """
+    Cosine distance between each sentence vector and the next; accepts a dense list/array or a sparse matrix.
+    """
+    if hasattr(vectors, "multiply"):
+        similarities = np.asarray(vectors[:-1].multiply(vectors[1:]).sum(axis=1)).ravel()
+    else:
+        matrix = np.asarray(vectors, dtype=float)
+        norms = np.linalg.norm(matrix, axis=1)
+        norms[norms == 0] = 1.0
+        matrix = matrix / norms[:, None]
+        similarities = np.einsum("ij,ij->i", matrix[:-1], matrix[1:])
+    return 1.0 - similarities
+
+
+class SemanticSplitter:
+    """
+    Splits text where the meaning shifts: sentences are embedded in batches, and a chunk boundary is placed wherever
+    the distance between consecutive sentences exceeds the `breakpoint_percentile` of all such distances.
+    Groups that may be longer than `chunk_size` tokens are split further by the token splitter, which is only
+    built when such a group occurs.
+    """
+
+    def __init__(
+        self,
+        encoder: Callable[[List[str]], list],
+        get_token_splitter: Callable[[], TextSplitter],
+        chunk_size: int,
+        breakpoint_percentile: float = SEMANTIC_BREAKPOINT_PERCENTILE
+    ):
+        self.encoder = encoder
+        self.get_token_splitter = get_token_splitter
+        self.chunk_size = chunk_size
+        self.breakpoint_percentile = breakpoint_percentile
+
+    def split_group(self, text: str) -> List[str]:
+        # The tokenizer is only loaded for groups that may exceed the chunk size
+        if fits_chunk(text, self.chunk_size):
+            return [text] if text.strip() else []
+        return self.get_token_splitter().split_text(text)
+
+    def split_text(self, text: str) -> List[str]:
+        sentences = split_sentences(text)
+        if len(sentences) < 3:
+            return self.split_group(" ".join(sentences)) if sentences else []
+        try:
+            distances = consecutive_distances(self.encoder(sentences))
+        except Exception as e:
+            logger.warning(f"Semantic chunking failed, falling back to token splitting: {e}")
+            return self.split_group(text)
+        threshold = np.percentile(distances, self.breakpoint_percentile)
+        groups = []
+        current = [sentences[0]]
+        for sentence, distance in zip(sentences[1:], distances):
+            if distance > threshold:
+                groups.append(" ".join(current))
+                current = []
+            current.append(sentence)
+        groups.append(" ".join(current))
+        chunks = []
+        for group in groups:
+            chunks.extend(self.split_group(group))
+        return chunks
+
+
+class ChunkingEngine:
+    """
+    Splits documents into chunks for indexing.
+    Built once per indexing job with the knowledge base's chunk_size/chunk_overlap; the token splitter (and its
+    tokenizer) and the semantic splitter are created on first use, then reused for every document. Semantic
+    splitting with the "tfidf" encoder only loads the tokenizer for oversized sentence groups.
+    With semantic=True, `semantic_encoder` picks the sentence encoder: "openai" (cached, batched embeddings)
+    or "tfidf" (offline).
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 50,
+        semantic: bool = False,
+        semantic_encoder: str = SEMANTIC_CHUNKING_ENCODER
+    ):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.semantic = semantic
+        self.semantic_encoder = semantic_encoder
+        self._token_splitter = None
+        self._semantic_splitter = None
+
+    @property
+    def token_splitter(self) -> TextSplitter:
+        if self._token_splitter is None:
+            self._token_splitter = build_token_splitter(self.chunk_size, self.chunk_overlap)
+        return self._token_splitter
+
+    @property
+    def semantic_splitter(self) -> SemanticSplitter:
+        if self._semantic_splitter is None:
+            self._semantic_splitter = SemanticSplitter(
+                SENTENCE_ENCODERS[self.semantic_encoder],
+                lambda: self.token_splitter,
+                self.chunk_size
+            )
+            logger.info(f"Using semantic splitting with the {self.semantic_encoder} sentence encoder")
+        return self._semantic_splitter
+
+    def split(self, document: Document, pdf_local: bool = False) -> List[Document]:
+        """
+        Splits one document into chunk Documents carrying its source and page metadata.
+        Args:
+            document (Document): The document to be split.
+            pdf_local (bool): If True, the source metadata is reduced to its file name.
+        Returns:
+            List[Document]: The chunks of the document.
+        """
+        splitter = self.semantic_splitter if self.semantic else self.token_splitter
+        source = document.metadata["source"]
+        metadata = {
+            "source": source.split("/")[-1] if pdf_local else source,
+            "page": document.metadata.get("page", None),
+        }
+        chunks = [Document(page_content=text, metadata=dict(metadata)) for text in splitter.split_text(document.page_content)]
+        logger.debug(f"Split {source} page {metadata['page']} into {len(chunks)} chunks")
+        return chunks
+
+    def chunk_documents(self, documents: Iterable[Document], pdf_local: bool = False) -> Iterator[Document]:
+        """
+        Lazily splits a stream of documents, yielding chunks as each document is split.
+        """
+        for document in documents:
+            yield from self.split(document, pdf_local=pdf_local)
+
+
+def chunk_splitter(
+    document: Document,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 50,
+    pdf_local: bool = False,
+    semantic: bool = False,
+    semantic_encoder: str = SEMANTIC_CHUNKING_ENCODER
+) -> List[Document]:
+    """
+    Splits a single document into chunks with a one-off ChunkingEngine.
+    Indexing jobs should build one ChunkingEngine and reuse it instead.
+    Args:
+        document (Document): The document to be split.
+        chunk_size (int): The size of each chunk.
+        chunk_overlap (int): The overlap between chunks.
+        pdf_local (bool): If True, indicates the document is a local PDF.
+        semantic (bool): If True, splits on semantic breakpoints between sentences.
+        semantic_encoder (str): Sentence encoder for semantic splitting ("openai" or "tfidf").
+    Returns:
+        List[Document]: A list of Document objects representing the chunks.
+    """
+    engine = ChunkingEngine(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        semantic=semantic,
+        semantic_encoder=semantic_encoder
+    )
+    return engine.split(document, pdf_local=pdf_local)
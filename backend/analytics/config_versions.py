@@ -0,0 +1,37 @@
+from typing import Optional
+from .version_counters import bump_version_counter, get_version_counters
+from backend.settings import logger
+
+
+def config_version_key(scope: str, identifier) -> str:
+    return f"config_version:{scope}:{identifier}"
+
+
+def get_config_versions(*scopes) -> Optional[tuple]:
+    """
+    Returns the versions of (scope, identifier) pairs, e.g. get_config_versions(("agent", uuid), ("user", 1)),
+    read with one cache round trip, or None if the cache is unreachable.
+    Anything derived from an agent's configuration is cached under the versions of the scopes it depends on:
+    "agent" (the AssistantConfiguration, its knowledge base and data files) and "user" (the user, their tools and
+    integrations). The counters are kept like the retrieval versions (see version_counters).
+    """
+    keys = [config_version_key(scope, identifier) for scope, identifier in scopes]
+    try:
+        return get_version_counters(keys)
+    except Exception as e:
+        logger.warning(f"Failed to read config versions {keys}: {e}")
+        return None
+
+
+def bump_config_version(scope: str, identifier) -> None:
+    """
+    Invalidates everything cached under a scope's version. Errors are logged and never interrupt the write
+    that triggered the bump.
+    """
+    if identifier is None:
+        return
+    key = config_version_key(scope, identifier)
+    try:
+        bump_version_counter(key)
+    except Exception as e:
+        logger.warning(f"Failed to bump config version {key}: {e}")
@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from urllib.parse import urlparse, urljoin
+import linkGrabber
+from .models import WebsiteLink
+from backend.settings import logger
+
+
+CRAWLER_WORKERS = int(os.getenv("CRAWLER_WORKERS", 8))
+CRAWLER_HOST_DELAY = float(os.getenv("CRAWLER_HOST_DELAY", 0.5))  # Seconds between request starts to one host
+CRAWLER_HOST_CONCURRENCY = int(os.getenv("CRAWLER_HOST_CONCURRENCY", 2))
+
+
+def grab_links_from_website(root_url):
+    """
+    Grabs all links from a given website URL that match the same domain and scheme.
+    Args:
+        root_url (str): The root URL of the website to scrape.
+    Returns:
+        list: A list of unique links found on the website that match the same domain and scheme.
+    """
+    logger.info(f"grab_links_from_website started for {root_url}")
+    logger.debug(f"grab_links_from_website called with root_url={root_url}")
+    parsed_root = urlparse(root_url)
+    root_scheme = parsed_root.scheme
+    root_domain = parsed_root.netloc
+
+    links = linkGrabber.Links(root_url)
+    found_links = links.find(duplicates=False, pretty=True)
+    logger.info(f"Found {len(found_links)} links on {root_url}")
+
+    domain_links = set()
+    for link in found_links:
+        href = link.get("href")
+        if not href:
+            continue
+
+        # Make relative links absolute
+        abs_url = urljoin(root_url, href)
+        parsed_href = urlparse(abs_url)
+
+        # Restrict to same domain and scheme
+        if parsed_href.netloc == root_domain and parsed_href.scheme == root_scheme:
+            clean_url = parsed_href.scheme + "://" + parsed_href.netloc + parsed_href.path
+            clean_url = clean_url.rstrip("/")  # Remove trailing slash
+            domain_links.add(clean_url)
+
+    logger.info(f"Returning {len(domain_links)} domain links for {root_url}")
+    logger.info(f"grab_links_from_website finished for {root_url}")
+    return list(domain_links)
+
+
+class HostRateLimiter:
+    """
+    Per-host politeness for the crawler: at most `concurrency` requests in flight to one host,
+    and request starts to the same host spaced at least `delay` seconds apart.
+    """
+
+    def __init__(self, delay: float = CRAWLER_HOST_DELAY, concurrency: int = CRAWLER_HOST_CONCURRENCY):
+        self.delay = delay
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self._next_start = {}
+        self._semaphores = {}
+
+    @contextmanager
+    def slot(self, url: str):
+        host = urlparse(url).netloc
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.Semaphore(self.concurrency))
+        semaphore.acquire()
+        try:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start.get(host, now))
+                self._next_start[host] = start + self.delay
+            if start > now:
+                time.sleep(start - now)
+            yield
+        finally:
+            semaphore.release()
+
+
+class LinkCrawler:
+    """
+    Crawls the website links of a knowledge base breadth-first with a bounded worker pool.
+    The frontier is persisted as WebsiteLink rows: links with grabber enabled that are not yet crawled or indexed
+    and sit above the knowledge base's crawl_max_depth. A run processes the frontier in batches; after each batch
+    the discovered links are inserted with bulk_create and the fetched links flagged as crawled, so an interrupted
+    run resumes where it stopped. No more than crawl_max_pages grabbed links are ever added to the knowledge base.
+    """
+
+    def __init__(
+        self,
+        kb,
+        fetch_links=grab_links_from_website,
+        max_workers: int = CRAWLER_WORKERS,
+        rate_limiter: HostRateLimiter = None
+    ):
+        self.kb = kb
+        self.fetch_links = fetch_links
+        self.max_workers = max_workers
+        self.rate_limiter = rate_limiter or HostRateLimiter()
+        self.batch_size = max_workers * 4
+        self.crawled = 0
+        self.discovered = 0
+
+    def frontier(self):
+        return WebsiteLink.objects.filter(
+            knowledge_base=self.kb,
+            grabber_enabled=True,
+            crawled=False,
+            indexed=False,
+            crawl_depth__lt=self.kb.crawl_max_depth
+        ).order_by("crawl_depth", "id")
+
+    def run(self) -> dict:
+        """
+        Crawls until the frontier is empty or the page budget is spent.
+        Returns:
+            dict: The number of links crawled and discovered in this run.
+        """
+        known = set(WebsiteLink.objects.filter(knowledge_base=self.kb).values_list("url", flat=True))
+        budget = self.kb.crawl_max_pages - WebsiteLink.objects.filter(knowledge_base=self.kb, grabbed=True).count()
+        logger.info(f"Crawling links for KB {self.kb.uuid}: {len(known)} known links, page budget {budget}")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while budget > 0:
+                batch = list(self.frontier()[:self.batch_size])
+                if not batch:
+                    break
+                futures = {executor.submit(self._fetch, link.url): link for link in batch}
+                new_links = []
+                for future in as_completed(futures):
+                    link = futures[future]
+                    for url in future.result():
+                        if url in known or budget <= 0:
+                            continue
+                        known.add(url)
+                        budget -= 1
+                        new_links.append(WebsiteLink(
+                            knowledge_base=self.kb,
+                            url=url,
+                            grabbed=True,
+                            indexed=False,
+                            grabber_enabled=True,
+                            crawl_depth=link.crawl_depth + 1,
+                        ))
+                WebsiteLink.objects.bulk_create(new_links, ignore_conflicts=True)
+                WebsiteLink.objects.filter(id__in=[link.id for link in batch]).update(crawled=True)
+                self.crawled += len(batch)
+                self.discovered += len(new_links)
+                logger.info(f"Crawled {len(batch)} links for KB {self.kb.uuid}, discovered {len(new_links)}")
+        summary = {"crawled": self.crawled, "discovered": self.discovered}
+        logger.info(f"Crawl finished for KB {self.kb.uuid}: {summary}")
+        return summary
+
+    def _fetch(self, url: str) -> list:
+        try:
+            with self.rate_limiter.slot(url):
+                return self.fetch_links(url)
+        except Exception as e:
+            logger.warning(f"Failed to grab links from {url}: {str(e)}")
+            return []
@@ -0,0 +1,256 @@
+import os
+import re
+import time
+import hashlib
+from typing import List, Optional
+import numpy as np
+from django.core.cache import cache
+from backend.settings import logger
+
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() != "false"
+DEDUP_SHINGLE_SIZE = 5  # Words per shingle
+DEDUP_NUM_PERMUTATIONS = 64
+DEDUP_BANDS = 16  # LSH bands of DEDUP_NUM_PERMUTATIONS / DEDUP_BANDS rows each
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", 0.85))  # Estimated Jaccard similarity of a near-duplicate
+BOILERPLATE_MIN_PAGES = int(os.getenv("BOILERPLATE_MIN_PAGES", 3))
+BOILERPLATE_MAX_LINES = 5000
+BOILERPLATE_TTL = 30 * 24 * 3600  # 30 days
+BOILERPLATE_COUNT_TTL = 24 * 3600  # Seconds the per-line page counts of a namespace are kept
+BOILERPLATE_LOCK_TIMEOUT = 30  # Seconds a save() may hold the merge lock of a namespace
+DEDUP_STATE_TTL = 30 * 24 * 3600  # Seconds the shared LSH index of a namespace is kept
+MERSENNE_PRIME = (1 << 31) - 1
+WORD = re.compile(r"\w+")
+
+_rng = np.random.default_rng(20240601)
+_PERM_A = _rng.integers(1, MERSENNE_PRIME, size=DEDUP_NUM_PERMUTATIONS, dtype=np.int64)
+_PERM_B = _rng.integers(0, MERSENNE_PRIME, size=DEDUP_NUM_PERMUTATIONS, dtype=np.int64)
+
+
+def shingles(text: str, size: int = DEDUP_SHINGLE_SIZE) -> set:
+    """
+    Word shingles of a text, lower-cased and stripped of punctuation. Texts shorter than `size` words form one shingle.
+    """
+    words = WORD.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """
+    MinHash signature of a text's shingles under DEDUP_NUM_PERMUTATIONS universal hash functions.
+    """
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles(text)),
+        dtype=np.int64
+    ) % MERSENNE_PRIME
+    if not hashes.size:
+        return np.full(DEDUP_NUM_PERMUTATIONS, MERSENNE_PRIME, dtype=np.int64)
+    return ((_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % MERSENNE_PRIME).min(axis=1)
+
+
+def line_digest(line: str) -> Optional[str]:
+    """
+    Digest of a line for boilerplate counting; None for lines without words (blank lines, table rules, ...).
+    """
+    words = WORD.findall(line.lower())
+    if not words:
+        return None
+    return hashlib.sha1(" ".join(words).encode("utf-8")).hexdigest()[:16]
+
+
+def dedup_key(namespace: str, kind: str, name: str) -> str:
+    return f"dedup:{namespace}:{kind}:{name}"
+
+
+def forget_chunks(namespace: str, chunk_ids: List[str]) -> None:
+    """
+    Removes chunks from the shared LSH index of a namespace, e.g. once their vectors are deleted, so no later
+    chunk is recorded as a reference to them. Index entries without a signature are ignored and reclaimed.
+    """
+    if not chunk_ids:
+        return
+    try:
+        cache.delete_many([dedup_key(namespace, "signature", chunk_id) for chunk_id in chunk_ids])
+    except Exception as e:
+        logger.warning(f"Failed to forget {len(chunk_ids)} dedup signatures of {namespace}: {e}")
+
+
+class ChunkDeduplicator:
+    """
+    Pre-embedding dedup stage of a knowledge base namespace. Each index_knowledge_sources subtask builds its
+    own, but the state lives in the Django cache (Redis) per namespace, so subtasks of a job, and later jobs,
+    see each other's pages and chunks.
+
+    strip_boilerplate() removes lines that recur on at least BOILERPLATE_MIN_PAGES pages (navigation, footers,
+    legal text). Each line has a page counter incremented atomically once per page, and each page records the
+    lines it was counted for, so re-indexing a page never counts it twice. Lines found to be boilerplate are
+    kept per namespace for BOILERPLATE_TTL; save() merges them with the lines stored by concurrent subtasks.
+
+    match() detects near-duplicate chunks with MinHash signatures and LSH banding: a chunk whose estimated Jaccard
+    similarity to an already registered chunk reaches DEDUP_THRESHOLD is reported as a reference to that chunk
+    instead of being embedded. `saved` counts the chunks that were not embedded.
+    The LSH index is one cache key per band bucket (and per exact text) pointing to the first chunk registered in
+    it, claimed with cache.add() so concurrent subtasks never overwrite each other, plus one signature key per
+    chunk. forget_chunks() drops the signatures of deleted chunks; a bucket pointing to a forgotten chunk is
+    claimed by the next chunk registered in it. Cache errors are logged and the chunk is embedded.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        threshold: float = DEDUP_THRESHOLD,
+        min_pages: int = BOILERPLATE_MIN_PAGES,
+        enabled: bool = DEDUP_ENABLED
+    ):
+        self.namespace = namespace
+        self.threshold = threshold
+        self.min_pages = min_pages
+        self.enabled = enabled
+        self.saved = 0
+        self.stripped_lines = 0
+        self._rows = DEDUP_NUM_PERMUTATIONS // DEDUP_BANDS
+        self.boilerplate = set()
+        if enabled:
+            try:
+                self.boilerplate = set(cache.get(self.boilerplate_key) or [])
+            except Exception as e:
+                logger.warning(f"Failed to load boilerplate lines for {namespace}: {e}")
+
+    @property
+    def boilerplate_key(self) -> str:
+        return f"boilerplate:{self.namespace}"
+
+    def strip_boilerplate(self, text: str, page: str = None) -> str:
+        """
+        Counts the lines of a page and returns the page without its boilerplate lines.
+        `page` identifies the page, e.g. its URL; by default pages are identified by their text.
+        """
+        if not self.enabled:
+            return text
+        lines = text.splitlines()
+        digests = [line_digest(line) for line in lines]
+        self._count_page(set(digests) - {None}, page if page is not None else text)
+        kept = [line for line, digest in zip(lines, digests) if digest is None or digest not in self.boilerplate]
+        self.stripped_lines += len(lines) - len(kept)
+        return "\n".join(kept)
+
+    def register(self, text: str, chunk_id: str) -> None:
+        """
+        Registers a chunk that has (or will have) its own vector, so later chunks can reference it.
+        """
+        if not self.enabled:
+            return
+        normalized = " ".join(text.split())
+        signature = minhash_signature(text)
+        try:
+            keys = self._index_keys(normalized, signature)
+            pointers = cache.get_many(keys)
+            self._register(keys, pointers, self._load_signatures(pointers.values()), signature, chunk_id)
+        except Exception as e:
+            logger.warning(f"Failed to register chunk {chunk_id} for dedup in {self.namespace}: {e}")
+
+    def match(self, text: str, chunk_id: str) -> Optional[str]:
+        """
+        Looks a new chunk up among the registered chunks of the namespace.
+        Returns:
+            str: The ID of the chunk it duplicates, or None if it is new, in which case it is registered as `chunk_id`.
+        """
+        if not self.enabled:
+            return None
+        normalized = " ".join(text.split())
+        signature = minhash_signature(text)
+        try:
+            keys = self._index_keys(normalized, signature)
+            pointers = cache.get_many(keys)
+            signatures = self._load_signatures(pointers.values())
+            # The exact-text key comes first, then the band buckets
+            candidates = dict.fromkeys(pointers[key] for key in keys if key in pointers)
+            for candidate in candidates:
+                if candidate == chunk_id or candidate not in signatures:
+                    continue
+                if np.mean(signatures[candidate] == signature) >= self.threshold:
+                    self.saved += 1
+                    return candidate
+            self._register(keys, pointers, signatures, signature, chunk_id)
+        except Exception as e:
+            logger.warning(f"Dedup lookup of chunk {chunk_id} failed in {self.namespace}: {e}")
+        return None
+
+    def save(self) -> None:
+        """
+        Stores the boilerplate lines of the namespace for later runs, merged with the lines already stored.
+        Concurrent subtasks merge one at a time under a lock in the cache, so none of their lines are lost.
+        """
+        if not self.enabled or not self.boilerplate:
+            return
+        lock_key = f"{self.boilerplate_key}:lock"
+        try:
+            deadline = time.monotonic() + BOILERPLATE_LOCK_TIMEOUT
+            while not cache.add(lock_key, 1, timeout=BOILERPLATE_LOCK_TIMEOUT):
+                if time.monotonic() > deadline:
+                    logger.warning(f"Timed out waiting to store boilerplate lines for {self.namespace}")
+                    return
+                time.sleep(0.05)
+            try:
+                stored = list(cache.get(self.boilerplate_key) or [])
+                known = set(stored)
+                merged = stored + [digest for digest in self.boilerplate if digest not in known]
+                cache.set(self.boilerplate_key, merged[:BOILERPLATE_MAX_LINES], timeout=BOILERPLATE_TTL)
+                self.boilerplate.update(stored)
+            finally:
+                cache.delete(lock_key)
+        except Exception as e:
+            logger.warning(f"Failed to store boilerplate lines for {self.namespace}: {e}")
+
+    def summary(self) -> dict:
+        return {"chunks_saved": self.saved, "boilerplate_lines_stripped": self.stripped_lines}
+
+    def _count_page(self, digests: set, page: str) -> None:
+        page_key = dedup_key(self.namespace, "page", hashlib.sha1(page.encode("utf-8")).hexdigest()[:16])
+        try:
+            counted = set(cache.get(page_key) or [])
+            line_keys = {digest: dedup_key(self.namespace, "line", digest) for digest in digests}
+            counts = cache.get_many([line_keys[digest] for digest in digests & counted])
+            for digest in digests - counted:
+                counts[line_keys[digest]] = self._increment(line_keys[digest])
+            cache.set(page_key, list(counted | digests), timeout=BOILERPLATE_COUNT_TTL)
+        except Exception as e:
+            logger.warning(f"Failed to count boilerplate lines for {self.namespace}: {e}")
+            return
+        self.boilerplate.update(digest for digest in digests if counts.get(line_keys[digest], 0) >= self.min_pages)
+
+    def _increment(self, key: str) -> int:
+        try:
+            return cache.incr(key)
+        except ValueError:
+            cache.add(key, 0, timeout=BOILERPLATE_COUNT_TTL)
+            return cache.incr(key)
+
+    def _index_keys(self, normalized: str, signature: np.ndarray) -> List[str]:
+        keys = [dedup_key(self.namespace, "exact", hashlib.sha1(normalized.encode("utf-8")).hexdigest())]
+        for band in range(DEDUP_BANDS):
+            rows = signature[band * self._rows:(band + 1) * self._rows].tobytes()
+            keys.append(dedup_key(self.namespace, f"band{band}", hashlib.sha1(rows).hexdigest()[:20]))
+        return keys
+
+    def _load_signatures(self, chunk_ids) -> dict:
+        chunk_ids = list(dict.fromkeys(chunk_ids))
+        if not chunk_ids:
+            return {}
+        stored = cache.get_many([dedup_key(self.namespace, "signature", chunk_id) for chunk_id in chunk_ids])
+        return {
+            chunk_id: np.frombuffer(stored[dedup_key(self.namespace, "signature", chunk_id)], dtype=np.int64)
+            for chunk_id in chunk_ids if dedup_key(self.namespace, "signature", chunk_id) in stored
+        }
+
+    def _register(self, keys: List[str], pointers: dict, signatures: dict, signature: np.ndarray, chunk_id: str) -> None:
+        # The signature goes first: an index entry whose signature is missing counts as forgotten
+        cache.set(dedup_key(self.namespace, "signature", chunk_id), signature.tobytes(), timeout=DEDUP_STATE_TTL)
+        for key in keys:
+            pointer = pointers.get(key)
+            if pointer is None:
+                cache.add(key, chunk_id, timeout=DEDUP_STATE_TTL)
+            elif pointer != chunk_id and pointer not in signatures:
+                cache.set(key, chunk_id, timeout=DEDUP_STATE_TTL)
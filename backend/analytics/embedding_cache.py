@@ -0,0 +1,119 @@
+import os
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List
+from django.core.cache import cache
+from backend.settings import logger
+
+
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 20000))
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", 30 * 24 * 3600))  # 30 days
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() != "false"
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for embeddings, keyed by (model, dimensions, sha256(text)).
+    The first tier is an in-process LRU bounded by `max_entries` and `ttl`; the second is the shared Django
+    cache (Redis), where entries expire after `ttl`. Redis errors are logged and treated as misses.
+    Hit and miss counts are kept per tier in `stats`.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        dimensions: int = 0,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+        ttl: int = EMBEDDING_CACHE_TTL,
+        enabled: bool = EMBEDDING_CACHE_ENABLED
+    ):
+        self.model = model
+        self.dimensions = dimensions
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self.stats = {"local_hits": 0, "remote_hits": 0, "misses": 0}
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"embedding:{self.model}:{self.dimensions}:{digest}"
+
+    def get_many(self, texts: List[str]) -> Dict[str, object]:
+        """
+        Looks texts up in the local tier, then the remaining ones in Redis.
+        Returns:
+            dict: Cached embeddings keyed by text; texts that missed both tiers are absent.
+        """
+        if not self.enabled or not texts:
+            return {}
+        found = {}
+        missing = {}
+        now = time.monotonic()
+        with self._lock:
+            for text in texts:
+                key = self.key(text)
+                entry = self._local.get(key)
+                if entry is not None and entry[0] > now:
+                    self._local.move_to_end(key)
+                    found[text] = entry[1]
+                    self.stats["local_hits"] += 1
+                else:
+                    if entry is not None:
+                        del self._local[key]
+                    missing[key] = text
+        if missing:
+            try:
+                remote = cache.get_many(list(missing))
+            except Exception as e:
+                logger.warning(f"Embedding cache lookup failed: {e}")
+                remote = {}
+            with self._lock:
+                for key, value in remote.items():
+                    found[missing[key]] = value
+                    self._store_local(key, value, now)
+                self.stats["remote_hits"] += len(remote)
+                self.stats["misses"] += len(missing) - len(remote)
+        return found
+
+    def set_many(self, embeddings: Dict[str, object]) -> None:
+        """
+        Stores embeddings keyed by text in both tiers.
+        """
+        if not self.enabled or not embeddings:
+            return
+        entries = {self.key(text): value for text, value in embeddings.items()}
+        now = time.monotonic()
+        with self._lock:
+            for key, value in entries.items():
+                self._store_local(key, value, now)
+        try:
+            cache.set_many(entries, timeout=self.ttl)
+        except Exception as e:
+            logger.warning(f"Embedding cache store failed: {e}")
+
+    def get_or_compute(self, texts: List[str], compute: Callable[[List[str]], list]) -> list:
+        """
+        Returns one embedding per text, calling `compute` once with the distinct texts that missed the cache.
+        """
+        found = self.get_many(texts)
+        missing = list(dict.fromkeys(text for text in texts if text not in found))
+        if missing:
+            computed = dict(zip(missing, compute(missing)))
+            self.set_many(computed)
+            found.update(computed)
+        logger.debug(f"Embedding cache {self.model}: {len(texts) - len(missing)} of {len(texts)} texts cached, stats {self.stats}")
+        return [found[text] for text in texts]
+
+    def clear_local(self) -> None:
+        with self._lock:
+            self._local.clear()
+
+    def _store_local(self, key: str, value, now: float) -> None:
+        self._local[key] = (now + self.ttl, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
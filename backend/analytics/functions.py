@@ -226,13 +226,14 @@ def user_tool_to_openai_tool(tool: UserTool):
     return result
 
 
-def execute_user_tool(tool_name, user, arguments):
-    """Find and execute a user tool by name for the given user and arguments dict, supporting all advanced features."""
+def execute_user_tool(tool_name, user, arguments, tool=None):
+    """Find and execute a user tool by name for the given user and arguments dict, supporting all advanced features.
+    A `tool` already loaded by the caller is used as is, saving the lookup query."""
     try:
         logger.info(f">>> Here called execute_user_tool with tool_name={tool_name}, user={user}, arguments={arguments}")
 
         # Find the tool
-        tool = UserTool.objects.filter(user=user, name=tool_name).first()
+        tool = tool or UserTool.objects.filter(user=user, name=tool_name).first()
         if not tool:
             logger.error(f"User tool '{tool_name}' not found for user {user}")
             return {"error": f"User tool '{tool_name}' not found."}
@@ -1,91 +1,160 @@
 import os
 import requests
 from typing import List
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
 from langchain_core.documents import Document
-from langchain_text_splitters import TokenTextSplitter
-from pinecone import Pinecone
-from langchain_openai import OpenAIEmbeddings
 import json
-from langchain_experimental.text_splitter import SemanticChunker
 from openai import OpenAI
 import pandas as pd
 import hashlib
 import time
-import uuid
-import tempfile
-import shutil
-try:
-    import boto3
-except ImportError:
-    boto3 = None
-from .models import (
-    WebsiteLink,
-    KnowledgeBase
+import random
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
+from .chunking import ChunkingEngine
+from .dedup import ChunkDeduplicator, forget_chunks
+from .embedding_cache import EmbeddingCache
+from .sparse import EMPTY_SPARSE_VECTOR, SparseEncoder, get_sparse_encoder
+from .retrieval_cache import bump_namespace_version
+from .ingest import download_to_tempfile, iter_document_pages, remove_tempfile
+from .vectorstore import (
+    VECTOR_STORE_BACKEND,
+    PineconeVectorStore,
+    VectorStore,
+    get_pinecone_index,
+    get_vector_store
 )
 from backend.settings import logger
 from dotenv import load_dotenv
+import tiktoken
 load_dotenv()
 
+EMBEDDING_MODEL = "text-embedding-3-large"
+EMBEDDING_DIMENSIONS = 1024
+# Upper bounds for one multi-input embeddings request
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", 200000))
+SPARSE_EMBEDDING_MODEL = os.getenv("SPARSE_EMBEDDINGS_MODEL", "splade")
+SPARSE_EMBEDDINGS_TIMEOUT = int(os.getenv("SPARSE_EMBEDDINGS_TIMEOUT", 30))
+# Pinecone accepts at most 1000 records and 2MB per upsert request
+PINECONE_UPSERT_BATCH_SIZE = int(os.getenv("PINECONE_UPSERT_BATCH_SIZE", 100))
+PINECONE_UPSERT_MAX_BYTES = int(os.getenv("PINECONE_UPSERT_MAX_BYTES", 2 * 1024 * 1024 - 64 * 1024))
+PINECONE_UPSERT_WORKERS = int(os.getenv("PINECONE_UPSERT_WORKERS", 4))
+SCRAPE_CONCURRENCY_PER_KB = int(os.getenv("SCRAPE_CONCURRENCY_PER_KB", 8))
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", 8))  # Threads overlapping query encodings and store queries
+RRF_K = 60  # Rank offset of reciprocal-rank fusion, 1 / (RRF_K + rank)
+RRF_CANDIDATES = int(os.getenv("RRF_CANDIDATES", 20))  # Matches fetched per list before reciprocal-rank fusion
+# Sparse weight of the sparse list of RRF retrieval; the small dense remainder keeps the query vector non-zero
+RRF_SPARSE_WEIGHTAGE = 0.99
+SUPPORTED_DOCUMENT_TYPES = (".pdf", ".txt", ".docx")
+LINK_FINGERPRINT_MAX_BYTES = 5 * 1024 * 1024
+LINK_VALIDATOR_FIELDS = ["etag", "last_modified", "content_length", "fingerprint"]
 
-def chunk_splitter(
-    document: Document,
-    embedding_model: str = "text-embedding-3-large",
-    chunk_size: int = 1000,
-    chunk_overlap: int = 50,
-    pdf_local: bool = False,
-    semantic: bool = False
-) -> List[Document]:
+_openai_client = None
+_token_encoding = None
+_http_session = None
+_retrieval_executor = None
+_retrieval_lock = threading.Lock()
+_scrape_semaphores = {}
+_scrape_lock = threading.Lock()
+dense_embedding_cache = EmbeddingCache(EMBEDDING_MODEL, EMBEDDING_DIMENSIONS)
+sparse_embedding_cache = EmbeddingCache(SPARSE_EMBEDDING_MODEL)
+
+
+def get_openai_client() -> OpenAI:
+    """
+    Returns a process-wide OpenAI client so embedding calls reuse one HTTP connection pool.
+    """
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _openai_client
+
+
+def get_http_session() -> requests.Session:
+    """
+    Returns a process-wide keep-alive session for scraping, with a connection pool sized for concurrent scrapes.
+    """
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=SCRAPE_CONCURRENCY_PER_KB * 2)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http_session = session
+    return _http_session
+
+
+def get_retrieval_executor() -> ThreadPoolExecutor:
+    """
+    Returns a process-wide thread pool for the concurrent parts of a retrieval, so queries don't pay for thread
+    start-up.
+    """
+    global _retrieval_executor
+    with _retrieval_lock:
+        if _retrieval_executor is None:
+            _retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+    return _retrieval_executor
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens of a text with the tokenizer used by the OpenAI embedding models.
+    Falls back to a 4-characters-per-token estimate if the tokenizer cannot be loaded.
     """
-    Splits a document into chunks using OpenAI embeddings and TokenTextSplitter.
-    Adjusts chunk size and overlap based on the provided parameters.
-    If semantic is True, uses SemanticChunker for chunking.
+    global _token_encoding
+    try:
+        if _token_encoding is None:
+            _token_encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_token_encoding.encode(text, disallowed_special=()))
+    except Exception:
+        return len(text) // 4 + 1
+
+
+def get_dense_vectors(texts: List[str]) -> List[list]:
+    """
+    Dense Vector Embeddings for a batch of texts, served from the embedding cache where possible.
+    Texts missing from the cache are embedded in a single OpenAI API request.
     Args:
-        document (Document): The document to be split.
-        embedding_model (str): The OpenAI model to use for embeddings.
-        chunk_size (int): The size of each chunk.
-        chunk_overlap (int): The overlap between chunks.
-        pdf_local (bool): If True, indicates the document is a local PDF.
-        semantic (bool): If True, uses SemanticChunker for chunking.
+        texts (List[str]): The input texts to generate embeddings for.
     Returns:
-        List[Document]: A list of Document objects representing the chunks.
+        List[list]: One 1024-dimensional dense vector per input text, in input order.
     """
-    logger.info(f"Starting chunk_splitter with chunk_size={chunk_size},")
-    logger.info(f"chunk_overlap={chunk_overlap}, pdf_local={pdf_local}, semantic={semantic}")
-    embeddings = OpenAIEmbeddings(
-        model=embedding_model,
-        openai_api_key=os.getenv("OPENAI_API_KEY")
-    )
+    if not texts:
+        return []
+    return dense_embedding_cache.get_or_compute(texts, request_dense_vectors)
 
-    logger.info("Embeddings created successfully for chunking")
-    text_splitter = TokenTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    logger.info("Using TokenTextSplitter for splitting")
 
-    if semantic:
-        text_splitter = SemanticChunker(
-            embeddings,
-            breakpoint_threshold_type="percentile"
+def request_dense_vectors(texts: List[str]) -> List[list]:
+    """
+    Dense Vector Embeddings for a batch of texts in a single OpenAI API request.
+    Uses the text-embedding-3-large model to generate 1024-dimensional embeddings.
+    Args:
+        texts (List[str]): The input texts to generate embeddings for.
+    Returns:
+        List[list]: One 1024-dimensional dense vector per input text, in input order.
+    Raises:
+        ValueError: If any generated embedding does not have 1024 dimensions.
+        Exception: If there is an error during the OpenAI API call.
+    """
+    if not texts:
+        return []
+    try:
+        logger.debug(f"Generating dense vector embeddings for {len(texts)} texts")
+        response = get_openai_client().embeddings.create(
+            input=texts,
+            model=EMBEDDING_MODEL,
+            dimensions=EMBEDDING_DIMENSIONS
         )
-        logger.info("Using Semantic Chunker for splitting")
-
-    chunks = text_splitter.split_text(document.page_content)
-    logger.info("Splitted Document into Chunks")
-    if pdf_local:
-        new_metadata = {
-            "source": document.metadata["source"].split("/")[-1],
-            "page": document.metadata.get("page", None),
-        }
-    else:
-        new_metadata = {
-            "source": document.metadata["source"],
-            "page": document.metadata.get("page", None),
-        }
-    chunk_documents = []
-    for chunk_text in chunks:
-        chunk_doc = Document(page_content=chunk_text, metadata=new_metadata)
-        chunk_documents.append(chunk_doc)
-    logger.info(f"Total Chunks created: {len(chunk_documents)}")
-    return chunk_documents
+        embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        for embedding in embeddings:
+            if len(embedding) != EMBEDDING_DIMENSIONS:
+                raise ValueError(f"Expected {EMBEDDING_DIMENSIONS} dimensions, but got {len(embedding)}")
+        logger.info(f"Successfully generated {len(embeddings)} dense vector embeddings")
+        return embeddings
+    except Exception as e:
+        logger.error(f"Error in request_dense_vectors: {str(e)}")
+        raise
 
 
 def get_dense_vector(text: str) -> list:
@@ -100,25 +169,38 @@ def get_dense_vector(text: str) -> list:
         ValueError: If the generated embeddings do not have 1024 dimensions.
         Exception: If there is an error during the OpenAI API call.
     """
-    try:
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        logger.debug(f"Generating dense vector embeddings for text: {text[:50]}...")
-        response = client.embeddings.create(
-            input=text,
-            model="text-embedding-3-large",
-            dimensions=1024
-        )
-        embeddings = response.data[0].embedding
-        if len(embeddings) != 1024:
-            raise ValueError(f"Expected 1024 dimensions, but got {len(embeddings)}")
-        logger.info("Successfully generated dense vector embeddings")
-        return embeddings
-    except Exception as e:
-        logger.error(f"Error in get_dense_vector: {str(e)}")
-        raise
+    logger.debug(f"Generating dense vector embeddings for text: {text[:50]}...")
+    return get_dense_vectors([text])[0]
+
+
+def normalize_sparse_vector(doc_sparse_vector) -> dict:
+    """
+    Ensures a sparse vector returned by the Sparse Embeddings API is a dict with 'indices' and 'values' keys.
+    """
+    if isinstance(doc_sparse_vector, list):
+        # Convert list to dict (example: treat as dense, use indices 0..n)
+        doc_sparse_vector = {"indices": list(range(len(doc_sparse_vector))), "values": doc_sparse_vector}
+    elif isinstance(doc_sparse_vector, dict):
+        # If already correct format, just return
+        if set(doc_sparse_vector.keys()) >= {"indices", "values"}:
+            return doc_sparse_vector
+        # If not, try to convert if possible
+        elif "values" in doc_sparse_vector and isinstance(doc_sparse_vector["values"], list):
+            doc_sparse_vector = {
+                "indices": list(range(len(doc_sparse_vector["values"]))),
+                "values": doc_sparse_vector["values"]
+            }
+    return doc_sparse_vector
 
 
 def get_sparse_vector(text: str) -> dict:
+    """
+    Sparse vector for a single text, served from the embedding cache where possible.
+    """
+    return sparse_embedding_cache.get_or_compute([text], lambda texts: [request_sparse_vector(texts[0])])[0]
+
+
+def request_sparse_vector(text: str) -> dict:
     """
     Splade Encoder using pinecone-text module for sparse vector retrieval.
     Uses the Sparse Embeddings API to generate sparse vectors.
@@ -131,39 +213,69 @@ def get_sparse_vector(text: str) -> dict:
         ValueError: If the response from the Sparse Embeddings API is not in the expected format.
     """
     url = os.getenv("SPARSE_EMBEDDINGS_API_URL")
-    response = requests.post(
+    response = get_http_session().post(
         url=url,
         data=json.dumps({"query": text}),
         headers={"Content-type": "application/json"},
+        timeout=SPARSE_EMBEDDINGS_TIMEOUT,
     )
     if response.ok:
-        doc_sparse_vector = response.json()
-        # Ensure the output is a dict with 'indices' and 'values' keys
-        if isinstance(doc_sparse_vector, list):
-            # Convert list to dict (example: treat as dense, use indices 0..n)
-            doc_sparse_vector = {"indices": list(range(len(doc_sparse_vector))), "values": doc_sparse_vector}
-        elif isinstance(doc_sparse_vector, dict):
-            # If already correct format, just return
-            if set(doc_sparse_vector.keys()) >= {"indices", "values"}:
-                return doc_sparse_vector
-            # If not, try to convert if possible
-            elif "values" in doc_sparse_vector and isinstance(doc_sparse_vector["values"], list):
-                doc_sparse_vector = {
-                    "indices": list(range(len(doc_sparse_vector["values"]))),
-                    "values": doc_sparse_vector["values"]
-                }
-        return doc_sparse_vector
+        return normalize_sparse_vector(response.json())
     else:
         logger.error(f"Error in get_sparse_vector {response.text}")
         raise Exception(f"Sparse vector API error: {response.text}")
 
 
-def encode(text: str, embedding_type: str = "hybrid"):
+def get_sparse_vectors(texts: List[str]) -> List[dict]:
+    """
+    Sparse vectors for a batch of texts, served from the embedding cache where possible.
+    Texts missing from the cache are encoded in a single Sparse Embeddings API request.
+    """
+    if not texts:
+        return []
+    return sparse_embedding_cache.get_or_compute(texts, request_sparse_vectors)
+
+
+def request_sparse_vectors(texts: List[str]) -> List[dict]:
+    """
+    Sparse vectors for a batch of texts in a single Sparse Embeddings API request.
+    The batch is sent as {"queries": [...]} and the service is expected to answer with one vector per text.
+    If the service rejects batched input, falls back to one request per text.
+    Args:
+        texts (List[str]): The input texts to generate sparse embeddings for.
+    Returns:
+        List[dict]: One sparse vector dict with 'indices' and 'values' keys per input text, in input order.
+    Raises:
+        Exception: If there is an error during the Sparse Embeddings API call.
+    """
+    if not texts:
+        return []
+    url = os.getenv("SPARSE_EMBEDDINGS_API_URL")
+    try:
+        response = get_http_session().post(
+            url=url,
+            data=json.dumps({"queries": texts}),
+            headers={"Content-type": "application/json"},
+            timeout=SPARSE_EMBEDDINGS_TIMEOUT,
+        )
+        if response.ok:
+            vectors = response.json()
+            if isinstance(vectors, list) and len(vectors) == len(texts):
+                return [normalize_sparse_vector(vector) for vector in vectors]
+        logger.warning(f"Sparse vector API did not accept a batch of {len(texts)} texts, falling back to single requests")
+    except requests.RequestException as e:
+        logger.warning(f"Batched sparse vector request failed, falling back to single requests: {e}")
+    return [request_sparse_vector(text) for text in texts]
+
+
+def encode(text: str, embedding_type: str = "hybrid", sparse_encoder: SparseEncoder = None, query: bool = False):
     """
     Encodes text into dense and sparse vectors based on the specified embedding type.
     Args:
         text (str): The input text to encode.
         embedding_type (str): The type of embedding to use ("dense", "hybrid").
+        sparse_encoder (SparseEncoder): Sparse encoder of the knowledge base; defaults to get_sparse_encoder().
+        query (bool): If True, the text is a query and is given query-side sparse weights.
     Returns:
         tuple: A tuple containing dense and sparse vectors.
     Raises:
@@ -174,15 +286,383 @@ def encode(text: str, embedding_type: str = "hybrid"):
         if embedding_type == "dense":
             logger.info("Using Dense Embeddings")
             dense_emb = get_dense_vector(text)
-            sparse_emb = {'indices': [0], 'values': [0.1]}
+            sparse_emb = EMPTY_SPARSE_VECTOR
         elif embedding_type == "hybrid":
             dense_emb = get_dense_vector(text)
-            sparse_emb = get_sparse_vector(text)
+            sparse_encoder = sparse_encoder or get_sparse_encoder(for_query=query)
+            if query:
+                sparse_emb = sparse_encoder.encode_queries([text])[0]
+            else:
+                sparse_emb = sparse_encoder.encode_documents([text])[0]
             logger.info("Returning dense_emb and sparse_emb for hybrid embedding type")
         return dense_emb, sparse_emb
     except Exception as e:
         logger.info(f"Error Occured as {e}")
-        return [], {'indices': [0], 'values': [0.1]}
+        return [], EMPTY_SPARSE_VECTOR
+
+
+def encode_batch(texts: List[str], embedding_type: str = "hybrid", sparse_encoder: SparseEncoder = None) -> List[tuple]:
+    """
+    Encodes a batch of texts into dense and sparse vectors with one request per embedding kind.
+    Args:
+        texts (List[str]): The input texts to encode.
+        embedding_type (str): The type of embedding to use ("dense", "hybrid").
+        sparse_encoder (SparseEncoder): Sparse encoder of the knowledge base; defaults to get_sparse_encoder().
+    Returns:
+        List[tuple]: One (dense, sparse) tuple per input text, in input order.
+        On failure every dense vector is empty, like encode().
+    """
+    try:
+        dense_embs = get_dense_vectors(texts)
+        if embedding_type == "hybrid":
+            sparse_embs = (sparse_encoder or get_sparse_encoder()).encode_documents(texts)
+        else:
+            sparse_embs = [EMPTY_SPARSE_VECTOR] * len(texts)
+        return list(zip(dense_embs, sparse_embs))
+    except Exception as e:
+        logger.error(f"Error in encode_batch for {len(texts)} texts: {e}")
+        return [([], EMPTY_SPARSE_VECTOR) for _ in texts]
+
+
+def build_vector_packet(
+    id: str,
+    chunk: Document,
+    dense_vec: list,
+    sparse_vec: dict,
+    doc_name: str = 'None',
+    doc_link: str = 'None'
+) -> dict:
+    """
+    Builds the Pinecone record for an embedded chunk.
+    """
+    return {
+        "id": id,
+        "values": dense_vec,
+        "sparse_values": sparse_vec,
+        "metadata": {
+            "context": chunk.page_content,
+            "doc_name": doc_name,
+            "doc_link": doc_link
+        },
+    }
+
+
+def estimate_vector_bytes(vector: dict) -> int:
+    """
+    Estimates the JSON payload size of a Pinecone record without serializing the dense values.
+    """
+    sparse = vector.get("sparse_values") or {}
+    return (
+        24 * len(vector.get("values") or [])
+        + 30 * len(sparse.get("indices") or [])
+        + len(json.dumps(vector.get("metadata") or {}))
+        + len(str(vector.get("id", "")))
+        + 64
+    )
+
+
+class VectorWriter:
+    """
+    Buffers vector records for one namespace and upserts them in bulk to a VectorStore.
+    A batch is flushed when it reaches `batch_size` records or `max_bytes` of estimated payload.
+    With `max_workers` > 1, up to that many batches are upserted concurrently on a thread pool.
+    Each batch's size, latency and error are recorded in `reports`; summary() aggregates them.
+    Callbacks registered with after_flush() run on the calling thread once every record written before them
+    has been upserted; they are dropped if any of those batches failed.
+    Upserted records are counted into `progress` (an IndexProgress) when one is given.
+    Every successful write bumps the namespace's retrieval version, invalidating its cached retrieval results.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        store: VectorStore = None,
+        batch_size: int = PINECONE_UPSERT_BATCH_SIZE,
+        max_bytes: int = PINECONE_UPSERT_MAX_BYTES,
+        max_workers: int = PINECONE_UPSERT_WORKERS,
+        progress=None
+    ):
+        self.namespace = namespace
+        self.progress = progress
+        self.store = store if store is not None else get_vector_store()
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.reports = []
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._sequence = 0
+        self._futures = {}
+        self._completed = {}
+        self._done_through = -1
+        self._first_failure = None
+        self._callbacks = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, vectors: List[dict]) -> None:
+        """
+        Adds records to the buffer, flushing whenever the size or byte limit would be exceeded.
+        """
+        for vector in vectors:
+            vector_bytes = estimate_vector_bytes(vector)
+            if self._buffer and (
+                len(self._buffer) >= self.batch_size
+                or self._buffer_bytes + vector_bytes > self.max_bytes
+            ):
+                self.flush()
+            self._buffer.append(vector)
+            self._buffer_bytes += vector_bytes
+        self._run_ready_callbacks()
+
+    def after_flush(self, callback) -> None:
+        """
+        Registers a callback to run once all records written so far have been upserted.
+        """
+        required = self._sequence if self._buffer else self._sequence - 1
+        self._callbacks.append((required, callback))
+        self._run_ready_callbacks()
+
+    def delete(self, ids: List[str]) -> None:
+        """
+        Deletes records by ID from the namespace.
+        """
+        try:
+            self.store.delete(ids, self.namespace)
+            bump_namespace_version(self.namespace)
+        except Exception as e:
+            logger.error(f"Delete of {len(ids)} vectors from namespace {self.namespace} failed: {e}")
+
+    def flush(self) -> None:
+        """
+        Upserts the buffered records as one batch, on the thread pool if one is configured.
+        """
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        batch_bytes, self._buffer_bytes = self._buffer_bytes, 0
+        sequence = self._sequence
+        self._sequence += 1
+        if self._executor is None:
+            self._completed[sequence] = self._upsert(sequence, batch, batch_bytes)
+        else:
+            self._futures[sequence] = self._executor.submit(self._upsert, sequence, batch, batch_bytes)
+        self._run_ready_callbacks()
+
+    def close(self) -> dict:
+        """
+        Flushes the buffer, waits for in-flight batches and shuts the thread pool down.
+        Returns:
+            dict: The summary() of all batches written.
+        """
+        self.flush()
+        for sequence, future in list(self._futures.items()):
+            self._completed[sequence] = future.result()
+        self._futures.clear()
+        self._run_ready_callbacks()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        summary = self.summary()
+        logger.info(f"VectorWriter closed for namespace {self.namespace}: {summary}")
+        return summary
+
+    def summary(self) -> dict:
+        """
+        Aggregates the per-batch reports.
+        """
+        latencies = [report["latency"] for report in self.reports]
+        failed = [report for report in self.reports if report["error"]]
+        return {
+            "batches": len(self.reports),
+            "vectors": sum(report["size"] for report in self.reports if not report["error"]),
+            "failed_batches": len(failed),
+            "failed_vectors": sum(report["size"] for report in failed),
+            "total_latency": round(sum(latencies), 3),
+            "max_latency": round(max(latencies), 3) if latencies else 0.0,
+        }
+
+    def _upsert(self, sequence: int, batch: List[dict], batch_bytes: int) -> bool:
+        start = time.perf_counter()
+        error = None
+        try:
+            self.store.upsert(batch, self.namespace)
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Upsert of batch {sequence} ({len(batch)} vectors) to namespace {self.namespace} failed: {e}")
+            forget_chunks(self.namespace, [record["id"] for record in batch])
+        latency = time.perf_counter() - start
+        self.reports.append({
+            "batch": sequence,
+            "size": len(batch),
+            "bytes": batch_bytes,
+            "latency": latency,
+            "error": error,
+        })
+        logger.info(f"Upserted batch {sequence} with {len(batch)} vectors (~{batch_bytes} bytes) in {latency:0.3f}s")
+        if error is None:
+            bump_namespace_version(self.namespace)
+            if self.progress is not None:
+                self.progress.add(chunks_upserted=len(batch))
+        return error is None
+
+    def _run_ready_callbacks(self) -> None:
+        for sequence, future in list(self._futures.items()):
+            if future.done():
+                self._completed[sequence] = future.result()
+                del self._futures[sequence]
+        while self._done_through + 1 in self._completed:
+            self._done_through += 1
+            if not self._completed[self._done_through] and self._first_failure is None:
+                self._first_failure = self._done_through
+        pending = []
+        for required, callback in self._callbacks:
+            if required > self._done_through:
+                pending.append((required, callback))
+            elif self._first_failure is not None and self._first_failure <= required:
+                logger.warning(f"Skipping flush callback because batch {self._first_failure} failed to upsert")
+            else:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Error in VectorWriter flush callback: {e}")
+        self._callbacks = pending
+
+
+class EmbeddingBatcher:
+    """
+    Embedding stage of the indexing pipeline.
+    Chunks are collected with add() and embedded in batches bounded by EMBEDDING_BATCH_SIZE chunks and
+    EMBEDDING_BATCH_MAX_TOKENS tokens, so each batch costs one dense (and one sparse) embeddings request.
+    Embedded records are handed to `writer` as a list, one call per batch. The writer is either a callable or
+    an object with a write() method such as VectorWriter.
+    Callbacks registered with after_flush() run once every chunk added before them has been handed to the writer
+    (and, if the writer has its own after_flush(), once the writer has stored them), which is how callers mark
+    a source as indexed only after its vectors are stored. Once a batch fails to embed or to be handed over,
+    every callback from then on is dropped, like VectorWriter does for failed upserts.
+    Embedded chunks are counted into `progress` (an IndexProgress) when one is given.
+    Sparse vectors come from `sparse_encoder`, normally the knowledge base's from get_sparse_encoder().
+    """
+
+    def __init__(
+        self,
+        writer,
+        embedding_type: str = "hybrid",
+        max_batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_batch_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+        progress=None,
+        sparse_encoder: SparseEncoder = None
+    ):
+        self.writer = writer
+        self.progress = progress
+        self.sparse_encoder = sparse_encoder
+        self.embedding_type = embedding_type
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.embedded = 0
+        self.failed = 0
+        self.batches = 0
+        self._pending = []
+        self._pending_tokens = 0
+        self._callbacks = []
+        self._first_failure = None
+
+    def add(self, id: str, chunk: Document, doc_name: str = 'None', doc_link: str = 'None') -> None:
+        """
+        Queues a chunk for embedding, flushing the current batch first if the chunk would overflow it.
+        """
+        if not chunk.page_content or not chunk.page_content.strip():
+            logger.debug(f"Skipping empty chunk {id}")
+            return
+        tokens = count_tokens(chunk.page_content)
+        if self._pending and (
+            len(self._pending) >= self.max_batch_size
+            or self._pending_tokens + tokens > self.max_batch_tokens
+        ):
+            self.flush()
+        self._pending.append((id, chunk, doc_name, doc_link))
+        self._pending_tokens += tokens
+
+    def after_flush(self, callback) -> None:
+        """
+        Registers a callback to run once all chunks queued so far have been stored.
+        """
+        if self._first_failure is not None:
+            logger.warning(f"Skipping flush callback because embedding batch {self._first_failure} failed")
+        elif self._pending:
+            self._callbacks.append(callback)
+        else:
+            self._defer(callback)
+
+    def flush(self) -> int:
+        """
+        Embeds the pending chunks and hands the records to the writer.
+        Returns:
+            int: The number of records handed to the writer.
+        """
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, []
+        callbacks, self._callbacks = self._callbacks, []
+        self._pending_tokens = 0
+        start = time.perf_counter()
+        vectors = encode_batch(
+            [chunk.page_content for _, chunk, _, _ in batch],
+            embedding_type=self.embedding_type,
+            sparse_encoder=self.sparse_encoder
+        )
+        packets = []
+        for (id, chunk, doc_name, doc_link), (dense_vec, sparse_vec) in zip(batch, vectors):
+            if len(dense_vec) == 0:
+                logger.error(f"Dense vector is empty for chunk id {id}. Chunk content: {chunk.page_content[:200]}")
+                self.failed += 1
+                continue
+            packets.append(build_vector_packet(id, chunk, dense_vec, sparse_vec, doc_name=doc_name, doc_link=doc_link))
+        sequence = self.batches
+        self.batches += 1
+        logger.info(f"Embedded batch of {len(packets)}/{len(batch)} chunks in {time.perf_counter() - start:0.3f}s")
+        if self.progress is not None:
+            self.progress.add(chunks_embedded=len(packets))
+        stored = len(packets)
+        if packets:
+            try:
+                getattr(self.writer, "write", self.writer)(packets)
+            except Exception as e:
+                logger.error(f"Error storing embedded batch of {len(packets)} chunks: {e}")
+                self.failed += len(packets)
+                stored = 0
+        self.embedded += stored
+        if stored < len(batch):
+            # Chunks that were not stored must not stay canonical for near-duplicates of other subtasks
+            stored_ids = {packet["id"] for packet in packets} if stored else set()
+            namespace = getattr(self.writer, "namespace", None)
+            if namespace:
+                forget_chunks(namespace, [id for id, _, _, _ in batch if id not in stored_ids])
+            if self._first_failure is None:
+                self._first_failure = sequence
+        if self._first_failure is not None:
+            if callbacks:
+                logger.warning(
+                    f"Skipping {len(callbacks)} flush callbacks because embedding batch {self._first_failure} failed"
+                )
+            return stored
+        for callback in callbacks:
+            self._defer(callback)
+        return stored
+
+    def _defer(self, callback) -> None:
+        after_flush = getattr(self.writer, "after_flush", None)
+        if after_flush is not None:
+            after_flush(callback)
+            return
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"Error in EmbeddingBatcher flush callback: {e}")
 
 
 def store_chunk_to_pinecone(
@@ -196,11 +676,12 @@ def store_chunk_to_pinecone(
 ) -> None:
     """
     Stores a chunk of text in Pinecone index with metadata.
+    Indexing jobs should prefer EmbeddingBatcher, which embeds and upserts chunks in batches.
     Args:
         id (str): Unique identifier for the chunk.
         chunk (Document): The chunk of text to store.
         namespace (str): The namespace in Pinecone to store the chunk.
-        index_name (str): The name of the Pinecone index.
+        index_name (str): The name of the Pinecone index; unused unless VECTOR_STORE_BACKEND is "pinecone".
         doc_name (str): The name of the document from which the chunk is derived.
         doc_link (str): The link to the document, if applicable.
         embedding_type (str): The type of embedding to use ("dense", "hybrid").
@@ -214,9 +695,9 @@ def store_chunk_to_pinecone(
     try:
         logger.debug(f"Chunk metadata: {chunk.metadata}")
         logger.debug(f"Chunk page_content (first 100 chars): {chunk.page_content[:100]}")
-        pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-        index = pc.Index(index_name)
-        dense_vec, sparse_vec = encode(chunk.page_content, embedding_type=embedding_type)
+        store = PineconeVectorStore(get_pinecone_index(index_name)) if VECTOR_STORE_BACKEND == "pinecone" else get_vector_store()
+        sparse_encoder = get_sparse_encoder(namespace)
+        dense_vec, sparse_vec = encode(chunk.page_content, embedding_type=embedding_type, sparse_encoder=sparse_encoder)
         logger.debug(f"Dense vector: {dense_vec[:10]}... (total {len(dense_vec)})")
         logger.debug(f"Sparse vector: {sparse_vec}")
         if len(dense_vec) == 0 and len(sparse_vec) == 0:
@@ -226,32 +707,239 @@ def store_chunk_to_pinecone(
                         """)
             logger.error(f"Chunk metadata: {chunk.metadata}")
             raise Exception("Both dense and sparse vectors are empty")
-        metadata = {
-            "context": chunk.page_content,
-            "doc_name": doc_name,
-            "doc_link": doc_link
-        }
-        logger.debug(f"Metadata to be stored in Pinecone: {metadata}")
-        final_packet = {
-            "id": id,
-            "values": dense_vec,
-            "sparse_values": sparse_vec,
-            "metadata": metadata,
-        }
+        final_packet = build_vector_packet(id, chunk, dense_vec, sparse_vec, doc_name=doc_name, doc_link=doc_link)
         logger.debug(f"Final packet for Pinecone upsert: {str(final_packet)[:200]}")
-        index.upsert(vectors=[final_packet], namespace=namespace)
+        store.upsert([final_packet], namespace)
+        sparse_encoder.save()
         logger.info(f"Index updated with {chunk.metadata['source']} with namespace {namespace}")
     except Exception as e:
         logger.error(f"Error occured in store_chunk_to_pinecone: {e}")
 
 
+def normalize_chunk_text(text: str) -> str:
+    """
+    Collapses whitespace so formatting-only changes do not alter a chunk's hash.
+    """
+    return " ".join(text.split())
+
+
+def chunk_digest(source_key: str, text: str) -> str:
+    """
+    Content hash of a chunk: sha256 of the source key plus the normalized chunk text.
+    """
+    return hashlib.sha256(f"{source_key}\n{normalize_chunk_text(text)}".encode("utf-8")).hexdigest()[:32]
+
+
+class ChunkManifest:
+    """
+    Content-addressed chunk IDs for one KnowledgeFile, KnowledgeExcel or WebsiteLink.
+    Chunk IDs are "<model>-<pk>#<digest>", so an unchanged chunk keeps its ID across runs.
+    The digests stored in the previous run (source.chunk_hashes) are diffed against the chunks seen now:
+    add() returns an ID only for chunks that still need embedding, and commit() deletes the vanished ones
+    and saves the new manifest.
+    With a ChunkDeduplicator, a new chunk that nearly duplicates an already stored or queued chunk of the
+    knowledge base is not embedded; it is recorded in source.chunk_refs as a reference to that chunk's ID.
+    Before a referenced chunk is deleted, rehome_chunk_references() gives its referrers a copy of the vector.
+    For large sources, checkpoint_after_flush() periodically saves the digests stored so far, so a run
+    that dies partway resumes without re-embedding them.
+    """
+
+    def __init__(self, source, deduplicator: ChunkDeduplicator = None):
+        self.source = source
+        self.prefix = source_chunk_prefix(source)
+        self.previous = set(source.chunk_hashes or [])
+        self.deduplicator = deduplicator
+        self.digests = []
+        self.references = {}
+        self._seen = set()
+        self._checkpointed = 0
+
+    def add(self, chunk: Document, key: str = "") -> str:
+        """
+        Registers a chunk. `key` further qualifies the source, e.g. the row link of an Excel file.
+        Returns:
+            str: The chunk ID if it must be embedded, None if it is already stored, repeats a chunk of this run
+                or duplicates another chunk of the knowledge base.
+        """
+        digest = chunk_digest(f"{self.prefix}{key}", chunk.page_content)
+        if digest in self._seen:
+            return None
+        self._seen.add(digest)
+        chunk_id = self.prefix + digest
+        if digest in self.previous:
+            self.digests.append(digest)
+            if self.deduplicator:
+                self.deduplicator.register(chunk.page_content, chunk_id)
+            return None
+        if self.deduplicator:
+            canonical = self.deduplicator.match(chunk.page_content, chunk_id)
+            if canonical:
+                self.references[digest] = canonical
+                return None
+        self.digests.append(digest)
+        return chunk_id
+
+    @property
+    def new_count(self) -> int:
+        return len(set(self.digests) - self.previous)
+
+    @property
+    def vanished(self) -> List[str]:
+        return [self.prefix + digest for digest in self.previous - set(self.digests)]
+
+    def checkpoint_after_flush(self, batcher, every: int = EMBEDDING_BATCH_SIZE) -> None:
+        """
+        Once at least `every` chunks were registered since the last checkpoint, schedules checkpoint()
+        to run after they are stored.
+        """
+        if len(self.digests) - self._checkpointed < every:
+            return
+        upto = self._checkpointed = len(self.digests)
+        batcher.after_flush(lambda: self.checkpoint(upto))
+
+    def checkpoint(self, upto: int) -> None:
+        """
+        Saves the first `upto` digests of this run, merged with the previous manifest, as the source's manifest
+        without flagging it as indexed. The next run treats them as stored and still deletes those that vanish.
+        """
+        previous = list(self.source.chunk_hashes or [])
+        known = set(previous)
+        self.source.chunk_hashes = previous + [digest for digest in self.digests[:upto] if digest not in known]
+        self.source.save(update_fields=["chunk_hashes"])
+        logger.debug(f"Checkpoint for {self.prefix}: {upto} chunks stored")
+
+    def commit(self, writer, complete: bool = True) -> None:
+        """
+        Deletes vanished chunks, then stores the manifest and flags the source as indexed.
+        Registered with after_flush() so it only runs once the new chunks are upserted.
+        With `complete` False, part of the source could not be read this run (e.g. a row link failed to scrape):
+        the new chunks are merged into the previous manifest, nothing is deleted and the source stays unindexed,
+        so the next run retries it.
+        """
+        if not complete:
+            previous = list(self.source.chunk_hashes or [])
+            known = set(previous)
+            self.source.chunk_hashes = previous + [digest for digest in self.digests if digest not in known]
+            self.source.chunk_refs = {**(self.source.chunk_refs or {}), **self.references}
+            self.source.save(update_fields=["chunk_hashes", "chunk_refs"])
+            logger.warning(f"Manifest for {self.prefix} is incomplete: {self.new_count} new chunks kept, nothing removed")
+            return
+        vanished = self.vanished
+        if vanished:
+            rehome_chunk_references(self.source, vanished, writer.namespace, writer.store)
+            writer.delete(vanished)
+            forget_chunks(writer.namespace, vanished)
+        self.source.chunk_hashes = self.digests
+        self.source.chunk_refs = self.references
+        self.source.indexed = True
+        self.source.save()
+        logger.info(
+            f"Manifest for {self.prefix}: {len(self.digests)} chunks, "
+            f"{self.new_count} new, {len(vanished)} removed, {len(self.references)} duplicates referenced"
+        )
+
+
+def source_chunk_prefix(source) -> str:
+    """
+    ID prefix shared by every chunk of a KnowledgeFile, KnowledgeExcel or WebsiteLink.
+    """
+    return f"{source._meta.model_name}-{source.pk}#"
+
+
+def rehome_chunk_references(source, chunk_ids: List[str], namespace: str, store: VectorStore) -> int:
+    """
+    Keeps near-duplicate references alive when the chunks they point to are about to be deleted.
+    Every other source of the knowledge base whose chunk_refs point to one of `chunk_ids` gets a copy of the
+    referenced vector under its own chunk ID, and the reference moves into its chunk manifest. A reference whose
+    vector cannot be fetched is dropped and its source flagged as not indexed, so the next run embeds the chunk.
+    Args:
+        source: The KnowledgeFile, KnowledgeExcel or WebsiteLink whose chunks are deleted.
+        chunk_ids (List[str]): IDs of the chunks about to be deleted.
+        namespace (str): The namespace of the knowledge base.
+        store (VectorStore): The vector store.
+    Returns:
+        int: The number of references given their own vector.
+    """
+    if not chunk_ids or getattr(source, "knowledge_base_id", None) is None:
+        return 0
+    from .models import KnowledgeExcel, KnowledgeFile, WebsiteLink
+    doomed = set(chunk_ids)
+    referrers = []
+    for model in (KnowledgeFile, KnowledgeExcel, WebsiteLink):
+        candidates = model.objects.filter(knowledge_base_id=source.knowledge_base_id).exclude(chunk_refs={})
+        if model is type(source):
+            candidates = candidates.exclude(pk=source.pk)
+        for referrer in candidates.only("id", "indexed", "chunk_hashes", "chunk_refs"):
+            refs = {digest: ref for digest, ref in referrer.chunk_refs.items() if ref in doomed}
+            if refs:
+                referrers.append((referrer, refs))
+    if not referrers:
+        return 0
+    records = store.fetch(sorted({ref for _, refs in referrers for ref in refs.values()}), namespace)
+    rehomed = 0
+    for referrer, refs in referrers:
+        prefix = source_chunk_prefix(referrer)
+        copies = [dict(records[ref], id=prefix + digest) for digest, ref in refs.items() if ref in records]
+        if copies:
+            store.upsert(copies, namespace)
+        for digest, ref in refs.items():
+            del referrer.chunk_refs[digest]
+            if ref in records:
+                referrer.chunk_hashes = list(referrer.chunk_hashes or []) + [digest]
+            else:
+                referrer.indexed = False
+        referrer.save(update_fields=["indexed", "chunk_hashes", "chunk_refs"])
+        rehomed += len(copies)
+    bump_namespace_version(namespace)
+    logger.info(f"Rehomed {rehomed} near-duplicate references to deleted chunks of {source_chunk_prefix(source)}")
+    return rehomed
+
+
+def legacy_metadata_filter(source) -> dict:
+    if hasattr(source, "url"):
+        return {"doc_link": {"$eq": source.url}}
+    return {"doc_name": {"$eq": os.path.basename(source.file)}}
+
+
+def delete_source_vectors(source, namespace: str = None, store: VectorStore = None) -> int:
+    """
+    Deletes every vector of a KnowledgeFile, KnowledgeExcel or WebsiteLink, e.g. before the source is removed.
+    IDs come from the source's chunk manifest and from listing its ID prefix.
+    Sources indexed before manifests existed are cleared by metadata filter.
+    Near-duplicate references of other sources to these vectors are rehomed first.
+    Args:
+        source: The KnowledgeFile, KnowledgeExcel or WebsiteLink.
+        namespace (str): The namespace; defaults to the source's knowledge base UUID.
+        store (VectorStore): The vector store; defaults to get_vector_store().
+    Returns:
+        int: The number of vectors deleted.
+    """
+    if namespace is None:
+        namespace = str(source.knowledge_base.uuid)
+    if store is None:
+        store = get_vector_store()
+    prefix = source_chunk_prefix(source)
+    chunk_ids = [prefix + digest for digest in source.chunk_hashes or []]
+    rehome_chunk_references(source, chunk_ids, namespace, store)
+    deleted = store.delete_source(prefix, namespace, ids=chunk_ids)
+    forget_chunks(namespace, chunk_ids)
+    if source.indexed and not source.chunk_hashes:
+        deleted += store.delete_by_filter(legacy_metadata_filter(source), namespace)
+    bump_namespace_version(namespace)
+    logger.info(f"Deleted {deleted} vectors of {prefix} from namespace {namespace}")
+    return deleted
+
+
 def index_uploaded_documents(
     kb_id,
     knowledge_files_queryset,
     namespace=None,
     chunk_size: int = 1000,
     chunk_overlap: int = 50,
-    embedding_type: str = "hybrid"
+    embedding_type: str = "hybrid",
+    chunking_engine: ChunkingEngine = None,
+    deduplicator: ChunkDeduplicator = None,
+    progress=None
 ) -> int:
     """
     Indexes uploaded documents into Pinecone.
@@ -262,6 +950,9 @@ def index_uploaded_documents(
         chunk_size (int): The size of each chunk.
         chunk_overlap (int): The overlap between chunks.
         embedding_type (str): The type of embedding to use ("dense", "hybrid").
+        chunking_engine (ChunkingEngine): Engine shared across the indexing job; built from chunk_size/chunk_overlap if omitted.
+        deduplicator (ChunkDeduplicator): Dedup stage shared across the indexing job; one for this call if omitted.
+        progress (IndexProgress): Progress of the indexing job to count embedded and upserted chunks into.
     Returns:
         int: The total number of chunks indexed.
     Raises:
@@ -271,78 +962,47 @@ def index_uploaded_documents(
         namespace = str(kb_id)
     total_chunks = 0
     logger.info(f"Starting document indexing for assistant {kb_id} with {knowledge_files_queryset.count()} files.")
+    engine = chunking_engine or ChunkingEngine(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    dedup = deduplicator or ChunkDeduplicator(namespace)
+    sparse_encoder = get_sparse_encoder(namespace)
+    writer = VectorWriter(namespace, progress=progress)
+    batcher = EmbeddingBatcher(writer, embedding_type=embedding_type, progress=progress, sparse_encoder=sparse_encoder)
     for kfile in knowledge_files_queryset:
         s3_url = kfile.file  # S3 URL
         file_ext = os.path.splitext(s3_url)[1].lower()
         doc_name = os.path.basename(s3_url)
         logger.info(f"Processing file: {doc_name} ({file_ext})")
+        manifest = ChunkManifest(kfile, deduplicator=dedup)
+        if file_ext not in SUPPORTED_DOCUMENT_TYPES:
+            logger.warning(f"Unsupported file type: {file_ext} for file {doc_name}")
+            batcher.after_flush(lambda manifest=manifest: manifest.commit(writer))
+            continue
+        temp_path = None
         try:
-            if file_ext == ".pdf":
-                response = requests.get(s3_url)
-                with open("/tmp/tmpfile.pdf", "wb") as tmpf:
-                    tmpf.write(response.content)
-                pages = PyPDFLoader("/tmp/tmpfile.pdf").load()
-                for page in pages:
-                    chunks = chunk_splitter(page, chunk_size=chunk_size, chunk_overlap=chunk_overlap, pdf_local=True)
-                    logger.info(f"File {doc_name} page {page.metadata.get('page', '?')}: {len(chunks)} semantic chunks")
-                    for chunk in chunks:
-                        store_chunk_to_pinecone(
-                            f"{kfile.id}_{total_chunks}",
-                            chunk,
-                            namespace=namespace,
-                            doc_name=doc_name,
-                            embedding_type=embedding_type
-                        )
-                        total_chunks += 1
-            elif file_ext == ".txt":
-                response = requests.get(s3_url)
-                text = response.text
-                doc = Document(page_content=text, metadata={"source": s3_url})
-                chunks = chunk_splitter(
-                    doc,
-                    chunk_size=chunk_size,
-                    chunk_overlap=chunk_overlap
-                )
-                logger.info(f"File {doc_name}: {len(chunks)} semantic chunks")
+            temp_path = download_to_tempfile(s3_url, suffix=file_ext, session=get_http_session())
+            for page in iter_document_pages(temp_path, file_ext, source=s3_url):
+                chunks = engine.split(page, pdf_local=file_ext == ".pdf")
+                logger.info(f"File {doc_name} page {page.metadata.get('page', '?')}: {len(chunks)} semantic chunks")
                 for chunk in chunks:
-                    store_chunk_to_pinecone(
-                        f"{kfile.id}_{total_chunks}",
-                        chunk,
-                        namespace=namespace,
-                        doc_name=doc_name,
-                        embedding_type=embedding_type
-                    )
+                    chunk_id = manifest.add(chunk)
+                    if chunk_id:
+                        batcher.add(chunk_id, chunk, doc_name=doc_name)
                     total_chunks += 1
-            elif file_ext == ".docx":
-                response = requests.get(s3_url)
-                with open("/tmp/tmpfile.docx", "wb") as tmpf:
-                    tmpf.write(response.content)
-                docs = Docx2txtLoader("/tmp/tmpfile.docx").load()
-                for doc in docs:
-                    chunks = chunk_splitter(
-                        doc,
-                        chunk_size=chunk_size,
-                        chunk_overlap=chunk_overlap
-                    )
-                    logger.info(f"File {doc_name} docx part: {len(chunks)} semantic chunks")
-                    for chunk in chunks:
-                        store_chunk_to_pinecone(
-                            f"{kfile.id}_{total_chunks}",
-                            chunk,
-                            namespace=namespace,
-                            doc_name=doc_name,
-                            embedding_type=embedding_type
-                        )
-                        total_chunks += 1
-            else:
-                logger.warning(f"Unsupported file type: {file_ext} for file {doc_name}")
+                manifest.checkpoint_after_flush(batcher)
 
-            kfile.indexed = True
-            kfile.save()
+            batcher.after_flush(lambda manifest=manifest: manifest.commit(writer))
         except Exception as e:
             logger.error(f"Failed to process {s3_url}: {e}")
             continue
-    logger.info(f"Indexed {total_chunks} chunks for assistant {kb_id}")
+        finally:
+            remove_tempfile(temp_path)
+    batcher.flush()
+    writer.close()
+    sparse_encoder.save()
+    logger.info(
+        f"Indexed {total_chunks} chunks for assistant {kb_id}, "
+        f"embedded {batcher.embedded} new chunks in {batcher.batches} batches, dedup {dedup.summary()}"
+    )
     return total_chunks
 
 
@@ -352,7 +1012,10 @@ def index_excel_documents(
     namespace=None,
     chunk_size: int = 1000,
     chunk_overlap: int = 50,
-    embedding_type: str = "hybrid"
+    embedding_type: str = "hybrid",
+    chunking_engine: ChunkingEngine = None,
+    deduplicator: ChunkDeduplicator = None,
+    progress=None
 ) -> int:
     """
     Indexes Excel/CSV documents into Pinecone.
@@ -367,37 +1030,21 @@ def index_excel_documents(
         namespace = str(kb_id)
     total_chunks = 0
     logger.info(f"Starting Excel/CSV document indexing for knowledgebase {kb_id} with {knowledge_excels_queryset} files.")
+    engine = chunking_engine or ChunkingEngine(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    dedup = deduplicator or ChunkDeduplicator(namespace)
+    sparse_encoder = get_sparse_encoder(namespace)
+    writer = VectorWriter(namespace, progress=progress)
+    batcher = EmbeddingBatcher(writer, embedding_type=embedding_type, progress=progress, sparse_encoder=sparse_encoder)
     for kfile in knowledge_excels_queryset:
         s3_url = kfile.file  # S3 URL or path
         file_ext = os.path.splitext(s3_url)[1].lower()
         excel_name = os.path.basename(s3_url)
         logger.info(f"Processing Excel/CSV file: {excel_name} ({file_ext})")
-        temp_dir = tempfile.mkdtemp()
-        temp_filename = f"{kfile.id}_{uuid.uuid4()}{file_ext}"
-        temp_path = os.path.join(temp_dir, temp_filename)
+        manifest = ChunkManifest(kfile, deduplicator=dedup)
+        temp_path = None
         try:
-            # Download file (support presigned URL or boto3 for private S3)
-            download_success = False
-            if s3_url.startswith("http"):
-                try:
-                    response = requests.get(s3_url, timeout=60)
-                    response.raise_for_status()
-                    with open(temp_path, "wb") as tmpf:
-                        tmpf.write(response.content)
-                    download_success = True
-                except Exception as e:
-                    logger.warning(f"Failed to download via HTTP: {e}")
-            if not download_success and boto3 is not None and s3_url.startswith("s3://"):
-                try:
-                    s3 = boto3.client("s3")
-                    bucket, key = s3_url[5:].split("/", 1)
-                    s3.download_file(bucket, key, temp_path)
-                    download_success = True
-                except Exception as e:
-                    logger.error(f"Failed to download from S3 using boto3: {e}")
-            if not download_success:
-                logger.error(f"Could not download file: {s3_url}")
-                continue
+            # Streams presigned/public URLs to a unique temp file; s3:// URLs are downloaded with boto3
+            temp_path = download_to_tempfile(s3_url, suffix=file_ext, session=get_http_session())
             # Read file (support .csv, .xlsx, .xls)
             df = None
             try:
@@ -412,41 +1059,47 @@ def index_excel_documents(
                 logger.error(f"Failed to read file {temp_path}: {e}")
                 continue
             logger.debug(f"df.head(): {df.head()}")
-            for index, row in df.iterrows():
-                link = str(row[0])
-                if link:
-                    try:
-                        content, hash = scrape_link(link)
-                        doc = Document(page_content=content, metadata={"source": getattr(kfile, 'original_name', excel_name)})
-                        chunks = chunk_splitter(doc, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-                        logger.info(f"Excel/CSV {excel_name} row {index}: {len(chunks)} semantic chunks")
-                        for chunk in chunks:
-                            store_chunk_to_pinecone(
-                                f"{kfile.id}_{total_chunks}",
-                                chunk,
-                                namespace=namespace,
-                                doc_name=excel_name,
-                                doc_link=link,
-                                embedding_type=embedding_type
-                            )
-                            total_chunks += 1
-                    except Exception as e:
-                        logger.warning(f"No content found for link {link} in file {excel_name}: {e}")
-                        continue
-            kfile.indexed = True
-            kfile.save()
+            row_links = [str(row[0]) for _, row in df.iterrows() if str(row[0])]
+            # Chunks of row links that fail now must not be deleted as vanished
+            failed_links = 0
+            for link, content, hash, error in scrape_links(row_links, kb_id=kb_id):
+                if error is not None:
+                    logger.warning(f"No content found for link {link} in file {excel_name}: {error}")
+                    failed_links += 1
+                    continue
+                try:
+                    doc = Document(
+                        page_content=dedup.strip_boilerplate(content, page=link),
+                        metadata={"source": getattr(kfile, 'original_name', excel_name)}
+                    )
+                    chunks = engine.split(doc)
+                    logger.info(f"Excel/CSV {excel_name} link {link}: {len(chunks)} semantic chunks")
+                    for chunk in chunks:
+                        chunk_id = manifest.add(chunk, key=link)
+                        if chunk_id:
+                            batcher.add(chunk_id, chunk, doc_name=excel_name, doc_link=link)
+                        total_chunks += 1
+                    manifest.checkpoint_after_flush(batcher)
+                except Exception as e:
+                    logger.warning(f"No content found for link {link} in file {excel_name}: {e}")
+                    failed_links += 1
+                    continue
+            batcher.after_flush(
+                lambda manifest=manifest, complete=not failed_links: manifest.commit(writer, complete=complete)
+            )
         except Exception as e:
             logger.error(f"Failed to process {s3_url}: {e}")
             continue
         finally:
-            try:
-                if os.path.exists(temp_path):
-                    os.remove(temp_path)
-                if os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir)
-            except Exception as cleanup_err:
-                logger.warning(f"Failed to clean up temp files: {cleanup_err}")
-    logger.info(f"Indexed {total_chunks} chunks from Excel/CSV files for assistant {kb_id}")
+            remove_tempfile(temp_path)
+    batcher.flush()
+    writer.close()
+    sparse_encoder.save()
+    dedup.save()
+    logger.info(
+        f"Indexed {total_chunks} chunks from Excel/CSV files for assistant {kb_id}, "
+        f"embedded {batcher.embedded} new chunks, dedup {dedup.summary()}"
+    )
     return total_chunks
 
 
@@ -456,7 +1109,10 @@ def index_scraped_links_with_jina(
     namespace=None,
     chunk_size: int = 1000,
     chunk_overlap: int = 50,
-    embedding_type: str = "hybrid"
+    embedding_type: str = "hybrid",
+    chunking_engine: ChunkingEngine = None,
+    deduplicator: ChunkDeduplicator = None,
+    progress=None
 ) -> int:
     """
     Indexes web links using Jina AI for scraping and stores the content in Pinecone.
@@ -467,6 +1123,9 @@ def index_scraped_links_with_jina(
         chunk_size (int): The size of each chunk.
         chunk_overlap (int): The overlap between chunks.
         embedding_type (str): The type of embedding to use ("dense", "hybrid").
+        chunking_engine (ChunkingEngine): Engine shared across the indexing job; built from chunk_size/chunk_overlap if omitted.
+        deduplicator (ChunkDeduplicator): Dedup stage shared across the indexing job; one for this call if omitted.
+        progress (IndexProgress): Progress of the indexing job to count embedded and upserted chunks into.
     Returns:
         int: The total number of chunks indexed.
     Raises:
@@ -477,40 +1136,48 @@ def index_scraped_links_with_jina(
     total_chunks = 0
     logger.debug("Using Jina AI for web scraping. Ensure you have the correct API key set in your environment variables.")
     logger.info(f"Starting link scraping for assistant {kb_id} with {links_queryset} links.")
+    engine = chunking_engine or ChunkingEngine(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    dedup = deduplicator or ChunkDeduplicator(namespace)
+    sparse_encoder = get_sparse_encoder(namespace)
+    writer = VectorWriter(namespace, progress=progress)
+    batcher = EmbeddingBatcher(writer, embedding_type=embedding_type, progress=progress, sparse_encoder=sparse_encoder)
 
-    for link in links_queryset:
+    for link, content, hash, error in scrape_links(links_queryset, kb_id=kb_id):
+        if error is not None:
+            logger.error(f"Exception indexing {link.url} with Jina AI: {error}")
+            continue
         try:
             logger.info(f"Processing link: {link.url}")
-            content, hash = scrape_link(link.url)
-            kb = KnowledgeBase.objects.filter(uuid=kb_id).first()
-            link_model = WebsiteLink.objects.filter(knowledge_base=kb, url=link).first()
-            link_model.hash = hash
-            link_model.save()
-            doc = Document(page_content=content, metadata={"source": link.url})
-            chunks = chunk_splitter(
-                doc,
-                chunk_size=chunk_size,
-                chunk_overlap=chunk_overlap
-            )
+            link.hash = hash
+            link.save(update_fields=["hash"])
+            manifest = ChunkManifest(link, deduplicator=dedup)
+            if link.indexed and not link.chunk_hashes:
+                # Indexed before manifests existed: positional chunk IDs, so clear them by metadata.
+                writer.store.delete_by_filter(legacy_metadata_filter(link), namespace)
+                bump_namespace_version(namespace)
+            doc = Document(page_content=dedup.strip_boilerplate(content, page=link.url), metadata={"source": link.url})
+            chunks = engine.split(doc)
             logger.info(f"Link {link.url}: {len(chunks)}  chunks")
             logger.debug(f"Link {link.url} content: {chunks}...")
             for chunk in chunks:
-                store_chunk_to_pinecone(
-                    f"{link.id}_{total_chunks}",
-                    chunk,
-                    namespace=namespace,
-                    doc_link=link.url,
-                    embedding_type=embedding_type
-                )
+                chunk_id = manifest.add(chunk)
+                if chunk_id:
+                    batcher.add(chunk_id, chunk, doc_link=link.url)
                 total_chunks += 1
 
         except Exception as e:
             logger.error(f"Exception indexing {link.url} with Jina AI: {e}")
             continue
-        link.indexed = True
-        link.save()
-    logger.info(f"Indexed {total_chunks} chunks from web links for assistant {kb_id}")
-    return
+        batcher.after_flush(lambda manifest=manifest: manifest.commit(writer))
+    batcher.flush()
+    writer.close()
+    sparse_encoder.save()
+    dedup.save()
+    logger.info(
+        f"Indexed {total_chunks} chunks from web links for assistant {kb_id}, "
+        f"embedded {batcher.embedded} new chunks, dedup {dedup.summary()}"
+    )
+    return total_chunks
 
 
 def scrape_link(
@@ -523,13 +1190,14 @@ def scrape_link(
     Args:
         link (str): The URL to scrape.
         max_retries (int): Maximum number of retries on failure.
-        retry_delay (int): Delay in seconds between retries.
+        retry_delay (int): Base delay in seconds between retries; doubled per attempt and jittered.
     Returns:
         tuple: A tuple containing the scraped content and its hash.
     Raises:
         Exception: If there is an error during the scraping process.
     This function uses Jina AI to scrape the content of a given link.
-    It retries up to `max_retries` times if the request fails, with a delay of `retry_delay` seconds between attempts.
+    It retries up to `max_retries` times if the request fails, backing off exponentially from `retry_delay` seconds
+    with random jitter so concurrent scrapes of a failing host do not retry in lockstep.
     """
     for attempt in range(1, max_retries + 1):
         try:
@@ -539,7 +1207,7 @@ def scrape_link(
                 "X-Engine": "direct"
             }
             jina_url = f"{os.getenv('JINA_READER_URL')}{link}"
-            resp = requests.get(jina_url, headers=headers, timeout=60)
+            resp = get_http_session().get(jina_url, headers=headers, timeout=60)
             if resp.status_code == 200:
                 data = resp.json().get("data", {})
                 content = data.get("content", "")
@@ -551,57 +1219,234 @@ def scrape_link(
         except Exception as e:
             logger.error(f"Exception scraping {link} with Jina AI (attempt {attempt}): {e}")
         if attempt < max_retries:
-            logger.info(f"Retrying scrape_link for {link} in {retry_delay} seconds (attempt {attempt + 1}/{max_retries})...")
-            time.sleep(retry_delay)
+            delay = retry_delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            logger.info(f"Retrying scrape_link for {link} in {delay:0.1f} seconds (attempt {attempt + 1}/{max_retries})...")
+            time.sleep(delay)
     raise Exception(f"Failed to scrape {link} after {max_retries} attempts")
 
 
+def link_has_changed(link) -> bool:
+    """
+    Checks a WebsiteLink against its origin with a conditional GET before paying for a Jina scrape.
+    Sends the stored ETag/Last-Modified as If-None-Match/If-Modified-Since. A 304, an identical ETag, or an identical
+    fingerprint (sha256 of the raw body) means the page is unchanged. The validators seen are set on `link` but not
+    saved, so that a changed link only records them once it has been re-indexed.
+    Any probe failure counts as a change, falling back to the full scrape.
+    Args:
+        link (WebsiteLink): The link to check.
+    Returns:
+        bool: True if the page must be re-scraped.
+    """
+    headers = {}
+    if link.etag:
+        headers["If-None-Match"] = link.etag
+    if link.last_modified:
+        headers["If-Modified-Since"] = link.last_modified
+    try:
+        with get_http_session().get(link.url, headers=headers, timeout=30, stream=True) as resp:
+            if resp.status_code == 304:
+                return False
+            if resp.status_code != 200:
+                logger.debug(f"Probe of {link.url} returned {resp.status_code}, treating as changed")
+                return True
+            etag = resp.headers.get("ETag")
+            if etag and etag == link.etag:
+                return False
+            digest = hashlib.sha256()
+            size = 0
+            for block in resp.iter_content(chunk_size=64 * 1024):
+                digest.update(block)
+                size += len(block)
+                if size >= LINK_FINGERPRINT_MAX_BYTES:
+                    break
+    except requests.RequestException as e:
+        logger.debug(f"Probe of {link.url} failed, treating as changed: {e}")
+        return True
+    fingerprint = digest.hexdigest()
+    changed = fingerprint != link.fingerprint
+    link.etag = etag
+    link.last_modified = resp.headers.get("Last-Modified")
+    link.content_length = size
+    link.fingerprint = fingerprint
+    return changed
+
+
+def split_changed_links(links, max_workers: int = SCRAPE_CONCURRENCY_PER_KB) -> tuple:
+    """
+    Runs link_has_changed for the links concurrently.
+    Returns:
+        tuple: (changed, unchanged) lists of links, in input order.
+    """
+    links = list(links)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(link_has_changed, links))
+    changed = [link for link, result in zip(links, results) if result]
+    unchanged = [link for link, result in zip(links, results) if not result]
+    return changed, unchanged
+
+
+def get_scrape_semaphore(kb_id) -> threading.BoundedSemaphore:
+    """
+    Returns the semaphore capping concurrent scrapes for a knowledge base across all indexing runs in this process.
+    """
+    with _scrape_lock:
+        semaphore = _scrape_semaphores.get(str(kb_id))
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(SCRAPE_CONCURRENCY_PER_KB)
+            _scrape_semaphores[str(kb_id)] = semaphore
+    return semaphore
+
+
+def scrape_links(links, kb_id=None, max_workers: int = SCRAPE_CONCURRENCY_PER_KB):
+    """
+    Scrapes links concurrently and yields them as they complete, so callers can chunk and embed one page
+    while the next ones are still being fetched.
+    At most `max_workers` scrapes run at once for this call, and at most SCRAPE_CONCURRENCY_PER_KB for the
+    knowledge base overall. Only a bounded number of links is queued ahead of the consumer.
+    Args:
+        links (iterable): WebsiteLink objects or URL strings.
+        kb_id (str): The knowledge base the links belong to.
+        max_workers (int): Number of scraping threads.
+    Yields:
+        tuple: (link, content, hash, error); content and hash are None and error is set if scraping failed.
+    """
+    semaphore = get_scrape_semaphore(kb_id)
+
+    def scrape(link):
+        with semaphore:
+            return scrape_link(getattr(link, "url", link))
+
+    links = iter(links)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {}
+        for link in links:
+            pending[executor.submit(scrape, link)] = link
+            if len(pending) >= max_workers * 2:
+                break
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                link = pending.pop(future)
+                try:
+                    content, hash = future.result()
+                    yield link, content, hash, None
+                except Exception as e:
+                    yield link, None, None, e
+                next_link = next(links, None)
+                if next_link is not None:
+                    pending[executor.submit(scrape, next_link)] = next_link
+
+
+def encode_query(text: str, namespace: str, embedding_type: str = "hybrid") -> tuple:
+    """
+    Encodes a retrieval query. In hybrid mode the sparse encoding runs on the retrieval pool while the dense
+    embedding is requested, so a hybrid query waits for the slower of the two instead of their sum.
+    Args:
+        text (str): The query text.
+        namespace (str): The knowledge base namespace, whose sparse encoder weights the query.
+        embedding_type (str): The type of embedding to use ("dense", "hybrid").
+    Returns:
+        tuple: The dense vector and the sparse vector (EMPTY_SPARSE_VECTOR in dense mode).
+    """
+    if embedding_type != "hybrid":
+        return get_dense_vector(text), EMPTY_SPARSE_VECTOR
+    sparse_encoder = get_sparse_encoder(namespace, for_query=True)
+    sparse_future = get_retrieval_executor().submit(lambda: sparse_encoder.encode_queries([text])[0])
+    dense = get_dense_vector(text)
+    return dense, sparse_future.result()
+
+
+def weight_hybrid_vectors(dense: list, sparse: dict, sparse_weightage: float) -> tuple:
+    """
+    Applies the hybrid weighting of a knowledge base to a query: the dense vector is scaled by 1 - alpha and the
+    sparse values by alpha, so the dot-product score is (1 - alpha) * dense score + alpha * sparse score.
+    Args:
+        dense (list): The dense query vector.
+        sparse (dict): The sparse query vector.
+        sparse_weightage (float): alpha, clamped to [0, 1].
+    Returns:
+        tuple: The weighted dense vector and the weighted sparse vector, None when alpha is 0.
+    """
+    alpha = min(max(float(sparse_weightage), 0.0), 1.0)
+    dense = [value * (1 - alpha) for value in dense]
+    if alpha == 0:
+        return dense, None
+    return dense, {"indices": sparse["indices"], "values": [value * alpha for value in sparse["values"]]}
+
+
+def reciprocal_rank_fusion(results: List, top_k: int, rrf_k: int = RRF_K) -> dict:
+    """
+    Fuses ranked query results by reciprocal rank: a match scores the sum of 1 / (rrf_k + rank) over the lists
+    it appears in. Only ranks count, so dense and sparse scores need no common scale.
+    Args:
+        results (List): Query results, each with its matches under "matches".
+        top_k (int): The number of fused matches to return.
+        rrf_k (int): The rank offset; larger values flatten the advantage of top ranks.
+    Returns:
+        dict: The fused results, with the matches under "matches" and the fused score as "score".
+    """
+    fused = {}
+    for result in results:
+        for rank, match in enumerate(result["matches"], start=1):
+            entry = fused.setdefault(match["id"], {"id": match["id"], "score": 0.0, "metadata": match.get("metadata")})
+            entry["score"] += 1.0 / (rrf_k + rank)
+    matches = sorted(fused.values(), key=lambda entry: entry["score"], reverse=True)
+    return {"matches": matches[:top_k]}
+
+
 def retrieve(
     text: str,
     namespace: str,
-    index,
+    store: VectorStore = None,
     k=2,
-    retrieval_method: str = "hybrid"
+    retrieval_method: str = "hybrid",
+    sparse_weightage: float = 0.5
 ) -> dict:
     """
-    Retrieve documents from Pinecone index based on the provided text and namespace.
+    Retrieve documents from the vector store based on the provided text and namespace.
     Args:
         text (str): The input text to retrieve documents for.
-        namespace (str): The namespace in Pinecone to query.
-        index: The Pinecone index object.
+        namespace (str): The namespace to query.
+        store (VectorStore): The vector store; defaults to get_vector_store().
         k (int): The number of top results to return.
-        retrieval_method (str): The method of retrieval ("dense", "hybrid").
+        retrieval_method (str): The method of retrieval ("dense", "hybrid", "rrf"). "hybrid" queries once with
+            vectors weighted by `sparse_weightage`; "rrf" queries the dense and sparse vectors separately, in
+            parallel, and fuses the two lists by reciprocal rank. The sparse list is ranked by the query weighted
+            with RRF_SPARSE_WEIGHTAGE, since indexes reject an all-zero dense vector.
+        sparse_weightage (float): Weight of the sparse score in "hybrid" retrieval (KnowledgeBase.sparse_weightage).
     Returns:
-        dict: The query results from the Pinecone index.
+        dict: The query results, with the matches under "matches".
     Raises:
-        Exception: If there is an error during the retrieval process.
-        ValueError: If the retrieval method is not supported.
+        ValueError: If the retrieval method is not supported. Other errors are logged and return {}.
     """
+    if retrieval_method not in ("dense", "hybrid", "rrf"):
+        raise ValueError(f"Unsupported retrieval method: {retrieval_method}")
     try:
+        if store is None:
+            store = get_vector_store()
         if retrieval_method == "dense":
-            dense, sparse = encode(text, embedding_type="dense")
-            result = index.query(
-                vector=dense,
-                top_k=k,
-                include_metadata=True,
-                namespace=namespace,
-            )
+            dense, sparse = encode_query(text, namespace, embedding_type="dense")
+            result = store.query(namespace, dense, top_k=k, include_metadata=True)
             logger.warning(f"Dense retrieval for text: {text[:50]}... with namespace: {namespace}")
             return result
         elif retrieval_method == "hybrid":
-            dense, sparse = encode(text, embedding_type="hybrid")
-            result = index.query(
-                vector=dense,
-                sparse_vector=sparse,
-                top_k=k,
-                include_metadata=True,
-                namespace=namespace,
-            )
+            dense, sparse = encode_query(text, namespace, embedding_type="hybrid")
+            dense, sparse = weight_hybrid_vectors(dense, sparse, sparse_weightage)
+            result = store.query(namespace, dense, sparse_vector=sparse, top_k=k, include_metadata=True)
             logger.warning(f"Hybrid retrieval for text: {text[:50]}... with namespace: {namespace}")
             return result
-        else:
-            logger.error(f"Unsupported retrieval method: {retrieval_method}")
-            return {404: "Unsupported retrieval method"}
+        elif retrieval_method == "rrf":
+            dense, sparse = encode_query(text, namespace, embedding_type="hybrid")
+            candidates = max(k, RRF_CANDIDATES)
+            executor = get_retrieval_executor()
+            sparse_dense, sparse = weight_hybrid_vectors(dense, sparse, RRF_SPARSE_WEIGHTAGE)
+            sparse_future = executor.submit(
+                store.query, namespace, sparse_dense, sparse_vector=sparse, top_k=candidates, include_metadata=True
+            )
+            dense_result = store.query(namespace, dense, top_k=candidates, include_metadata=True)
+            result = reciprocal_rank_fusion([dense_result, sparse_future.result()], k)
+            logger.warning(f"RRF retrieval for text: {text[:50]}... with namespace: {namespace}")
+            return result
     except Exception as e:
         logger.error(f"Error in hybrid-retrieval: {e}")
         return {}
@@ -0,0 +1,193 @@
+import os
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List
+import requests
+from langchain_core.documents import Document
+from langchain_community.document_loaders import Docx2txtLoader
+from pypdf import PdfReader
+try:
+    import boto3
+except ImportError:
+    boto3 = None
+try:
+    import billiard
+    from billiard.pool import Pool as BilliardPool
+except ImportError:
+    billiard = BilliardPool = None
+from backend.settings import logger
+
+
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+PDF_PAGES_PER_TASK = 16
+PDF_PARALLEL_MIN_PAGES = 32
+TEXT_BLOCK_SIZE = 256 * 1024
+
+
+def download_to_tempfile(url: str, suffix: str = "", session: requests.Session = None) -> str:
+    """
+    Streams a file to a unique temporary file, so concurrent workers never share a path and the
+    file is never held in memory. s3:// URLs are downloaded with boto3.
+    Args:
+        url (str): HTTP(S) or s3:// URL of the file.
+        suffix (str): Suffix of the temporary file, e.g. ".pdf".
+        session (requests.Session): Session to download HTTP(S) URLs with.
+    Returns:
+        str: Path of the temporary file; the caller removes it.
+    Raises:
+        Exception: If the download fails.
+    """
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        if url.startswith("s3://"):
+            if boto3 is None:
+                raise Exception("boto3 is required to download s3:// URLs")
+            os.close(fd)
+            bucket, key = url[5:].split("/", 1)
+            boto3.client("s3").download_file(bucket, key, path)
+            return path
+        with os.fdopen(fd, "wb") as tmpf:
+            with (session or requests).get(url, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                for block in response.iter_content(chunk_size=DOWNLOAD_BLOCK_SIZE):
+                    tmpf.write(block)
+        return path
+    except Exception:
+        remove_tempfile(path)
+        raise
+
+
+def remove_tempfile(path: str) -> None:
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+    except OSError as e:
+        logger.warning(f"Failed to clean up temp file {path}: {e}")
+
+
+def extract_pdf_pages(path: str, start: int, stop: int) -> List[str]:
+    """
+    Extracts the text of pages [start, stop) of a PDF. Runs in the extraction process pool.
+    """
+    reader = PdfReader(path)
+    return [reader.pages[number].extract_text() or "" for number in range(start, min(stop, len(reader.pages)))]
+
+
+class BilliardExecutor:
+    """
+    Minimal submit()/result() executor over billiard's process pool. Unlike multiprocessing, billiard lets
+    daemonic processes such as Celery prefork children start worker processes.
+    """
+
+    def __init__(self, max_workers: int):
+        self._pool = BilliardPool(processes=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self._pool.close()
+        else:
+            self._pool.terminate()
+        self._pool.join()
+
+    def submit(self, fn, *args):
+        return BilliardResult(self._pool.apply_async(fn, args))
+
+
+class BilliardResult:
+    def __init__(self, async_result):
+        self._async_result = async_result
+
+    def result(self):
+        return self._async_result.get()
+
+
+def get_extract_executor(max_workers: int = PDF_EXTRACT_WORKERS):
+    """
+    Returns a process pool executor for PDF extraction, or None if extraction must run serially.
+    Daemonic processes (e.g. Celery prefork children, where indexing runs) are not allowed to start a
+    multiprocessing pool, so they use billiard's pool instead.
+    """
+    if max_workers <= 1:
+        return None
+    daemon = multiprocessing.current_process().daemon or (billiard is not None and billiard.current_process().daemon)
+    if not daemon:
+        return ProcessPoolExecutor(max_workers=max_workers)
+    if BilliardPool is not None:
+        return BilliardExecutor(max_workers)
+    return None
+
+
+def iter_pdf_pages(path: str, source: str, max_workers: int = PDF_EXTRACT_WORKERS) -> Iterator[Document]:
+    """
+    Yields the pages of a PDF as Documents, in page order.
+    Large PDFs are extracted in ranges of PDF_PAGES_PER_TASK pages on a process pool, with only a bounded number
+    of ranges in flight, so memory does not grow with the page count.
+    Args:
+        path (str): Local path of the PDF.
+        source (str): Value of the "source" metadata of the pages.
+        max_workers (int): Number of extraction processes.
+    """
+    page_count = len(PdfReader(path).pages)
+    ranges = [(start, start + PDF_PAGES_PER_TASK) for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+    executor = get_extract_executor(max_workers) if page_count >= PDF_PARALLEL_MIN_PAGES else None
+    if executor is None:
+        pages = (text for start, stop in ranges for text in extract_pdf_pages(path, start, stop))
+        for number, text in enumerate(pages):
+            yield Document(page_content=text, metadata={"source": source, "page": number})
+        return
+    with executor:
+        pending = []
+        next_range = 0
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < max_workers * 2:
+                start, stop = ranges[next_range]
+                pending.append((start, executor.submit(extract_pdf_pages, path, start, stop)))
+                next_range += 1
+            start, future = pending.pop(0)
+            for offset, text in enumerate(future.result()):
+                yield Document(page_content=text, metadata={"source": source, "page": start + offset})
+
+
+def iter_text_blocks(path: str, source: str, block_size: int = TEXT_BLOCK_SIZE) -> Iterator[Document]:
+    """
+    Yields a text file as Documents of about `block_size` characters, cut at line boundaries.
+    """
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        block = []
+        size = 0
+        for line in f:
+            block.append(line)
+            size += len(line)
+            if size >= block_size:
+                yield Document(page_content="".join(block), metadata={"source": source})
+                block = []
+                size = 0
+        if block:
+            yield Document(page_content="".join(block), metadata={"source": source})
+
+
+def iter_document_pages(path: str, file_ext: str, source: str) -> Iterator[Document]:
+    """
+    Yields the pages of a downloaded PDF, TXT or DOCX file lazily for chunking.
+    Args:
+        path (str): Local path of the file.
+        file_ext (str): Lower-case extension of the file, e.g. ".pdf".
+        source (str): Value of the "source" metadata of the documents.
+    Raises:
+        ValueError: If the file type is not supported.
+    """
+    if file_ext == ".pdf":
+        yield from iter_pdf_pages(path, source)
+    elif file_ext == ".txt":
+        yield from iter_text_blocks(path, source)
+    elif file_ext == ".docx":
+        for doc in Docx2txtLoader(path).load():
+            doc.metadata["source"] = source
+            yield doc
+    else:
+        raise ValueError(f"Unsupported file type: {file_ext}")
@@ -21,10 +21,11 @@ import boto3
 from botocore.exceptions import NoCredentialsError
 import os
 from .models import KnowledgeExcel
-from pinecone import Pinecone
-from pinecone.grpc import PineconeGRPC
 from backend.settings import logger
 from .models import KnowledgeDataExcel
+from .indexing import delete_source_vectors
+from .retrieval_cache import bump_namespace_version
+from .vectorstore import get_vector_store
 import pandas as pd
 import io
 
@@ -56,18 +57,12 @@ def create_knowledge_base(request):
         chunk_size=request.data.get("chunk_size"),
         chunk_overlap=request.data.get("chunk_overlap"),
     )
-    # Always upsert a dummy vector to ensure namespace is created (using PineconeGRPC)
+    # Always create the namespace up front (Pinecone: a marker vector)
     try:
-        pc = PineconeGRPC(api_key=os.getenv("PINECONE_API_KEY"))
-        index = pc.Index(os.getenv('PINECONE_INDEX'))
-        # Use correct dimension for your index
-        index.upsert(
-            vectors=[{"id": f"init-{kb.uuid}", "values": [0.1] * 1024, "metadata": {"init": True}}],
-            namespace=str(kb.uuid)
-        )
-        logger.info(f"Pinecone namespace created for KB {kb.uuid}")
+        get_vector_store().create_namespace(str(kb.uuid))
+        logger.info(f"Vector store namespace created for KB {kb.uuid}")
     except Exception as e:
-        logger.error(f"Error creating Pinecone namespace for KB {kb.uuid}: {e}")
+        logger.error(f"Error creating vector store namespace for KB {kb.uuid}: {e}")
 
     return Response({"id": kb.id, "name": kb.name, "uuid": str(kb.uuid)})
 
@@ -100,6 +95,8 @@ def list_knowledge_bases(request):
             "top_k": kb.top_k,
             "top_k_after_reranking": kb.top_k_after_reranking,
             "sparse_weightage": kb.sparse_weightage,
+            "crawl_max_depth": kb.crawl_max_depth,
+            "crawl_max_pages": kb.crawl_max_pages,
             "files_count": files_count,
             "links_count": links_count,
             "excels_count": excels_count,
@@ -127,6 +124,8 @@ def update_knowledge_base(request, kb_id):
     retrieval_method = request.data.get("retrieval_method")
     embedding_type = request.data.get("embedding_type")
     update_interval = request.data.get("update_interval")
+    crawl_max_depth = request.data.get("crawl_max_depth")
+    crawl_max_pages = request.data.get("crawl_max_pages")
     # check once with fronten
 
     kb = KnowledgeBase.objects.filter(uuid=kb_id, user=request.user).first()
@@ -162,6 +161,16 @@ def update_knowledge_base(request, kb_id):
             kb.update_interval = timedelta(hours=h, minutes=m, seconds=s)
         except Exception:
             pass
+    if crawl_max_depth is not None:
+        try:
+            kb.crawl_max_depth = int(crawl_max_depth)
+        except Exception:
+            pass
+    if crawl_max_pages is not None:
+        try:
+            kb.crawl_max_pages = int(crawl_max_pages)
+        except Exception:
+            pass
 
     kb.save()
 
@@ -177,14 +186,16 @@ def update_knowledge_base(request, kb_id):
         "top_k": kb.top_k,
         "top_k_after_reranking": kb.top_k_after_reranking,
         "sparse_weightage": kb.sparse_weightage,
-        "update_interval": str(kb.update_interval)
+        "update_interval": str(kb.update_interval),
+        "crawl_max_depth": kb.crawl_max_depth,
+        "crawl_max_pages": kb.crawl_max_pages
     })
 
 
 @api_view(["DELETE"])
 @permission_classes([IsAuthenticated])
 def delete_knowledge_base(request, kb_id):
-    """Delete a knowledge base and its associated Pinecone namespace.
+    """Delete a knowledge base and its associated vector store namespace.
     Args:
         request (): _http request object containing the kb_id in POST data.
         kb_id (int): ID of the knowledge base to delete.
@@ -195,13 +206,12 @@ def delete_knowledge_base(request, kb_id):
     kb = KnowledgeBase.objects.filter(uuid=kb_id, user=request.user).first()
     if not kb:
         return Response({"error": "Knowledge base not found"}, status=404)
-    # Delete Pinecone namespace (all vectors)
+    # Delete the vector store namespace (all vectors)
     try:
-        pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-        index = pc.Index(os.getenv('PINECONE_INDEX'))
-        index.delete(delete_all=True, namespace=str(kb.uuid))
+        get_vector_store().drop_namespace(str(kb.uuid))
+        bump_namespace_version(str(kb.uuid))
     except Exception as e:
-        logger.error(f"Error deleting Pinecone namespace for KB {kb.uuid}: {e}")
+        logger.error(f"Error deleting vector store namespace for KB {kb.uuid}: {e}")
     kb.delete()
     return Response({"message": "Knowledge base and namespace deleted"})
 
@@ -326,20 +336,7 @@ def knowledgebase_delete_link(request, link_id):
         return Response({"error": "Link not found"}, status=404)
     # Delete Pinecone chunks for this link
     try:
-        pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-        index = pc.Index(os.getenv('PINECONE_INDEX'))
-        # Pinecone query requires a vector, so use a dummy vector and filter
-        results = index.query(
-            vector=[0.0] * 1024,
-            top_k=10000,
-            namespace=str(kb_uuid),
-            filter={"doc_link": {"$eq": link.url}},
-            include_values=False,
-            include_metadata=True
-        )
-        ids_to_delete = [match["id"] for match in results.get("matches", [])]
-        if ids_to_delete:
-            index.delete(ids=ids_to_delete, namespace=str(kb_uuid))
+        delete_source_vectors(link, namespace=str(kb_uuid))
     except Exception as e:
         logger.error(f"Error deleting Pinecone chunks for link {link.url}: {e}")
     link.delete()
@@ -374,19 +371,24 @@ def knowledgebase_delete_file(request, file_id):
         except Exception as e:
             return Response({"error": f"S3 delete failed: {str(e)}"}, status=500)
 
+    try:
+        delete_source_vectors(kf)
+    except Exception as e:
+        logger.error(f"Error deleting Pinecone chunks for {kf.original_name}: {e}")
     kf.delete()
     return Response({"success": True})
 
 
 @api_view(["DELETE"])
 @permission_classes([IsAuthenticated])
-def knowledgebase_delete_excel(request, kb_uuid):
+def knowledgebase_delete_excel(request):
     """
-    Delete an Excel file from the knowledge base and remove it from S3.
+    Delete an Excel file (excel_id in GET parameters or body) from the knowledge base and remove it from S3.
     """
     from .models import KnowledgeExcel
     import boto3
 
+    excel_id = request.GET.get("excel_id") or request.data.get("excel_id")
     kf = KnowledgeExcel.objects.filter(id=excel_id, knowledge_base__user=request.user).first()
     if not kf:
         return Response({"error": "Excel file not found"}, status=404)
@@ -406,6 +408,10 @@ def knowledgebase_delete_excel(request, kb_uuid):
         except Exception as e:
             return Response({"error": f"S3 delete failed: {str(e)}"}, status=500)
 
+    try:
+        delete_source_vectors(kf)
+    except Exception as e:
+        logger.error(f"Error deleting Pinecone chunks for {kf.original_name}: {e}")
     kf.delete()
     return Response({"success": True})
 
@@ -0,0 +1,68 @@
+import json
+import time
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand, CommandError
+from analytics.agent_turn import AgentTurn
+
+
+def scripted_model(tool_rounds: int, latency: float):
+    """
+    Fake chat-completions endpoint that asks for one tool call per round for `tool_rounds` rounds, then replies.
+    Each call sleeps `latency` seconds to stand in for a model round trip.
+    """
+    calls = []
+
+    def call_model(messages, tool_choice):
+        calls.append(tool_choice)
+        time.sleep(latency)
+        if len(calls) <= tool_rounds and tool_choice != "none":
+            tool_call = SimpleNamespace(
+                id=f"call_{len(calls)}",
+                type="function",
+                function=SimpleNamespace(name="lookup_order", arguments=json.dumps({"order": len(calls)}))
+            )
+            message = SimpleNamespace(content=None, tool_calls=[tool_call])
+            return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="tool_calls")])
+        message = SimpleNamespace(content=json.dumps({"message": "done"}), tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")])
+
+    return call_model, calls
+
+
+class Command(BaseCommand):
+    help = "Counts model calls per webhook agent turn and times turns against a simulated model."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-tool-rounds", type=int, default=3, help="Benchmark turns with 0..N tool rounds.")
+        parser.add_argument("--latency", type=float, default=50.0, help="Simulated model latency in milliseconds.")
+        parser.add_argument("--tool-latency", type=float, default=10.0, help="Simulated tool latency in milliseconds.")
+
+    def handle(self, *args, **options):
+        latency = options["latency"] / 1000
+        tool_latency = options["tool_latency"] / 1000
+        self.stdout.write(
+            f"{'tool rounds':>11}  {'model calls':>11}  {'expected':>8}  {'previous flow':>13}  {'turn time':>9}"
+        )
+        for tool_rounds in range(options["max_tool_rounds"] + 1):
+            call_model, calls = scripted_model(tool_rounds, latency)
+
+            def run_tools(tool_calls):
+                time.sleep(tool_latency)
+                return [
+                    {"role": "tool", "tool_call_id": tool_call.id, "content": json.dumps({"result": "ok"})}
+                    for tool_call in tool_calls
+                ]
+
+            turn = AgentTurn([{"role": "user", "content": "Where is my order?"}], call_model, run_tools)
+            start = time.perf_counter()
+            turn.run()
+            elapsed = time.perf_counter() - start
+            expected = tool_rounds + 1
+            # The loop this replaced made a discarded first call, then two calls per tool round, then the reply call
+            previous = 2 + 2 * tool_rounds
+            self.stdout.write(
+                f"{tool_rounds:>11}  {turn.model_calls:>11}  {expected:>8}  {previous:>13}  {elapsed * 1000:>7.1f}ms"
+            )
+            if turn.model_calls != expected or len(calls) != expected:
+                raise CommandError(f"Turn with {tool_rounds} tool rounds made {turn.model_calls} model calls")
+        self.stdout.write(self.style.SUCCESS("Every turn made exactly one model call per reasoning step"))
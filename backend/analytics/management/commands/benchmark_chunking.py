@@ -0,0 +1,77 @@
+import os
+import random
+import time
+from django.core.management.base import BaseCommand
+from langchain_core.documents import Document
+from analytics.chunking import ChunkingEngine, chunk_splitter
+from analytics.ingest import iter_document_pages
+
+
+class Command(BaseCommand):
+    help = "Benchmarks chunking with a splitter built per page against one reused ChunkingEngine."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", help="Local PDF, TXT or DOCX file to chunk; synthetic pages are used if omitted.")
+        parser.add_argument("--pages", type=int, default=300, help="Number of synthetic pages.")
+        parser.add_argument("--words-per-page", type=int, default=500, help="Words per synthetic page.")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--chunk-overlap", type=int, default=100)
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per strategy; the best run is reported.")
+        parser.add_argument(
+            "--semantic",
+            choices=["openai", "tfidf"],
+            help="Benchmark semantic splitting with this sentence encoder; tfidf runs offline."
+        )
+
+    def handle(self, *args, **options):
+        pages = self.load_pages(options)
+        chunk_size = options["chunk_size"]
+        chunk_overlap = options["chunk_overlap"]
+        semantic = {"semantic": True, "semantic_encoder": options["semantic"]} if options["semantic"] else {}
+        self.stdout.write(
+            f"Chunking {len(pages)} pages (chunk_size={chunk_size}, chunk_overlap={chunk_overlap}, "
+            f"semantic={options['semantic'] or 'off'})"
+        )
+
+        def per_page():
+            return sum(
+                len(chunk_splitter(page, chunk_size=chunk_size, chunk_overlap=chunk_overlap, **semantic))
+                for page in pages
+            )
+
+        def reused():
+            engine = ChunkingEngine(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **semantic)
+            return sum(1 for _ in engine.chunk_documents(pages))
+
+        results = {}
+        for name, run in (("per-page construction", per_page), ("reused engine", reused)):
+            timings = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                chunks = run()
+                timings.append(time.perf_counter() - start)
+            results[name] = min(timings)
+            self.stdout.write(
+                f"{name:<24} {chunks} chunks  best {min(timings):0.3f}s  "
+                f"({min(timings) / len(pages) * 1000:0.2f} ms/page)"
+            )
+        speedup = results["per-page construction"] / results["reused engine"]
+        self.stdout.write(self.style.SUCCESS(f"Reused engine is {speedup:0.2f}x faster"))
+
+    def load_pages(self, options):
+        path = options.get("file")
+        if path:
+            file_ext = os.path.splitext(path)[1].lower()
+            return list(iter_document_pages(path, file_ext, source=path))
+        rng = random.Random(0)
+        vocabulary = [f"word{i}" for i in range(2000)]
+        return [
+            Document(
+                page_content=". ".join(
+                    " ".join(rng.choice(vocabulary) for _ in range(10))
+                    for _ in range(options["words_per_page"] // 10)
+                ) + ".",
+                metadata={"source": "synthetic.pdf", "page": number}
+            )
+            for number in range(options["pages"])
+        ]
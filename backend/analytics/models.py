@@ -109,6 +109,14 @@ class WebsiteLink(models.Model):
     update_dynamically = models.BooleanField(default=False)  # Flag to indicate if the link should be updated dynamically
     hash = models.CharField(max_length=64, blank=True, null=True)  # Unique hash for the URL
     indexed = models.BooleanField(default=False)  # Flag to indicate if the link has been indexed
+    chunk_hashes = models.JSONField(default=list, blank=True)  # Manifest of content hashes of the chunks stored in Pinecone
+    chunk_refs = models.JSONField(default=dict, blank=True)  # Near-duplicate chunks stored as references: digest -> chunk ID
+    crawl_depth = models.IntegerField(default=0)  # Link hops from the root link this link was grabbed from
+    crawled = models.BooleanField(default=False)  # Flag to indicate if the grabber has collected this link's outgoing links
+    etag = models.CharField(max_length=255, blank=True, null=True)  # ETag of the page when it was last indexed
+    last_modified = models.CharField(max_length=64, blank=True, null=True)  # Last-Modified header of the page when it was last indexed
+    content_length = models.BigIntegerField(blank=True, null=True)  # Size in bytes of the page when it was last indexed
+    fingerprint = models.CharField(max_length=64, blank=True, null=True)  # Hash of the raw page body when it was last indexed
 
     def __str__(self):
         return self.url
@@ -127,6 +135,8 @@ class KnowledgeFile(models.Model):
     original_name = models.CharField(max_length=255)
     doc_name = models.CharField(max_length=255, blank=True, null=True)  # For Pinecone metadata
     indexed = models.BooleanField(default=False)  # Flag to indicate if the file has been indexed
+    chunk_hashes = models.JSONField(default=list, blank=True)  # Manifest of content hashes of the chunks stored in Pinecone
+    chunk_refs = models.JSONField(default=dict, blank=True)  # Near-duplicate chunks stored as references: digest -> chunk ID
 
     def __str__(self):
         return self.original_name
@@ -149,6 +159,8 @@ class KnowledgeExcel(models.Model):
     original_name = models.CharField(max_length=255)
     excel_name = models.CharField(max_length=255, blank=True, null=True)  # For Pinecone metadata
     indexed = models.BooleanField(default=False)  # Flag to indicate if the file has been indexed
+    chunk_hashes = models.JSONField(default=list, blank=True)  # Manifest of content hashes of the chunks stored in Pinecone
+    chunk_refs = models.JSONField(default=dict, blank=True)  # Near-duplicate chunks stored as references: digest -> chunk ID
 
     def __str__(self):
         return self.original_name
@@ -219,15 +231,32 @@ class KnowledgeBase(models.Model):
     retrieval_method = models.CharField(
         max_length=50,
         default='dense',
-        choices=[('dense', 'Dense'), ('hybrid', 'Hybrid')]
+        choices=[('dense', 'Dense'), ('hybrid', 'Hybrid'), ('rrf', 'Hybrid (reciprocal rank fusion)')]
     )  # Retrieval method
     dynamic_links_enabled = models.BooleanField(default=True)  # Flag to indicate if dynamic links are enabled
     update_interval = models.DurationField(default=models.DurationField().to_python("10 00:00:00"))  # Default: 10 days
+    crawl_max_depth = models.IntegerField(default=3)  # How many link hops the grabber follows from a root link
+    crawl_max_pages = models.IntegerField(default=500)  # Maximum number of links the grabber adds to the knowledge base
+    sparse_doc_count = models.BigIntegerField(default=0)  # Chunks counted in the BM25 statistics of the local sparse encoder
+    sparse_total_length = models.BigIntegerField(default=0)  # Terms of those chunks, for the BM25 average chunk length
+    sparse_encoder = models.CharField(max_length=16, blank=True, default="")  # Sparse encoder of the stored chunks ("bm25" or "remote"), set on first indexing
 
     def __str__(self):
         return f"{self.name} ({self.uuid})"
 
 
+class SparseTerm(models.Model):
+    knowledge_base = models.ForeignKey('KnowledgeBase', on_delete=models.CASCADE, related_name="sparse_terms")
+    index = models.BigIntegerField()  # Sparse dimension of the term (its CRC32)
+    df = models.BigIntegerField(default=0)  # Chunks of the knowledge base containing the term
+
+    class Meta:
+        unique_together = ("knowledge_base", "index")
+
+    def __str__(self):
+        return f"SparseTerm({self.knowledge_base_id}, {self.index})"
+
+
 class UserTool(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='user_tools')
     name = models.CharField(max_length=100)
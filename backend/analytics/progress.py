@@ -0,0 +1,116 @@
+import os
+import time
+import threading
+from celery.result import AsyncResult
+from django.core.cache import cache
+from backend.settings import logger
+
+
+INDEX_PROGRESS_TTL = 24 * 3600  # Matches CELERY_RESULT_EXPIRES
+INDEX_PROGRESS_PUBLISH_INTERVAL = float(os.getenv("INDEX_PROGRESS_PUBLISH_INTERVAL", 2.0))  # Seconds between meta writes
+
+
+class IndexProgress:
+    """
+    Progress of one knowledge base indexing job, shared by the job's subtasks.
+    Counters live in the Django cache (Redis) and are incremented atomically, so concurrent subtasks can report
+    without coordination. Snapshots are published as the PROGRESS meta of the job's Celery task, at most once
+    per `publish_interval` seconds per process, so clients polling get_task_status read a single result key.
+    """
+
+    COUNTERS = ("sources_total", "sources_done", "chunks_embedded", "chunks_upserted")
+
+    def __init__(self, job_id: str, publish_interval: float = INDEX_PROGRESS_PUBLISH_INTERVAL):
+        self.job_id = job_id
+        self.publish_interval = publish_interval
+        self._last_publish = 0.0
+        self._lock = threading.Lock()
+
+    def key(self, field: str) -> str:
+        return f"index_progress:{self.job_id}:{field}"
+
+    def start(self, kb_uuid: str, sources_total: int) -> None:
+        """
+        Resets the counters for a job indexing `sources_total` sources and publishes the first snapshot.
+        """
+        values = {self.key(field): 0 for field in self.COUNTERS}
+        values[self.key("sources_total")] = sources_total
+        values[self.key("kb_uuid")] = kb_uuid
+        values[self.key("started_at")] = time.time()
+        cache.set_many(values, timeout=INDEX_PROGRESS_TTL)
+        self.publish(force=True)
+
+    def add(self, **counts) -> None:
+        """
+        Increments counters, e.g. add(chunks_upserted=100), then publishes a snapshot if one is due.
+        Errors are logged and never interrupt indexing.
+        """
+        try:
+            for field, count in counts.items():
+                if count:
+                    try:
+                        cache.incr(self.key(field), count)
+                    except ValueError:
+                        cache.add(self.key(field), 0, timeout=INDEX_PROGRESS_TTL)
+                        cache.incr(self.key(field), count)
+            self.publish()
+        except Exception as e:
+            logger.warning(f"Failed to record progress of indexing job {self.job_id}: {e}")
+
+    def mark_done(self, source_keys) -> int:
+        """
+        Counts sources as done once each, however often they are reported: a redelivered subtask reports its
+        sources again. `source_keys` identify the sources within the job, e.g. "file:12".
+        Returns:
+            int: The number of sources newly counted.
+        """
+        try:
+            count = sum(
+                1 for source_key in source_keys
+                if cache.add(self.key(f"done:{source_key}"), 1, timeout=INDEX_PROGRESS_TTL)
+            )
+        except Exception as e:
+            logger.warning(f"Failed to record done sources of indexing job {self.job_id}: {e}")
+            return 0
+        self.add(sources_done=count)
+        return count
+
+    def snapshot(self) -> dict:
+        """
+        Returns:
+            dict: The counters, elapsed seconds and the ETA in seconds, extrapolated from the sources done so far
+                (None until the first source is done).
+        """
+        fields = self.COUNTERS + ("kb_uuid", "started_at")
+        values = cache.get_many([self.key(field) for field in fields])
+        snapshot = {field: values.get(self.key(field)) for field in fields}
+        for field in self.COUNTERS:
+            snapshot[field] = snapshot[field] or 0
+        started_at = snapshot.pop("started_at", None) or time.time()
+        elapsed = time.time() - started_at
+        done, total = snapshot["sources_done"], snapshot["sources_total"]
+        snapshot["elapsed_seconds"] = round(elapsed, 1)
+        snapshot["eta_seconds"] = round(elapsed / done * max(total - done, 0), 1) if done else None
+        return snapshot
+
+    def publish(self, force: bool = False) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_publish < self.publish_interval:
+                return
+            self._last_publish = now
+        AsyncResult(self.job_id).backend.store_result(self.job_id, self.snapshot(), "PROGRESS")
+
+    def finish(self, result: dict) -> dict:
+        """
+        Stores the final result of the job as its SUCCESS result, with the final counters under "progress".
+        """
+        result = dict(result, progress=self.snapshot())
+        AsyncResult(self.job_id).backend.store_result(self.job_id, result, "SUCCESS")
+        return result
+
+    def fail(self, exc: Exception, traceback: str = None) -> None:
+        """
+        Stores `exc` as the FAILURE result of the job.
+        """
+        AsyncResult(self.job_id).backend.mark_as_failure(self.job_id, exc, traceback=traceback)
@@ -0,0 +1,235 @@
+import os
+import time
+import threading
+from typing import List
+import numpy as np
+from .indexing import retrieve
+from .retrieval_cache import retrieval_cache
+from .sparse import tokenize
+from .vectorstore import VectorStore
+from backend.settings import logger
+
+
+RERANKER = os.getenv("RERANKER", "lexical")  # "lexical", "cross-encoder" or "mmr"
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.7))  # Relevance vs. diversity trade-off of the MMR pass
+
+_cross_encoders = {}
+_cross_encoders_lock = threading.Lock()
+
+
+def match_context(match: dict) -> str:
+    return (match.get("metadata") or {}).get("context", "") or ""
+
+
+def as_match(match) -> dict:
+    """
+    Copies a store match (a dict or a Pinecone ScoredVector) into a plain {"id", "score", "metadata"} dict.
+    """
+    return {"id": match["id"], "score": match.get("score"), "metadata": match.get("metadata") or {}}
+
+
+class Reranker:
+    """
+    Reorders retrieved candidates for a query and keeps the best `top_k`.
+    Rerankers set "rerank_score" on the matches they return.
+    """
+
+    name = ""
+
+    def rerank(self, query: str, matches: List[dict], top_k: int) -> List[dict]:
+        raise NotImplementedError
+
+
+class LexicalOverlapReranker(Reranker):
+    """
+    Orders candidates by the share of the query's terms their context contains; ties keep the retrieval order.
+    Costs microseconds and no model, and recovers exact-term matches (product names, codes) that dense
+    retrieval ranks too low.
+    """
+
+    name = "lexical"
+
+    def rerank(self, query: str, matches: List[dict], top_k: int) -> List[dict]:
+        terms = set(tokenize(query))
+        if not terms:
+            return matches[:top_k]
+        for match in matches:
+            match["rerank_score"] = len(terms.intersection(tokenize(match_context(match)))) / len(terms)
+        return sorted(matches, key=lambda match: match["rerank_score"], reverse=True)[:top_k]
+
+
+def get_cross_encoder(model_name: str = CROSS_ENCODER_MODEL):
+    """
+    Returns the process-wide cross-encoder for a model, loaded on first use.
+    Requires the optional sentence-transformers package.
+    """
+    with _cross_encoders_lock:
+        if model_name not in _cross_encoders:
+            from sentence_transformers import CrossEncoder
+            _cross_encoders[model_name] = CrossEncoder(model_name)
+        return _cross_encoders[model_name]
+
+
+class CrossEncoderReranker(Reranker):
+    """
+    Scores each (query, context) pair with a local cross-encoder (CROSS_ENCODER_MODEL). The most accurate
+    reranker and the slowest, roughly linear in the number of candidates. Falls back to lexical overlap when
+    the model can't be loaded.
+    """
+
+    name = "cross-encoder"
+
+    def __init__(self, model_name: str = CROSS_ENCODER_MODEL):
+        self.model_name = model_name
+
+    def rerank(self, query: str, matches: List[dict], top_k: int) -> List[dict]:
+        try:
+            model = get_cross_encoder(self.model_name)
+        except Exception as e:
+            logger.warning(f"Cross-encoder {self.model_name} unavailable, reranking by lexical overlap: {e}")
+            return LexicalOverlapReranker().rerank(query, matches, top_k)
+        scores = model.predict([(query, match_context(match)) for match in matches])
+        for match, score in zip(matches, scores):
+            match["rerank_score"] = float(score)
+        return sorted(matches, key=lambda match: match["rerank_score"], reverse=True)[:top_k]
+
+
+class MMRReranker(Reranker):
+    """
+    Maximal marginal relevance: picks candidates greedily by
+    lambda * relevance - (1 - lambda) * max similarity to the candidates already picked,
+    so near-identical chunks don't fill the context. Relevance is the retrieval score scaled to [0, 1];
+    similarity is the cosine of the contexts' term-frequency vectors, so the pass needs no extra embeddings.
+    """
+
+    name = "mmr"
+
+    def __init__(self, lambda_: float = MMR_LAMBDA):
+        self.lambda_ = lambda_
+
+    def rerank(self, query: str, matches: List[dict], top_k: int) -> List[dict]:
+        if len(matches) <= 1:
+            return matches[:top_k]
+        relevance = np.array([match.get("score") or 0.0 for match in matches], dtype=float)
+        spread = relevance.max() - relevance.min()
+        relevance = (relevance - relevance.min()) / spread if spread else np.ones(len(matches))
+        similarity = self.similarity_matrix([match_context(match) for match in matches])
+        selected = []
+        redundancy = np.zeros(len(matches))
+        remaining = list(range(len(matches)))
+        while remaining and len(selected) < top_k:
+            scores = self.lambda_ * relevance[remaining] - (1 - self.lambda_) * redundancy[remaining]
+            best = remaining.pop(int(np.argmax(scores)))
+            matches[best]["rerank_score"] = float(scores.max())
+            selected.append(best)
+            redundancy = np.maximum(redundancy, similarity[best])
+        return [matches[row] for row in selected]
+
+    @staticmethod
+    def similarity_matrix(texts: List[str]) -> np.ndarray:
+        vocabulary = {}
+        rows = [[vocabulary.setdefault(token, len(vocabulary)) for token in tokenize(text)] for text in texts]
+        matrix = np.zeros((len(texts), max(len(vocabulary), 1)))
+        for row, columns in enumerate(rows):
+            np.add.at(matrix[row], columns, 1.0)
+        norms = np.linalg.norm(matrix, axis=1)
+        norms[norms == 0] = 1.0
+        matrix = matrix / norms[:, None]
+        return matrix @ matrix.T
+
+
+RERANKERS = {
+    "lexical": LexicalOverlapReranker,
+    "cross-encoder": CrossEncoderReranker,
+    "mmr": MMRReranker,
+}
+
+
+def get_reranker(name: str = None) -> Reranker:
+    """
+    Returns the reranker registered under `name`, RERANKER by default.
+    """
+    name = name or RERANKER
+    if name not in RERANKERS:
+        raise ValueError(f"Unsupported reranker: {name}")
+    return RERANKERS[name]()
+
+
+def retrieve_for_knowledge_base(
+    text: str,
+    kb,
+    store: VectorStore = None,
+    retrieval_method: str = None,
+    reranker: Reranker = None
+) -> dict:
+    """
+    Retrieval pipeline of a knowledge base, driven by its settings.
+    Results are served from the retrieval cache until the knowledge base's vectors change.
+    With reranking enabled, `kb.top_k` candidates are retrieved and the reranker keeps `kb.top_k_after_reranking`
+    of them; otherwise `kb.top_k_after_reranking` matches are retrieved directly.
+    Args:
+        text (str): The query text.
+        kb (KnowledgeBase): The knowledge base to search.
+        store (VectorStore): The vector store; defaults to get_vector_store().
+        retrieval_method (str): Overrides kb.retrieval_method.
+        reranker (Reranker): Overrides get_reranker().
+    Returns:
+        dict: The matches under "matches", the reranker used (None when disabled) under "reranker", the
+            per-stage latency in milliseconds under "timings" ("retrieval_ms", "rerank_ms", "total_ms"), and
+            whether the result came from the retrieval cache under "cached".
+    """
+    start = time.perf_counter()
+    namespace = str(kb.uuid)
+    method = retrieval_method or kb.retrieval_method or "dense"
+    final_k = max(kb.top_k_after_reranking or 1, 1)
+    candidates_k = max(kb.top_k or 0, final_k) if kb.reranking_enabled else final_k
+    if kb.reranking_enabled:
+        try:
+            reranker = reranker or get_reranker()
+        except ValueError as e:
+            logger.error(f"Reranking disabled for KB {namespace}: {e}")
+            reranker = None
+    else:
+        reranker = None
+    reranker_name = reranker.name if reranker is not None else None
+
+    cache_key, cached = retrieval_cache.lookup(
+        namespace, text, method=method, k=candidates_k, final_k=final_k,
+        reranker=reranker_name, sparse_weightage=kb.sparse_weightage
+    )
+    if cached is not None:
+        total_ms = round((time.perf_counter() - start) * 1000, 1)
+        timings = {"retrieval_ms": 0.0, "rerank_ms": 0.0, "total_ms": total_ms}
+        logger.info(f"Retrieval for KB {namespace}: cache hit, returned={len(cached['matches'])} timings={timings}")
+        return dict(cached, timings=timings, cached=True)
+
+    result = retrieve(
+        text, namespace, store=store, k=candidates_k,
+        retrieval_method=method, sparse_weightage=kb.sparse_weightage
+    )
+    succeeded = bool(result) and "matches" in result
+    matches = [as_match(match) for match in result["matches"]] if succeeded else []
+    retrieved = time.perf_counter()
+
+    if reranker is not None and matches:
+        try:
+            matches = reranker.rerank(text, matches, final_k)
+        except Exception as e:
+            succeeded = False
+            logger.error(f"Reranking failed for KB {namespace}, keeping retrieval order: {e}")
+    matches = matches[:final_k]
+    end = time.perf_counter()
+
+    if succeeded:
+        retrieval_cache.store(cache_key, {"matches": matches, "reranker": reranker_name})
+    timings = {
+        "retrieval_ms": round((retrieved - start) * 1000, 1),
+        "rerank_ms": round((end - retrieved) * 1000, 1),
+        "total_ms": round((end - start) * 1000, 1),
+    }
+    logger.info(
+        f"Retrieval for KB {namespace}: method={method} candidates={candidates_k} reranker={reranker_name} "
+        f"returned={len(matches)} timings={timings}"
+    )
+    return {"matches": matches, "reranker": reranker_name, "timings": timings, "cached": False}
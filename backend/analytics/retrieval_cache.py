@@ -0,0 +1,98 @@
+import os
+import re
+import json
+import hashlib
+from typing import Optional
+from django.core.cache import cache
+from .version_counters import bump_version_counter, get_version_counters
+from backend.settings import logger
+
+
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() != "false"
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", 6 * 3600))  # 6 hours
+WORD = re.compile(r"\w+")
+
+
+def normalize_query(text: str) -> str:
+    """
+    Case, whitespace and punctuation-insensitive form of a query, so "Refund policy?" and "refund  policy"
+    share a cache entry.
+    """
+    return " ".join(WORD.findall(text.lower()))
+
+
+def namespace_version_key(namespace: str) -> str:
+    return f"retrieval_version:{namespace}"
+
+
+def get_namespace_version(namespace: str) -> Optional[int]:
+    """
+    Returns the retrieval version of a knowledge base namespace, or None if the cache is unreachable.
+    """
+    try:
+        return get_version_counters([namespace_version_key(namespace)])[0]
+    except Exception as e:
+        logger.warning(f"Failed to read retrieval version of {namespace}: {e}")
+        return None
+
+
+def bump_namespace_version(namespace: str) -> None:
+    """
+    Invalidates every cached retrieval result of a namespace. Called whenever vectors of the namespace are
+    written or deleted; errors are logged and never interrupt the write.
+    """
+    try:
+        bump_version_counter(namespace_version_key(namespace))
+    except Exception as e:
+        logger.warning(f"Failed to bump retrieval version of {namespace}: {e}")
+
+
+class RetrievalCache:
+    """
+    Cache of retrieval results in the Django cache (Redis), keyed by
+    (namespace, namespace version, normalized query, retrieval parameters).
+    Bumping the namespace version makes every earlier entry unreachable; entries then expire after `ttl`.
+    Hit and miss counts are kept in `stats`.
+    """
+
+    def __init__(self, ttl: int = RETRIEVAL_CACHE_TTL, enabled: bool = RETRIEVAL_CACHE_ENABLED):
+        self.ttl = ttl
+        self.enabled = enabled
+        self.stats = {"hits": 0, "misses": 0}
+
+    def key(self, namespace: str, version: int, text: str, params: dict) -> str:
+        payload = json.dumps([normalize_query(text), params], sort_keys=True, default=str)
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        return f"retrieval:{namespace}:{version}:{digest}"
+
+    def lookup(self, namespace: str, text: str, **params) -> tuple:
+        """
+        Looks a query up, e.g. lookup(namespace, text, method="hybrid", k=10).
+        Returns:
+            tuple: The cache key to store the result under (None if caching is unavailable) and the cached
+                result (None on a miss).
+        """
+        if not self.enabled:
+            return None, None
+        version = get_namespace_version(namespace)
+        if version is None:
+            return None, None
+        key = self.key(namespace, version, text, params)
+        try:
+            cached = cache.get(key)
+        except Exception as e:
+            logger.warning(f"Retrieval cache lookup failed: {e}")
+            cached = None
+        self.stats["hits" if cached is not None else "misses"] += 1
+        return key, cached
+
+    def store(self, key: Optional[str], result: dict) -> None:
+        if key is None:
+            return
+        try:
+            cache.set(key, result, timeout=self.ttl)
+        except Exception as e:
+            logger.warning(f"Retrieval cache store failed: {e}")
+
+
+retrieval_cache = RetrievalCache()
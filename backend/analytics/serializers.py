@@ -45,7 +45,8 @@ class KnowledgeBaseSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'name', 'uuid', 'created_at', 'updated_at',
             'embedding_type', 'chunk_size', 'chunk_overlap', 'retrieval_method',
-            'reranking_enabled', 'top_k', 'top_k_after_reranking', 'sparse_weightage', 'update_interval'
+            'reranking_enabled', 'top_k', 'top_k_after_reranking', 'sparse_weightage', 'update_interval',
+            'crawl_max_depth', 'crawl_max_pages'
         ]
 
 
@@ -0,0 +1,74 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .agent_snapshot import forget_user_email
+from .config_versions import bump_config_version
+from .models import (
+    AssistantConfiguration,
+    IntegrationFeature,
+    Integrations,
+    KnowledgeBase,
+    KnowledgeDataExcel,
+    UserTool,
+)
+from .tool_registry import invalidate_tool_registries
+
+
+def bump_knowledge_base_agents(knowledge_base_id) -> None:
+    if knowledge_base_id is None:
+        return
+    agent_uuids = AssistantConfiguration.objects.filter(
+        knowledge_base_id=knowledge_base_id
+    ).values_list("assistant_uuid", flat=True)
+    for agent_uuid in agent_uuids:
+        bump_config_version("agent", agent_uuid)
+
+
+@receiver([post_save, post_delete], sender=UserTool)
+def user_tool_changed(sender, instance, **kwargs):
+    invalidate_tool_registries(instance.user_id)
+    bump_config_version("user", instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=AssistantConfiguration)
+def assistant_configuration_changed(sender, instance, **kwargs):
+    bump_config_version("agent", instance.assistant_uuid)
+
+
+@receiver([post_save, post_delete], sender=KnowledgeBase)
+def knowledge_base_changed(sender, instance, **kwargs):
+    bump_knowledge_base_agents(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=KnowledgeDataExcel)
+def knowledge_data_excel_changed(sender, instance, **kwargs):
+    bump_knowledge_base_agents(instance.knowledge_base_id)
+
+
+@receiver([post_save, post_delete], sender=Integrations)
+def integration_changed(sender, instance, **kwargs):
+    bump_config_version("user", instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=IntegrationFeature)
+def integration_feature_changed(sender, instance, **kwargs):
+    user_id = Integrations.objects.filter(pk=instance.integration_id).values_list("user_id", flat=True).first()
+    bump_config_version("user", user_id)
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def user_email_changing(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None or (update_fields is not None and "email" not in update_fields):
+        return
+    previous_email = sender.objects.filter(pk=instance.pk).values_list("email", flat=True).first()
+    if previous_email and previous_email != instance.email:
+        forget_user_email(previous_email)
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields == frozenset({"last_login"}):
+        return
+    bump_config_version("user", instance.pk)
+    if kwargs.get("signal") is post_delete and instance.email:
+        forget_user_email(instance.email)
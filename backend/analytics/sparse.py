@@ -0,0 +1,280 @@
+import os
+import re
+import time
+import zlib
+import threading
+from collections import Counter, defaultdict
+from typing import List
+import numpy as np
+from django.db.models import F
+from .models import KnowledgeBase, KnowledgeExcel, KnowledgeFile, SparseTerm, WebsiteLink
+from backend.settings import logger
+
+
+# Encoder of knowledge bases indexed for the first time: "bm25" (in-process) or "remote" (SPARSE_EMBEDDINGS_API_URL)
+SPARSE_ENCODER = os.getenv("SPARSE_ENCODER", "bm25")
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_DEFAULT_AVGDL = 150.0  # Words per chunk assumed until a knowledge base has statistics
+SPARSE_VOCABULARY_TTL = 60  # Seconds a process reuses a knowledge base's chunk count and length for queries
+SPARSE_TERM_BATCH_SIZE = 1000  # Terms per statement when document frequencies are incremented
+EMPTY_SPARSE_VECTOR = {'indices': [0], 'values': [0.1]}  # Stand-in for texts without terms; Pinecone rejects empty ones
+TOKEN = re.compile(r"\w+")
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for from has have he her his i in is it its me my not of on or our she so "
+    "that the their them they this to was we were what when which who will with you your".split()
+)
+
+_vocabularies = {}
+_vocabularies_lock = threading.Lock()
+_encoder_names = {}
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN.findall(text.lower()) if len(token) > 1 and token not in STOP_WORDS]
+
+
+def token_index(token: str) -> int:
+    """
+    Sparse dimension of a token: its CRC32, so no vocabulary has to be shipped to map tokens to indices.
+    """
+    return zlib.crc32(token.encode("utf-8"))
+
+
+def empty_vocabulary() -> dict:
+    return {"id": None, "n_docs": 0, "total_length": 0}
+
+
+def load_vocabulary(namespace: str, max_age: float = SPARSE_VOCABULARY_TTL) -> dict:
+    """
+    Chunk count and total length of a knowledge base's BM25 statistics, cached in-process for `max_age` seconds.
+    Document frequencies are SparseTerm rows, loaded per query by load_document_frequencies().
+    """
+    now = time.monotonic()
+    with _vocabularies_lock:
+        cached = _vocabularies.get(namespace)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+    try:
+        kb = KnowledgeBase.objects.filter(uuid=namespace).values("id", "sparse_doc_count", "sparse_total_length").first()
+    except Exception as e:
+        logger.warning(f"Failed to load sparse vocabulary of {namespace}: {e}")
+        kb = None
+    vocabulary = empty_vocabulary()
+    if kb is not None:
+        vocabulary = {"id": kb["id"], "n_docs": kb["sparse_doc_count"], "total_length": kb["sparse_total_length"]}
+    with _vocabularies_lock:
+        _vocabularies[namespace] = (now + max_age, vocabulary)
+    return vocabulary
+
+
+def load_document_frequencies(knowledge_base_id, indices) -> dict:
+    """
+    Stored document frequencies of the given sparse dimensions; dimensions without a row are left out.
+    """
+    if knowledge_base_id is None or not indices:
+        return {}
+    try:
+        return dict(
+            SparseTerm.objects.filter(knowledge_base_id=knowledge_base_id, index__in=list(indices)).values_list("index", "df")
+        )
+    except Exception as e:
+        logger.warning(f"Failed to load document frequencies of KB {knowledge_base_id}: {e}")
+        return {}
+
+
+class SparseEncoder:
+    """
+    Encodes texts into Pinecone-style sparse vectors ({"indices", "values"}).
+    Documents and queries may be weighted differently; save() persists whatever the encoder learned while
+    encoding documents.
+    """
+
+    def encode_documents(self, texts: List[str]) -> List[dict]:
+        raise NotImplementedError
+
+    def encode_queries(self, texts: List[str]) -> List[dict]:
+        raise NotImplementedError
+
+    def save(self) -> None:
+        pass
+
+
+class BM25SparseEncoder(SparseEncoder):
+    """
+    In-process BM25 encoder with per-knowledge-base statistics.
+    Documents get saturated term frequencies, tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)); queries get
+    normalized IDF weights, so the sparse dot product of a query and a chunk is the chunk's BM25 score.
+    Document frequencies, chunk count and total length are fitted while documents are encoded and added by save()
+    as increments: one SparseTerm row per term and two counters on the knowledge base, so concurrent indexing
+    subtasks add up without locking the knowledge base. Queries load only the frequencies of their own terms.
+    They are not decremented when chunks are deleted.
+    """
+
+    def __init__(self, namespace: str = None, k1: float = BM25_K1, b: float = BM25_B):
+        self.namespace = namespace
+        self.k1 = k1
+        self.b = b
+        self.stored = load_vocabulary(namespace) if namespace else empty_vocabulary()
+        self.n_docs = 0
+        self.total_length = 0
+        self.df = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def avgdl(self) -> float:
+        n_docs = self.stored["n_docs"] + self.n_docs
+        if not n_docs:
+            return BM25_DEFAULT_AVGDL
+        return (self.stored["total_length"] + self.total_length) / n_docs
+
+    def encode_documents(self, texts: List[str]) -> List[dict]:
+        counts = [Counter(token_index(token) for token in tokenize(text)) for text in texts]
+        with self._lock:
+            for tf in counts:
+                self.n_docs += 1
+                self.total_length += sum(tf.values())
+                self.df.update(tf.keys())
+            avgdl = self.avgdl
+        vectors = []
+        for tf in counts:
+            if not tf:
+                vectors.append(dict(EMPTY_SPARSE_VECTOR))
+                continue
+            indices = np.fromiter(tf.keys(), dtype=np.int64, count=len(tf))
+            frequencies = np.fromiter(tf.values(), dtype=np.float32, count=len(tf))
+            length = frequencies.sum()
+            values = frequencies * (self.k1 + 1) / (frequencies + self.k1 * (1 - self.b + self.b * length / avgdl))
+            vectors.append({"indices": indices.tolist(), "values": values.tolist()})
+        return vectors
+
+    def encode_queries(self, texts: List[str]) -> List[dict]:
+        n_docs = self.stored["n_docs"] + self.n_docs
+        terms = [sorted({token_index(token) for token in tokenize(text)}) for text in texts]
+        stored_df = load_document_frequencies(self.stored["id"], {index for indices in terms for index in indices})
+        vectors = []
+        for indices in terms:
+            if not indices:
+                vectors.append(dict(EMPTY_SPARSE_VECTOR))
+                continue
+            df = np.array([stored_df.get(index, 0) + self.df.get(index, 0) for index in indices], dtype=np.float32)
+            idf = np.log((n_docs + 1) / (df + 0.5))
+            idf = np.clip(idf, 1e-6, None)
+            vectors.append({"indices": indices, "values": (idf / idf.sum()).tolist()})
+        return vectors
+
+    def save(self) -> None:
+        """
+        Adds the statistics fitted since the last save to the knowledge base's statistics. Each statement is an
+        atomic increment, so a save that fails midway leaves only part of its increments applied.
+        """
+        if not self.namespace or not self.n_docs:
+            return
+        with self._lock:
+            n_docs, total_length, df = self.n_docs, self.total_length, self.df
+            self.n_docs, self.total_length, self.df = 0, 0, Counter()
+        try:
+            kb_id = self.stored["id"] or KnowledgeBase.objects.filter(uuid=self.namespace).values_list("id", flat=True).first()
+            if kb_id is None:
+                return
+            indices = sorted(df)
+            for start in range(0, len(indices), SPARSE_TERM_BATCH_SIZE):
+                batch = indices[start:start + SPARSE_TERM_BATCH_SIZE]
+                SparseTerm.objects.bulk_create(
+                    [SparseTerm(knowledge_base_id=kb_id, index=index) for index in batch], ignore_conflicts=True
+                )
+                # One UPDATE per distinct count; most terms occur in one or a few chunks
+                by_count = defaultdict(list)
+                for index in batch:
+                    by_count[df[index]].append(index)
+                for count, group in by_count.items():
+                    SparseTerm.objects.filter(knowledge_base_id=kb_id, index__in=group).update(df=F("df") + count)
+            KnowledgeBase.objects.filter(id=kb_id).update(
+                sparse_doc_count=F("sparse_doc_count") + n_docs,
+                sparse_total_length=F("sparse_total_length") + total_length,
+            )
+            with _vocabularies_lock:
+                _vocabularies.pop(self.namespace, None)
+            self.stored = load_vocabulary(self.namespace)
+            logger.info(f"Sparse vocabulary of KB {self.namespace}: {self.stored['n_docs']} chunks, {len(indices)} terms updated")
+        except Exception as e:
+            logger.error(f"Failed to save sparse vocabulary of KB {self.namespace}: {e}")
+
+
+class RemoteSparseEncoder(SparseEncoder):
+    """
+    Sparse encoder backed by the Sparse Embeddings API (SPARSE_EMBEDDINGS_API_URL), batched, cached and
+    sent over the shared keep-alive session.
+    """
+
+    def encode_documents(self, texts: List[str]) -> List[dict]:
+        from .indexing import get_sparse_vectors
+        return get_sparse_vectors(texts)
+
+    def encode_queries(self, texts: List[str]) -> List[dict]:
+        from .indexing import get_sparse_vectors
+        return get_sparse_vectors(texts)
+
+
+def knowledge_base_sparse_encoder(namespace: str, indexing: bool = False) -> str:
+    """
+    Name of the sparse encoder whose vectors a knowledge base stores, so its chunks and queries share one space.
+    Resolved in order: the name recorded on the knowledge base; "bm25" if it has BM25 statistics; "remote" if it
+    has sources indexed before encoders were recorded; SPARSE_ENCODER otherwise. Indexing records the resolved
+    name, so it never changes afterwards; switching a knowledge base to another encoder requires clearing the
+    field and re-indexing all its sources.
+    Names used for queries are cached in-process for SPARSE_VOCABULARY_TTL seconds.
+    """
+    now = time.monotonic()
+    if not indexing:
+        with _vocabularies_lock:
+            cached = _encoder_names.get(namespace)
+            if cached is not None and cached[0] > now:
+                return cached[1]
+        name = resolve_sparse_encoder(namespace, indexing=False)
+        with _vocabularies_lock:
+            _encoder_names[namespace] = (now + SPARSE_VOCABULARY_TTL, name)
+        return name
+    name = resolve_sparse_encoder(namespace, indexing=True)
+    with _vocabularies_lock:
+        _encoder_names.pop(namespace, None)
+    return name
+
+
+def resolve_sparse_encoder(namespace: str, indexing: bool) -> str:
+    try:
+        kb = KnowledgeBase.objects.filter(uuid=namespace).values("id", "sparse_encoder").first()
+    except Exception as e:
+        logger.warning(f"Failed to load the sparse encoder of {namespace}: {e}")
+        kb = None
+    if kb is None:
+        return SPARSE_ENCODER
+    if kb["sparse_encoder"]:
+        return kb["sparse_encoder"]
+    if load_vocabulary(namespace)["n_docs"]:
+        name = "bm25"
+    elif any(
+        model.objects.filter(knowledge_base_id=kb["id"], indexed=True).exists()
+        for model in (KnowledgeFile, KnowledgeExcel, WebsiteLink)
+    ):
+        name = "remote"
+    else:
+        name = SPARSE_ENCODER
+    if not indexing:
+        return name
+    KnowledgeBase.objects.filter(id=kb["id"], sparse_encoder="").update(sparse_encoder=name)
+    return KnowledgeBase.objects.filter(id=kb["id"]).values_list("sparse_encoder", flat=True).first() or name
+
+
+def get_sparse_encoder(namespace: str = None, for_query: bool = False) -> SparseEncoder:
+    """
+    Returns the sparse encoder for a knowledge base namespace: the one recorded on the knowledge base (see
+    knowledge_base_sparse_encoder()), or SPARSE_ENCODER without a namespace.
+    Args:
+        namespace (str): The knowledge base namespace.
+        for_query (bool): True for retrieval; indexing records the encoder on the knowledge base if it has none yet.
+    """
+    name = knowledge_base_sparse_encoder(namespace, indexing=not for_query) if namespace else SPARSE_ENCODER
+    if name == "remote":
+        return RemoteSparseEncoder()
+    return BM25SparseEncoder(namespace)
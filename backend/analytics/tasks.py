@@ -1,4 +1,5 @@
-from celery import shared_task
+from celery import chord, shared_task
+from celery.exceptions import Ignore
 from datetime import datetime
 import traceback
 import os
@@ -13,6 +14,7 @@ from langchain_openai import OpenAIEmbeddings
 from sklearn.metrics.pairwise import cosine_similarity
 from .constants import AGENT_SYSTEM_PROMPT
 from jinja2 import Template
+from .config_versions import get_config_versions
 from .models import AssistantConfiguration
 from django.contrib.auth import get_user_model
 from .models import (
@@ -27,15 +29,19 @@ from .indexing import (
     index_uploaded_documents,
     index_scraped_links_with_jina,
     index_excel_documents,
-    scrape_link
+    split_changed_links,
+    LINK_VALIDATOR_FIELDS
 )
-from urllib.parse import urlparse, urljoin
-import linkGrabber
-from collections import deque
+from .chunking import ChunkingEngine
+from .dedup import ChunkDeduplicator
+from .progress import IndexProgress
+from .crawler import LinkCrawler
 import pandas as pd
-from pinecone import Pinecone
 # from more_itertools import chunked
 from django.utils import timezone
+from django.core.cache import cache
+from django.db.models import DateTimeField, ExpressionWrapper, F
+from django.db.models.functions import Now
 from backend.settings import logger
 from PIL import Image
 from gql import gql, Client
@@ -137,207 +143,17 @@ def run_test_task(run_id, idx, config, test_case, model_uuid, user_id=None):
     }
 
 
-def build_final_prompt(config):
-    """
-    Build the final system prompt for the agent based on the configuration.
-    Args:
-        config (dict): Configuration dictionary containing agent settings.
-    Returns:
-        str: The final system prompt rendered with the provided configuration.
-    """
-    logger.debug("build_final_prompt called")
-
-    def get_val(key, default=None):
-        if isinstance(config, dict):
-            return config.get(key, default)
-        return getattr(config, key, default)
-
-    agent_name = get_val("agent_name")
-    organisation_name = get_val("organisation_name")
-    organisation_description = get_val("organisation_description")
-    conversation_tone = get_val("conversation_tone")
-    examples = get_val("examples")
-    goal = get_val("goal")
-    use_last_user_language = get_val("use_last_user_language", True)
-    languages = get_val("languages")
-    enable_emojis = get_val("enable_emojis", False)
-    answer_competitor_queries = get_val("answer_competitor_queries", False)
-    competitor_response_bias = get_val("competitor_response_bias", "genuine")
-    system_instructions = get_val("system_instructions") or get_val("systemInstructions") or ""
-    # selected_tools = get_val("selected_tools") or []
-
-    # --- DataExcel summary logic ---
-    data_excel = None
-    knowledge_base = get_val("knowledge_base")
-    if knowledge_base:
-
-        if isinstance(knowledge_base, KnowledgeBase):
-            kb_obj = knowledge_base
-        else:
-            try:
-                kb_obj = KnowledgeBase.objects.get(pk=knowledge_base).first()
-            except Exception:
-                kb_obj = None
-        if kb_obj:
-            data_excels = kb_obj.knowledge_data_excels.all()
-            if data_excels.exists():
-                data_excel = "\n\n".join([f"{de.original_name}:\n{de.summary}" for de in data_excels if de.summary])
-
-    selected_tools = []
-
-    # Append AGENT_TOOLS
-    for tool in AGENT_TOOLS:
-        func = tool.get("function", {})
-        name = func.get("name")
-        description = func.get("description", "")
-        selected_tools.append({
-            "name": name,
-            "description": description
-        })
-
-    # Append INTEGRATION_TOOLS
-    integration_tool_ids = get_val("integration_tools", [])
-    for tool_id in integration_tool_ids:
-        tool = INTEGRATION_TOOLS.get(tool_id)
-        if tool:
-            func = tool.get("function", {})
-            selected_tools.append({
-                "name": func.get("name"),
-                "description": func.get("description", "")
-            })
-
-    context = {
-        "agent_name": agent_name,
-        "organisation_name": organisation_name,
-        "organisation_description": organisation_description if organisation_description != "None" else None,
-        "conversation_tone": conversation_tone if conversation_tone not in (None, "None") else None,
-        "examples": examples if examples and examples != "None" else None,
-        "goal": goal if goal and goal != "None" else None,
-        "use_last_user_language": use_last_user_language,
-        "languages": languages,
-        "enable_emojis": enable_emojis,
-        "answer_competitor_queries": answer_competitor_queries,
-        "competitor_response_bias": competitor_response_bias,
-        "system_instructions": system_instructions,
-        "data_excel": data_excel,
-        "selected_tools": selected_tools  # add selected_tools here
-    }
-
-    system_prompt_template = AGENT_SYSTEM_PROMPT
-    system_prompt = Template(system_prompt_template).render(**context).strip()
-    # Insert few-shot examples as user/assistant pairs if present
-    if examples and isinstance(examples, list) and len(examples) > 0:
-        fewshot = "\n".join(
-            [
-                f"user: {ex.get('question', '')}\nassistant: {ex.get('answer', '')}"
-                for ex in examples if ex.get('question') and ex.get('answer')
-            ]
-        )
-        system_prompt = f"{fewshot}\n" + system_prompt
-    logger.debug(f"build_final_prompt returning system_prompt of length {len(system_prompt)}")
-    return system_prompt
-
-
-def build_prompt_webhook(config):
-    """
-    Build the system prompt for webhook component, including response schema instructions and tool usage.
-    Args:
-        config (dict): Configuration dictionary containing agent settings.
-    Returns:
-        str: The system prompt rendered with the provided configuration and webhook response schema.
-    """
-    logger.debug("build_prompt_webhook called")
-
-    def get_val(key, default=None):
-        if isinstance(config, dict):
-            return config.get(key, default)
-        return getattr(config, key, default)
-
-    agent_name = get_val("agent_name")
-    organisation_name = get_val("organisation_name")
-    organisation_description = get_val("organisation_description")
-    conversation_tone = get_val("conversation_tone")
-    examples = get_val("examples")
-    goal = get_val("goal")
-    use_last_user_language = get_val("use_last_user_language", True)
-    languages = get_val("languages")
-    enable_emojis = get_val("enable_emojis", False)
-    answer_competitor_queries = get_val("answer_competitor_queries", False)
-    competitor_response_bias = get_val("competitor_response_bias", "genuine")
-    system_instructions = get_val("system_instructions") or get_val("systemInstructions") or ""
-    # selected_tools = get_val("selected_tools") or []
-
-    # --- DataExcel summary logic ---
-    data_excel = None
-    knowledge_base = get_val("knowledge_base")
-    if knowledge_base:
-        if isinstance(knowledge_base, KnowledgeBase):
-            kb_obj = knowledge_base
-        else:
-            try:
-                kb_obj = KnowledgeBase.objects.get(pk=knowledge_base).first()
-            except Exception:
-                kb_obj = None
-        if kb_obj:
-            data_excels = kb_obj.knowledge_data_excels.all()
-            if data_excels.exists():
-                data_excel = "\n\n".join([f"{de.original_name}:\n{de.summary}" for de in data_excels if de.summary])
-
-    selected_tools = []
-
-    # Append AGENT_TOOLS
-    for tool in AGENT_TOOLS:
-        func = tool.get("function", {})
-        name = func.get("name")
-        description = func.get("description", "")
-        selected_tools.append({
-            "name": name,
-            "description": description
-        })
+def tool_summary(tool: dict) -> dict:
+    func = tool.get("function", {})
+    return {"name": func.get("name"), "description": func.get("description", "")}
 
-    # Append INTEGRATION_TOOLS
-    integration_tool_ids = get_val("integration_tools", [])
-    for tool_id in integration_tool_ids:
-        tool = INTEGRATION_TOOLS.get(tool_id)
-        if tool:
-            func = tool.get("function", {})
-            selected_tools.append({
-                "name": func.get("name"),
-                "description": func.get("description", "")
-            })
 
-    context = {
-        "agent_name": agent_name,
-        "organisation_name": organisation_name,
-        "organisation_description": organisation_description if organisation_description != "None" else None,
-        "conversation_tone": conversation_tone if conversation_tone not in (None, "None") else None,
-        "examples": examples if examples and examples != "None" else None,
-        "goal": goal if goal and goal != "None" else None,
-        "use_last_user_language": use_last_user_language,
-        "languages": languages,
-        "enable_emojis": enable_emojis,
-        "answer_competitor_queries": answer_competitor_queries,
-        "competitor_response_bias": competitor_response_bias,
-        "system_instructions": system_instructions,
-        "data_excel": data_excel,
-        "selected_tools": selected_tools
-    }
+AGENT_SYSTEM_TEMPLATE = Template(AGENT_SYSTEM_PROMPT)  # Compiled once; rendering no longer reparses the template
+AGENT_TOOL_SUMMARIES = [tool_summary(tool) for tool in AGENT_TOOLS]
+INTEGRATION_TOOL_SUMMARIES = {tool_id: tool_summary(tool) for tool_id, tool in INTEGRATION_TOOLS.items()}
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", 24 * 3600))  # 24 hours
 
-    system_prompt_template = AGENT_SYSTEM_PROMPT
-    system_prompt = Template(system_prompt_template).render(**context).strip()
-    # Insert few-shot examples as user/assistant pairs if present
-    if examples and isinstance(examples, list) and len(examples) > 0:
-        fewshot = "\n".join(
-            [
-                f"user: {ex.get('question', '')}\nassistant: {ex.get('answer', '')}"
-                for ex in examples if ex.get('question') and ex.get('answer')
-            ]
-        )
-        system_prompt = f"{fewshot}\n" + system_prompt
-        logger.info(f"system_prompt for webhook : {system_prompt}")
-
-    # Add webhook response schema instruction and tool info
-    webhook_schema = """
+WEBHOOK_RESPONSE_SCHEMA = """
 You have access to the following tool:
 - get_relevant_images: Use this tool to retrieve relevant image URLs based on the context and user query. use this tool when images would enhance the response.
 - capture_user_data: Use this tool to capture user data which is asked to be captured. where ever it is mentioned in the conversation to maintain the records of conversation.
@@ -465,7 +281,131 @@ Only use these fields. Do not add extra fields. Status codes:
 - 203 to take location input from user (when you are expecting user input of location)
 Do not explain the schema in your reply.
 """
-    system_prompt = f"{system_prompt}\n\n{webhook_schema}"
+
+
+def render_agent_prompt(config) -> str:
+    """
+    Renders the static system prompt of an agent: AGENT_SYSTEM_TEMPLATE filled from the configuration, its
+    data file summaries and its tools, preceded by the few-shot examples.
+    Args:
+        config (dict): Configuration dictionary (or AssistantConfiguration) containing agent settings.
+    Returns:
+        str: The rendered system prompt.
+    """
+    def get_val(key, default=None):
+        if isinstance(config, dict):
+            return config.get(key, default)
+        return getattr(config, key, default)
+
+    organisation_description = get_val("organisation_description")
+    conversation_tone = get_val("conversation_tone")
+    examples = get_val("examples")
+    goal = get_val("goal")
+
+    # --- DataExcel summary logic ---
+    data_excel = None
+    knowledge_base = get_val("knowledge_base")
+    if knowledge_base:
+
+        if isinstance(knowledge_base, KnowledgeBase):
+            kb_obj = knowledge_base
+        else:
+            try:
+                kb_obj = KnowledgeBase.objects.get(pk=knowledge_base).first()
+            except Exception:
+                kb_obj = None
+        if kb_obj:
+            data_excel = "\n\n".join(
+                [f"{de.original_name}:\n{de.summary}" for de in kb_obj.knowledge_data_excels.all() if de.summary]
+            ) or None
+
+    selected_tools = list(AGENT_TOOL_SUMMARIES)
+    for tool_id in get_val("integration_tools", []) or []:
+        if tool_id in INTEGRATION_TOOL_SUMMARIES:
+            selected_tools.append(INTEGRATION_TOOL_SUMMARIES[tool_id])
+
+    context = {
+        "agent_name": get_val("agent_name"),
+        "organisation_name": get_val("organisation_name"),
+        "organisation_description": organisation_description if organisation_description != "None" else None,
+        "conversation_tone": conversation_tone if conversation_tone not in (None, "None") else None,
+        "examples": examples if examples and examples != "None" else None,
+        "goal": goal if goal and goal != "None" else None,
+        "use_last_user_language": get_val("use_last_user_language", True),
+        "languages": get_val("languages"),
+        "enable_emojis": get_val("enable_emojis", False),
+        "answer_competitor_queries": get_val("answer_competitor_queries", False),
+        "competitor_response_bias": get_val("competitor_response_bias", "genuine"),
+        "system_instructions": get_val("system_instructions") or get_val("systemInstructions") or "",
+        "data_excel": data_excel,
+        "selected_tools": selected_tools
+    }
+
+    system_prompt = AGENT_SYSTEM_TEMPLATE.render(**context).strip()
+    # Insert few-shot examples as user/assistant pairs if present
+    if examples and isinstance(examples, list) and len(examples) > 0:
+        fewshot = "\n".join(
+            [
+                f"user: {ex.get('question', '')}\nassistant: {ex.get('answer', '')}"
+                for ex in examples if ex.get('question') and ex.get('answer')
+            ]
+        )
+        system_prompt = f"{fewshot}\n" + system_prompt
+    return system_prompt
+
+
+def cached_agent_prompt(config, variant: str, render) -> str:
+    """
+    Returns `render(config)` from the Django cache (Redis) for a saved AssistantConfiguration, keyed by the
+    agent's config version, which signals bump when the configuration, its knowledge base or data files change.
+    Unsaved configurations and plain dicts (editor previews, test runs) are rendered directly.
+    """
+    if not isinstance(config, AssistantConfiguration) or config.pk is None:
+        return render(config)
+    versions = get_config_versions(("agent", config.assistant_uuid))
+    if versions is None:
+        return render(config)
+    key = f"agent_prompt:{variant}:{config.pk}:{versions[0]}"
+    try:
+        prompt = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Prompt cache lookup failed: {e}")
+        prompt = None
+    if prompt is None:
+        prompt = render(config)
+        try:
+            cache.set(key, prompt, timeout=PROMPT_CACHE_TTL)
+        except Exception as e:
+            logger.warning(f"Prompt cache store failed: {e}")
+    return prompt
+
+
+def build_final_prompt(config):
+    """
+    Build the final system prompt for the agent based on the configuration.
+    Args:
+        config (dict): Configuration dictionary containing agent settings.
+    Returns:
+        str: The final system prompt rendered with the provided configuration.
+    """
+    system_prompt = cached_agent_prompt(config, "chat", render_agent_prompt)
+    logger.debug(f"build_final_prompt returning system_prompt of length {len(system_prompt)}")
+    return system_prompt
+
+
+def render_webhook_prompt(config) -> str:
+    return f"{render_agent_prompt(config)}\n\n{WEBHOOK_RESPONSE_SCHEMA}"
+
+
+def build_prompt_webhook(config):
+    """
+    Build the system prompt for webhook component, including response schema instructions and tool usage.
+    Args:
+        config (dict): Configuration dictionary containing agent settings.
+    Returns:
+        str: The system prompt rendered with the provided configuration and webhook response schema.
+    """
+    system_prompt = cached_agent_prompt(config, "webhook", render_webhook_prompt)
     logger.debug(f"build_prompt_webhook returning system_prompt of length {len(system_prompt)}")
     return system_prompt
 
@@ -561,47 +501,22 @@ def response_verification(question, expected, agent):
         return "fail", f"[Verification Error: {e}]"
 
 
-def grab_links_from_website(root_url):
-    """
-    Grabs all links from a given website URL that match the same domain and scheme.
-    Args:
-        root_url (str): The root URL of the website to scrape.
-    Returns:
-        list: A list of unique links found on the website that match the same domain and scheme.
-    """
-    logger.info(f"grab_links_from_website started for {root_url}")
-    logger.debug(f"grab_links_from_website called with root_url={root_url}")
-    parsed_root = urlparse(root_url)
-    root_scheme = parsed_root.scheme
-    root_domain = parsed_root.netloc
-
-    links = linkGrabber.Links(root_url)
-    found_links = links.find(duplicates=False, pretty=True)
-    logger.info(f"Found {len(found_links)} links on {root_url}")
-
-    domain_links = set()
-    for link in found_links:
-        href = link.get("href")
-        if not href:
-            continue
-
-        # Make relative links absolute
-        abs_url = urljoin(root_url, href)
-        parsed_href = urlparse(abs_url)
+INDEX_LOCK_TIMEOUT = 6 * 3600  # An indexing job holding its lock longer than this is assumed dead
+INDEX_LINKS_PER_SUBTASK = 25
+INDEX_SOURCE_TYPES = {
+    "file": (KnowledgeFile, index_uploaded_documents),
+    "excel": (KnowledgeExcel, index_excel_documents),
+    "link": (WebsiteLink, index_scraped_links_with_jina),
+}
 
-        # Restrict to same domain and scheme
-        if parsed_href.netloc == root_domain and parsed_href.scheme == root_scheme:
-            clean_url = parsed_href.scheme + "://" + parsed_href.netloc + parsed_href.path
-            clean_url = clean_url.rstrip("/")  # Remove trailing slash
-            domain_links.add(clean_url)
 
-    logger.info(f"Returning {len(domain_links)} domain links for {root_url}")
-    logger.info(f"grab_links_from_website finished for {root_url}")
-    return list(domain_links)
+def get_index_lock_key(kb_uuid):
+    return f"index_knowledge_base_lock:{kb_uuid}"
 
 
-@shared_task(queue='index_knowledge_base')
+@shared_task(bind=True, queue='index_knowledge_base')
 def index_knowledge_base_task(
+    self,
     kb_uuid,
     chunk_size: int = 1000,
     chunk_overlap: int = 50,
@@ -609,6 +524,14 @@ def index_knowledge_base_task(
 ) -> dict:
     """
     Celery task to index a knowledge base by processing uploaded documents, website links, and Excel files.
+    Crawls the knowledge base's links, then fans the sources that are not indexed yet out to index_knowledge_sources
+    subtasks: one per file or Excel file, and one per INDEX_LINKS_PER_SUBTASK links. finish_knowledge_base_index
+    runs once they are all done and stores the final result of this task.
+    Sources are flagged as indexed one by one and large files checkpoint their stored chunks, so a job that dies
+    partway resumes where it stopped when started again.
+    While the subtasks run, this task's state is PROGRESS with the IndexProgress snapshot as meta.
+    A per-knowledge-base lock in the cache keeps two jobs from indexing the same knowledge base at once. If a
+    subtask or the callback fails, fail_knowledge_base_index releases it and stores the job as FAILURE.
     Args:
         kb_uuid (str): UUID of the knowledge base to index.
         chunk_size (int): Size of chunks for processing documents.
@@ -618,169 +541,270 @@ def index_knowledge_base_task(
         dict: A dictionary containing the status of the indexing operation and the knowledge base UUID.
     """
     logger.info(f"index_knowledge_base_task started for kb_uuid={kb_uuid}")
+    job_id = self.request.id
+    lock_key = get_index_lock_key(kb_uuid)
+    if not cache.add(lock_key, job_id, timeout=INDEX_LOCK_TIMEOUT):
+        logger.info(f"Knowledge base {kb_uuid} is already being indexed, skipping.")
+        return {"status": "skipped", "kb_uuid": str(kb_uuid), "task_id": cache.get(lock_key)}
     try:
         kb = KnowledgeBase.objects.get(uuid=kb_uuid)
-
-        # ---Index uploaded documents---
-        files = KnowledgeFile.objects.filter(knowledge_base=kb, indexed=False)
-        if files.exists():
-            index_uploaded_documents(
-                kb_id=kb.uuid,
-                knowledge_files_queryset=files,
-                namespace=str(kb.uuid),
-                chunk_size=chunk_size,
-                chunk_overlap=chunk_overlap,
-                embedding_type=embedding_type
-            )
-
-        # ---Index website links---
-        initial_links = WebsiteLink.objects.filter(knowledge_base=kb, indexed=False)
-
-        if initial_links.exists():
-            all_links = set()  # To track unique URLs
-            queue = deque()
-
-            # Initialize queue and all_links with initial root URLs
-            for link in initial_links:
-                if link.grabber_enabled:
-                    all_links.add(link.url)
-                    queue.append(link.url)
-
-            while queue:
-                current_url = queue.popleft()
-                try:
-                    grabbed_links = grab_links_from_website(root_url=current_url)
-                    logger.info(f"Grabbed {len(grabbed_links)} links from {current_url}")
-                    for url in grabbed_links:
-                        if url not in all_links:
-                            all_links.add(url)
-                            queue.append(url)
-                            WebsiteLink.objects.create(
-                                knowledge_base=kb,
-                                url=url,
-                                grabbed=True,
-                                indexed=False,
-                                grabber_enabled=True,
-                            )
-                except Exception as e:
-                    logger.warning(f"Failed to grab links from {current_url}: {str(e)}")
-
-        excels = KnowledgeExcel.objects.filter(knowledge_base=kb, indexed=False)
-        if excels.exists():
-            # Index Excel files
-            for excel in excels:
-                try:
-                    index_excel_documents(
-                        kb.uuid,
-                        excel,
-                        namespace=str(kb.uuid),
-                        chunk_overlap=chunk_overlap,
-                        chunk_size=chunk_size,
-                        embedding_type=embedding_type
-                    )
-                except Exception as e:
-                    logger.error(f"Error indexing Excel file {excel.original_name}: {str(e)}")
-        # Filter all WebsiteLinks which were grabbed and enabled for grabber
-        final_links = WebsiteLink.objects.filter(
-            knowledge_base=kb,
-            grabbed=True,
-            grabber_enabled=True,
-            indexed=False
+        if not self.request.called_directly:
+            self.update_state(state="PROGRESS", meta={"kb_uuid": str(kb.uuid), "phase": "crawling"})
+        LinkCrawler(kb).run()
+
+        options = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "embedding_type": embedding_type}
+        file_ids = list(KnowledgeFile.objects.filter(knowledge_base=kb, indexed=False).values_list("id", flat=True))
+        excel_ids = list(KnowledgeExcel.objects.filter(knowledge_base=kb, indexed=False).values_list("id", flat=True))
+        link_ids = list(WebsiteLink.objects.filter(knowledge_base=kb, indexed=False).values_list("id", flat=True))
+        subtasks = [index_knowledge_sources.s(job_id, kb_uuid, "file", [file_id], options) for file_id in file_ids]
+        subtasks += [index_knowledge_sources.s(job_id, kb_uuid, "excel", [excel_id], options) for excel_id in excel_ids]
+        subtasks += [
+            index_knowledge_sources.s(job_id, kb_uuid, "link", link_ids[start:start + INDEX_LINKS_PER_SUBTASK], options)
+            for start in range(0, len(link_ids), INDEX_LINKS_PER_SUBTASK)
+        ]
+        logger.info(
+            f"Indexing KB {kb_uuid}: {len(file_ids)} files, {len(excel_ids)} Excel files, "
+            f"{len(link_ids)} links in {len(subtasks)} subtasks"
         )
-        final_links = final_links.union(initial_links)
+        if job_id:
+            IndexProgress(job_id).start(str(kb.uuid), len(file_ids) + len(excel_ids) + len(link_ids))
+        if not subtasks:
+            return finish_knowledge_base_index([], job_id, kb_uuid)
+        callback = finish_knowledge_base_index.s(job_id, kb_uuid).on_error(fail_knowledge_base_index.s(job_id, kb_uuid))
+        chord(subtasks)(callback)
+    except Exception as e:
+        cache.delete(lock_key)
+        logger.error(f"Error indexing knowledge base {kb_uuid}: {str(e)}\n{traceback.format_exc()}")
+        return {"status": "error", "kb_uuid": str(kb_uuid), "error": str(e)}
+    if self.request.called_directly:
+        return {"status": "scheduled", "kb_uuid": str(kb_uuid), "subtasks": len(subtasks)}
+    # finish_knowledge_base_index stores this task's result; returning would overwrite the PROGRESS meta.
+    raise Ignore()
+
 
-        index_scraped_links_with_jina(
+@shared_task(queue='index_knowledge_base', acks_late=True, reject_on_worker_lost=True)
+def index_knowledge_sources(job_id, kb_uuid, source_type, source_ids, options):
+    """
+    Celery subtask of index_knowledge_base_task indexing some sources of one type.
+    The message is acknowledged only once the subtask returns, so a subtask lost with its worker is redelivered
+    and resumes from the sources' manifests.
+    Args:
+        job_id (str): Task ID of the index_knowledge_base_task job, whose progress is updated.
+        kb_uuid (str): UUID of the knowledge base.
+        source_type (str): "file", "excel" or "link".
+        source_ids (list): IDs of the sources to index.
+        options (dict): chunk_size, chunk_overlap and embedding_type of the job.
+    Returns:
+        dict: The number of sources and chunks indexed and the dedup summary.
+    """
+    model, indexer = INDEX_SOURCE_TYPES[source_type]
+    progress = IndexProgress(job_id) if job_id else None
+    deduplicator = ChunkDeduplicator(str(kb_uuid))
+    try:
+        kb = KnowledgeBase.objects.get(uuid=kb_uuid)
+        sources = model.objects.filter(knowledge_base=kb, id__in=source_ids, indexed=False)
+        chunks = indexer(
             kb.uuid,
-            final_links,
+            sources,
             namespace=str(kb.uuid),
-            chunk_overlap=chunk_overlap,
-            chunk_size=chunk_size,
-            embedding_type=embedding_type
+            chunk_size=options["chunk_size"],
+            chunk_overlap=options["chunk_overlap"],
+            embedding_type=options["embedding_type"],
+            chunking_engine=ChunkingEngine(chunk_size=options["chunk_size"], chunk_overlap=options["chunk_overlap"]),
+            deduplicator=deduplicator,
+            progress=progress
         )
+        result = {"status": "success", "sources": len(source_ids), "chunks": chunks}
+    except Exception as e:
+        logger.error(f"Error indexing {source_type} sources {source_ids} of KB {kb_uuid}: {str(e)}\n{traceback.format_exc()}")
+        result = {"status": "error", "sources": len(source_ids), "chunks": 0, "error": str(e)}
+    if progress is not None:
+        progress.mark_done(f"{source_type}:{source_id}" for source_id in source_ids)
+    result["dedup"] = deduplicator.summary()
+    return result
 
-        logger.info(f"index_knowledge_base_task completed for kb_uuid={kb_uuid}")
-        logger.info(f"index_knowledge_base_task finished for kb_uuid={kb_uuid}")
-        kb.updated_at = timezone.now()
-        kb.save(update_fields=["updated_at"])
 
-        return {"status": "success", "kb_uuid": str(kb.uuid)}
+@shared_task(queue='index_knowledge_base')
+def finish_knowledge_base_index(results, job_id, kb_uuid):
+    """
+    Chord callback of index_knowledge_base_task: stamps the knowledge base as updated, stores the job's
+    final result and releases its lock.
+    Args:
+        results (list): Results of the index_knowledge_sources subtasks.
+        job_id (str): Task ID of the index_knowledge_base_task job.
+        kb_uuid (str): UUID of the knowledge base.
+    Returns:
+        dict: A dictionary containing the status of the indexing operation and the knowledge base UUID.
+    """
+    try:
+        KnowledgeBase.objects.filter(uuid=kb_uuid).update(updated_at=timezone.now())
+        dedup = {}
+        for result in results:
+            for field, count in result.get("dedup", {}).items():
+                dedup[field] = dedup.get(field, 0) + count
+        errors = [result["error"] for result in results if result.get("status") == "error"]
+        summary = {
+            "status": "error" if errors and len(errors) == len(results) else "success",
+            "kb_uuid": str(kb_uuid),
+            "chunks": sum(result.get("chunks", 0) for result in results),
+            "failed_subtasks": len(errors),
+            "dedup": dedup,
+        }
+        if job_id:
+            summary = IndexProgress(job_id).finish(summary)
+        logger.info(f"index_knowledge_base_task finished for kb_uuid={kb_uuid}: {summary}")
+    finally:
+        cache.delete(get_index_lock_key(kb_uuid))
+    return summary
+
+
+@shared_task(queue='index_knowledge_base')
+def fail_knowledge_base_index(request, exc, traceback, job_id, kb_uuid):
+    """
+    Error callback of the index_knowledge_base_task chord, run when a subtask fails (the chord callback then
+    never runs) or when finish_knowledge_base_index itself fails: stores the job's FAILURE result and releases
+    its lock, so the knowledge base can be indexed again right away.
+    Args:
+        request: Request of the failed task.
+        exc (Exception): The error.
+        traceback (str): Its traceback.
+        job_id (str): Task ID of the index_knowledge_base_task job.
+        kb_uuid (str): UUID of the knowledge base.
+    """
+    logger.error(f"index_knowledge_base_task {job_id} failed for kb_uuid={kb_uuid}: {exc}")
+    lock_key = get_index_lock_key(kb_uuid)
+    try:
+        if job_id:
+            IndexProgress(job_id).fail(exc, traceback)
+    finally:
+        if cache.get(lock_key) in (job_id, None):
+            cache.delete(lock_key)
+
+
+UPDATE_LINKS_LOCK_TIMEOUT = 4 * 3600  # A refresh holding its lock longer than this is assumed dead
+UPDATE_LINKS_PER_SUBTASK = 25
 
-    except Exception as e:
-        logger.error(f"Error indexing knowledge base {kb_uuid}: {str(e)}\n{traceback.format_exc()}")
-        return {"status": "error", "kb_uuid": str(kb.uuid), "error": str(e)}
+
+def get_update_links_lock_key(kb_uuid):
+    return f"update_links_lock:{kb_uuid}"
 
 
 @shared_task(queue='update_links')
 def update_links():
     """
-    Celery task to update links in knowledge bases that have dynamic links enabled.
-    It checks if the last update was beyond the specified interval and updates the links accordingly.
+    Celery beat task that schedules the refresh of dynamic links.
+    Selects, in one query, the knowledge bases with dynamic links enabled whose update interval has elapsed,
+    and enqueues one refresh_knowledge_base_links task per knowledge base.
     Returns:
-        dict: A dictionary containing the status of the update operation and the knowledge base UUID.
+        dict: A dictionary containing the status of the scheduling and the UUIDs of the knowledge bases enqueued.
     """
     logger.info("update_links started")
-    all_kb = KnowledgeBase.objects.filter(dynamic_links_enabled=True)
-    logger.info(f"Found {all_kb.count()} knowledge bases with dynamic_links_enabled=True")
-    for kb in all_kb:
-        logger.info(f"Checking KB {kb.uuid} for update interval")
-        if (timezone.now() - kb.updated_at).total_seconds() > kb.update_interval.total_seconds():
-            logger.info(f"Updating links for knowledge base {kb.uuid}...")
-            # Get all links for the knowledge base
-            links = WebsiteLink.objects.filter(knowledge_base=kb, update_dynamically=True)
-            logger.warning(f"{links}")
-            logger.info(f"Found {len(links)} links to update for KB {kb.uuid}")
-            links_to_update = []
-            for link in links:
-                logger.debug(f"Checking link {link.url} for update")
-                try:
-                    content, hash = scrape_link(link.url)
-                    logger.debug(f"Scraped content for {link.url}, hash: {hash}and current hash: {link.hash}")
-                    if hash != link.hash:
-                        logger.info(f"Link {link.url} content changed, will update.")
-                        links_to_update.append(link)
-                        link.updated_at = timezone.now()
-                        # delete old vectors of the link from pinecone
-                        pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-                        index = pc.Index(os.getenv('PINECONE_INDEX'))
-                        # Query all chunk IDs for this link.url in metadata
-                        query_result = index.query(
-                            vector=[0.0] * 1024,
-                            filter={"doc_link": {"$eq": link.url}},
-                            namespace=str(kb.uuid),
-                            top_k=10000,
-                            include_values=False
-                        )
-                        link_chunks = [match["id"] for match in query_result.get("matches", [])]
-                        logger.debug(f"Found {len(link_chunks)} chunks to delete for link {link.url}")
-                        if link_chunks:
-                            index.delete(ids=link_chunks, namespace=str(kb.uuid))
-                        link.save()
-
-                except Exception as e:
-                    logger.error(f"Error updating link {link.url}: {str(e)}")
-                    continue
-
-            logger.info(f"Total links to update for KB {kb.uuid}: {len(links_to_update)}")
-            index_scraped_links_with_jina(
+    due_kbs = KnowledgeBase.objects.filter(
+        dynamic_links_enabled=True,
+        updated_at__lt=ExpressionWrapper(Now() - F("update_interval"), output_field=DateTimeField())
+    ).values_list("uuid", flat=True)
+    kb_uuids = [str(kb_uuid) for kb_uuid in due_kbs]
+    for kb_uuid in kb_uuids:
+        refresh_knowledge_base_links.delay(kb_uuid)
+    logger.info(f"update_links enqueued refresh for {len(kb_uuids)} knowledge bases")
+    return {"status": "success", "kb_uuids": kb_uuids}
+
+
+@shared_task(queue='update_links')
+def refresh_knowledge_base_links(kb_uuid):
+    """
+    Celery task refreshing the dynamic links of one knowledge base.
+    Fans the update_dynamically links out to refresh_links_batch subtasks, which probe and re-index them;
+    finish_links_refresh runs once they are all done. Only link IDs are loaded here, so a knowledge base with many
+    links never holds an update_links worker for its probes.
+    A per-knowledge-base lock in the cache keeps overlapping runs from processing the same knowledge base twice;
+    it is released by finish_links_refresh, or expires after UPDATE_LINKS_LOCK_TIMEOUT.
+    Args:
+        kb_uuid (str): UUID of the knowledge base to refresh.
+    Returns:
+        dict: A dictionary containing the status of the refresh and the knowledge base UUID.
+    """
+    lock_key = get_update_links_lock_key(kb_uuid)
+    if not cache.add(lock_key, timezone.now().isoformat(), timeout=UPDATE_LINKS_LOCK_TIMEOUT):
+        logger.info(f"Links of knowledge base {kb_uuid} are already being refreshed, skipping.")
+        return {"status": "skipped", "kb_uuid": kb_uuid}
+    try:
+        link_ids = list(
+            WebsiteLink.objects.filter(knowledge_base__uuid=kb_uuid, update_dynamically=True).values_list("id", flat=True)
+        )
+        logger.info(f"Found {len(link_ids)} links to check for KB {kb_uuid}")
+        if not link_ids:
+            return finish_links_refresh([], kb_uuid)
+        subtasks = [
+            refresh_links_batch.s(kb_uuid, link_ids[start:start + UPDATE_LINKS_PER_SUBTASK])
+            for start in range(0, len(link_ids), UPDATE_LINKS_PER_SUBTASK)
+        ]
+        chord(subtasks)(finish_links_refresh.s(kb_uuid))
+        return {"status": "scheduled", "kb_uuid": kb_uuid, "links": len(link_ids)}
+    except Exception as e:
+        cache.delete(lock_key)
+        logger.error(f"Error refreshing links for knowledge base {kb_uuid}: {str(e)}\n{traceback.format_exc()}")
+        return {"status": "error", "kb_uuid": kb_uuid, "error": str(e)}
+
+
+@shared_task(queue='update_links')
+def refresh_links_batch(kb_uuid, link_ids):
+    """
+    Celery subtask refreshing a batch of dynamic links of a knowledge base.
+    Probes the links with conditional requests (split_changed_links), saves the validators of the unchanged ones
+    and re-indexes the changed ones, whose validators are saved with the re-indexed link.
+    Errors are caught and reported in the result, so a failing batch never keeps the chord callback
+    finish_links_refresh from releasing the refresh lock.
+    Args:
+        kb_uuid (str): UUID of the knowledge base.
+        link_ids (list): IDs of the WebsiteLinks to refresh.
+    Returns:
+        dict: The number of links probed and changed, and the number of chunks indexed.
+    """
+    try:
+        kb = KnowledgeBase.objects.get(uuid=kb_uuid)
+        links = WebsiteLink.objects.filter(knowledge_base=kb, id__in=link_ids)
+        # Conditional requests against the origin; only changed pages go through the Jina scrape
+        changed_links, unchanged_links = split_changed_links(links)
+        WebsiteLink.objects.bulk_update(unchanged_links, LINK_VALIDATOR_FIELDS)
+        chunks = 0
+        if changed_links:
+            chunks = index_scraped_links_with_jina(
                 kb.uuid,
-                links_to_update,
+                changed_links,
                 namespace=str(kb.uuid),
                 chunk_overlap=kb.chunk_overlap,
                 chunk_size=kb.chunk_size,
                 embedding_type=kb.embedding_type
             )
-            kb.updated_at = timezone.now()
-            kb.save()
-            logger.info(f"Finished updating links for knowledge base {kb.uuid}.")
-        else:
-            logger.info(f"""
-                        Knowledge base {kb.uuid} not require update.
-                        Last updated at {kb.updated_at}, interval is {kb.update_interval}.
-                        """)
-            links_to_update = []
-    logger.info("update_links finished")
-    logger.info(f"Total links updated: {len(links_to_update)} and links are {links_to_update}")
-    return {"status": "success", "kb_uuid": str(kb.uuid)}
+        return {"status": "success", "links": len(link_ids), "changed": len(changed_links), "chunks": chunks}
+    except Exception as e:
+        logger.error(f"Error refreshing links {link_ids} of KB {kb_uuid}: {str(e)}\n{traceback.format_exc()}")
+        return {"status": "error", "links": len(link_ids), "changed": 0, "chunks": 0, "error": str(e)}
+
+
+@shared_task(queue='update_links')
+def finish_links_refresh(results, kb_uuid):
+    """
+    Chord callback of refresh_knowledge_base_links: stamps the knowledge base as updated and releases its lock.
+    Args:
+        results (list): Results of the refresh_links_batch subtasks.
+        kb_uuid (str): UUID of the knowledge base.
+    Returns:
+        dict: A dictionary containing the status of the refresh and the knowledge base UUID.
+    """
+    changed = sum(result.get("changed", 0) for result in results)
+    chunks = sum(result.get("chunks", 0) for result in results)
+    failed = sum(1 for result in results if result.get("status") == "error")
+    try:
+        KnowledgeBase.objects.filter(uuid=kb_uuid).update(updated_at=timezone.now())
+        logger.info(
+            f"Finished updating links for knowledge base {kb_uuid}: {changed} changed links, {chunks} chunks, "
+            f"{failed} failed batches."
+        )
+    finally:
+        cache.delete(get_update_links_lock_key(kb_uuid))
+    return {"status": "success", "kb_uuid": kb_uuid, "changed": changed, "chunks": chunks, "failed_batches": failed}
 
 
 def refine_query(query, context):
@@ -1,7 +1,40 @@
+import json
+import shutil
+import tempfile
+import threading
+import time
+import uuid
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache as django_cache
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from unittest import mock
+from langchain_core.documents import Document
+from analytics.indexing import ChunkManifest, EmbeddingBatcher, VectorWriter, chunk_digest, encode_batch, delete_source_vectors, link_has_changed, scrape_links
+from analytics.indexing import reciprocal_rank_fusion, retrieve, weight_hybrid_vectors
+from analytics import agent_snapshot
+from analytics.agent_snapshot import get_agent_snapshot
+from analytics.agent_turn import AgentTurn
+from analytics.chunking import ChunkingEngine, chunk_splitter
+from analytics.config_versions import bump_config_version
+from analytics.crawler import HostRateLimiter, LinkCrawler
+from analytics.dedup import ChunkDeduplicator, forget_chunks
+from analytics.embedding_cache import EmbeddingCache
+from analytics.ingest import download_to_tempfile, iter_text_blocks, remove_tempfile
+from analytics.progress import IndexProgress
+from analytics.retrieval import LexicalOverlapReranker, MMRReranker, retrieve_for_knowledge_base
+from analytics.retrieval_cache import bump_namespace_version
+from analytics.tasks import build_final_prompt, build_prompt_webhook, fail_knowledge_base_index, get_index_lock_key, index_knowledge_sources
+from analytics.tasks import refresh_links_batch
+from analytics.sparse import BM25SparseEncoder, RemoteSparseEncoder, get_sparse_encoder, token_index
+from analytics.tool_calls import execute_tool_calls
+from analytics.tool_registry import ToolContext, ToolRegistry, build_tool_registry, get_tool_registry, invalidate_tool_registries
+from analytics.tool_schemas import get_compiled_agent_tools
+from analytics.vectorstore import LocalVectorStore, PineconeVectorStore
+from analytics.models import AssistantConfiguration, ChatRoom, KnowledgeBase, UserTool, WebsiteLink
 
 
 class APITestSuite(APITestCase):
@@ -230,3 +263,1009 @@ class APITestSuite(APITestCase):
         self.authenticate()
         response = self.client.delete('/api/analytics/Knowledge-excel/1')
         self.assertIn(response.status_code, [status.HTTP_204_NO_CONTENT, status.HTTP_400_BAD_REQUEST])
+
+
+class EmbeddingBatcherTestSuite(SimpleTestCase):
+    def fake_encode_batch(self, texts, embedding_type="hybrid", sparse_encoder=None):
+        self.encode_calls.append(list(texts))
+        return [([0.1] * 1024, {"indices": [0], "values": [0.1]}) for _ in texts]
+
+    def setUp(self):
+        self.encode_calls = []
+        self.upserts = []
+        patcher = mock.patch("analytics.indexing.encode_batch", side_effect=self.fake_encode_batch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_batches_are_bounded_by_size(self):
+        batcher = EmbeddingBatcher(self.upserts.append, max_batch_size=3)
+        for i in range(7):
+            batcher.add(f"doc_{i}", Document(page_content=f"chunk {i}"))
+        batcher.flush()
+        self.assertEqual([len(call) for call in self.encode_calls], [3, 3, 1])
+        self.assertEqual([len(batch) for batch in self.upserts], [3, 3, 1])
+        self.assertEqual(batcher.embedded, 7)
+
+    def test_batches_are_bounded_by_tokens(self):
+        batcher = EmbeddingBatcher(self.upserts.append, max_batch_size=100, max_batch_tokens=5)
+        for i in range(4):
+            batcher.add(f"doc_{i}", Document(page_content="one two three"))
+        batcher.flush()
+        self.assertEqual(len(self.encode_calls), 4)
+
+    def test_after_flush_runs_once_chunks_are_stored(self):
+        batcher = EmbeddingBatcher(self.upserts.append, max_batch_size=10)
+        marked = []
+        batcher.add("doc_0", Document(page_content="chunk"))
+        batcher.after_flush(lambda: marked.append("doc"))
+        self.assertEqual(marked, [])
+        batcher.flush()
+        self.assertEqual(marked, ["doc"])
+        self.assertEqual(self.upserts[0][0]["id"], "doc_0")
+
+    def test_failed_embeddings_leave_the_manifest_untouched(self):
+        link = WebsiteLink(id=5, url="https://example.com", chunk_hashes=["old"])
+        manifest = ChunkManifest(link)
+        batcher = EmbeddingBatcher(self.upserts.append, embedding_type="dense", max_batch_size=2)
+        with mock.patch("analytics.indexing.encode_batch", wraps=encode_batch), \
+                mock.patch("analytics.indexing.get_dense_vectors", side_effect=Exception("OpenAI is down")), \
+                mock.patch.object(WebsiteLink, "save") as save:
+            for i in range(3):
+                chunk = Document(page_content=f"chunk {i}")
+                batcher.add(manifest.add(chunk), chunk)
+                manifest.checkpoint_after_flush(batcher, every=2)
+            batcher.after_flush(lambda: manifest.commit(mock.Mock()))
+            batcher.flush()
+        save.assert_not_called()
+        self.assertEqual(link.chunk_hashes, ["old"])
+        self.assertFalse(link.indexed)
+        self.assertEqual(batcher.failed, 3)
+        self.assertEqual(self.upserts, [])
+
+
+class VectorWriterTestSuite(SimpleTestCase):
+    def setUp(self):
+        self.index = mock.Mock()
+
+    def make_vector(self, i):
+        return {"id": f"doc_{i}", "values": [0.0] * 4, "metadata": {"context": "chunk"}}
+
+    def test_batches_are_bounded_by_size(self):
+        writer = VectorWriter("ns", store=PineconeVectorStore(self.index), batch_size=2, max_workers=1)
+        writer.write([self.make_vector(i) for i in range(5)])
+        summary = writer.close()
+        sizes = [len(call.kwargs["vectors"]) for call in self.index.upsert.call_args_list]
+        self.assertEqual(sizes, [2, 2, 1])
+        self.assertEqual(summary["vectors"], 5)
+        self.assertEqual(summary["failed_batches"], 0)
+
+    def test_batches_are_bounded_by_bytes(self):
+        vector_bytes = len('{"context": "chunk"}') + 24 * 4 + 5 + 64
+        writer = VectorWriter("ns", store=PineconeVectorStore(self.index), batch_size=100, max_bytes=vector_bytes * 2, max_workers=1)
+        writer.write([self.make_vector(i) for i in range(5)])
+        writer.close()
+        self.assertEqual(self.index.upsert.call_count, 3)
+
+    def test_after_flush_skipped_when_batch_fails(self):
+        self.index.upsert.side_effect = [None, Exception("boom")]
+        marked = []
+        with VectorWriter("ns", store=PineconeVectorStore(self.index), batch_size=1, max_workers=2) as writer:
+            writer.write([self.make_vector(0)])
+            writer.after_flush(lambda: marked.append("first"))
+            writer.write([self.make_vector(1)])
+            writer.after_flush(lambda: marked.append("second"))
+        self.assertEqual(marked, ["first"])
+        self.assertEqual(writer.summary()["failed_vectors"], 1)
+
+
+class ChunkManifestTestSuite(SimpleTestCase):
+    def test_only_new_chunks_are_embedded_and_vanished_deleted(self):
+        prefix = "websitelink-3#"
+        kept = chunk_digest(prefix, "unchanged text")
+        removed = chunk_digest(prefix, "old text")
+        link = WebsiteLink(id=3, url="https://example.com", chunk_hashes=[kept, removed])
+        manifest = ChunkManifest(link)
+        self.assertIsNone(manifest.add(Document(page_content="unchanged   text")))
+        new_id = manifest.add(Document(page_content="new text"))
+        self.assertEqual(new_id, prefix + chunk_digest(prefix, "new text"))
+        self.assertIsNone(manifest.add(Document(page_content="new text")))
+
+        writer = mock.Mock()
+        with mock.patch.object(WebsiteLink, "save"):
+            manifest.commit(writer)
+        writer.delete.assert_called_once_with([prefix + removed])
+        self.assertEqual(link.chunk_hashes, [kept, chunk_digest(prefix, "new text")])
+        self.assertTrue(link.indexed)
+
+    def test_incomplete_commit_keeps_previous_chunks(self):
+        prefix = "websitelink-6#"
+        failed_row = chunk_digest(prefix + "https://example.com/down", "row text")
+        link = WebsiteLink(id=6, url="https://example.com", chunk_hashes=[failed_row])
+        manifest = ChunkManifest(link)
+        manifest.add(Document(page_content="row text"), key="https://example.com/up")
+        writer = mock.Mock()
+        with mock.patch.object(WebsiteLink, "save"):
+            manifest.commit(writer, complete=False)
+        writer.delete.assert_not_called()
+        self.assertEqual(link.chunk_hashes, [failed_row, chunk_digest(prefix + "https://example.com/up", "row text")])
+        self.assertFalse(link.indexed)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ChunkDeduplicatorTestSuite(SimpleTestCase):
+    text = " ".join(f"word{i % 97} token{i % 13}" for i in range(300))
+
+    def setUp(self):
+        django_cache.clear()
+
+    def test_near_duplicates_reference_the_first_chunk(self):
+        dedup = ChunkDeduplicator("kb")
+        self.assertIsNone(dedup.match(self.text, "a"))
+        self.assertEqual(dedup.match(self.text.replace("word50", "changed", 1), "b"), "a")
+        self.assertIsNone(dedup.match(" ".join(f"other{i}" for i in range(300)), "c"))
+        self.assertEqual(dedup.summary()["chunks_saved"], 1)
+
+    def test_boilerplate_lines_are_stripped_and_remembered(self):
+        dedup = ChunkDeduplicator("kb", min_pages=2)
+        page = "Home | About | Contact\nBody of page {}\n(c) Example Corp"
+        self.assertIn("Home", dedup.strip_boilerplate(page.format(1)))
+        self.assertEqual(dedup.strip_boilerplate(page.format(2)), "Body of page 2")
+        dedup.save()
+        self.assertEqual(ChunkDeduplicator("kb", min_pages=2).strip_boilerplate(page.format(3)), "Body of page 3")
+
+    def test_concurrent_subtasks_merge_their_boilerplate(self):
+        first, second = ChunkDeduplicator("kb", min_pages=1), ChunkDeduplicator("kb", min_pages=1)
+        first.strip_boilerplate("Header of site one")
+        second.strip_boilerplate("Footer of site two")
+        first.save()
+        second.save()
+        later = ChunkDeduplicator("kb")
+        self.assertEqual(later.strip_boilerplate("Header of site one\nBody\nFooter of site two"), "Body")
+
+    def test_subtasks_share_the_lsh_index(self):
+        self.assertIsNone(ChunkDeduplicator("kb").match(self.text, "a"))
+        self.assertEqual(ChunkDeduplicator("kb").match(self.text.replace("word50", "changed", 1), "b"), "a")
+        self.assertIsNone(ChunkDeduplicator("other-kb").match(self.text, "c"))
+        forget_chunks("kb", ["a"])
+        self.assertIsNone(ChunkDeduplicator("kb").match(self.text, "d"))
+        self.assertEqual(ChunkDeduplicator("kb").match(self.text, "e"), "d")
+
+    def test_boilerplate_pages_are_counted_across_subtasks_once_each(self):
+        page = "Home | About | Contact\nBody of page {}"
+        for url in ("https://example.com/1", "https://example.com/1", "https://example.com/2"):
+            self.assertIn("Home", ChunkDeduplicator("kb", min_pages=3).strip_boilerplate(page.format(url), page=url))
+        third = ChunkDeduplicator("kb", min_pages=3)
+        self.assertEqual(third.strip_boilerplate(page.format(3), page="https://example.com/3"), "Body of page 3")
+
+    def test_manifest_records_duplicates_as_references(self):
+        dedup = ChunkDeduplicator("kb")
+        first = ChunkManifest(WebsiteLink(id=1, url="https://example.com/a"), deduplicator=dedup)
+        second = ChunkManifest(WebsiteLink(id=2, url="https://example.com/b"), deduplicator=dedup)
+        chunk_id = first.add(Document(page_content=self.text))
+        self.assertIsNotNone(chunk_id)
+        self.assertIsNone(second.add(Document(page_content=self.text)))
+        with mock.patch.object(WebsiteLink, "save"):
+            second.commit(mock.Mock())
+        self.assertEqual(second.source.chunk_hashes, [])
+        self.assertEqual(list(second.source.chunk_refs.values()), [chunk_id])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class IndexSubtaskDedupTestSuite(TestCase):
+    page = " ".join(f"word{i % 97} token{i % 13}" for i in range(60))
+
+    def fake_encode_batch(self, texts, embedding_type="hybrid", sparse_encoder=None):
+        return [([0.1] * 4, {"indices": [0], "values": [0.1]}) for _ in texts]
+
+    def setUp(self):
+        django_cache.clear()
+        user = get_user_model().objects.create_user(username="dedup", password="pass")
+        self.kb = KnowledgeBase.objects.create(user=user, name="kb")
+        self.first = WebsiteLink.objects.create(knowledge_base=self.kb, url="https://example.com/a")
+        self.second = WebsiteLink.objects.create(knowledge_base=self.kb, url="https://example.com/b")
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        self.store = LocalVectorStore(path)
+        for target, value in (
+            ("analytics.indexing.get_vector_store", mock.Mock(return_value=self.store)),
+            ("analytics.indexing.scrape_link", mock.Mock(return_value=(self.page, "hash"))),
+            ("analytics.indexing.encode_batch", mock.Mock(side_effect=self.fake_encode_batch)),
+            ("analytics.chunking.TokenTextSplitter", mock.Mock(side_effect=OSError("offline"))),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_second_subtask_references_the_page_of_the_first(self):
+        options = {"chunk_size": 1000, "chunk_overlap": 0, "embedding_type": "hybrid"}
+        index_knowledge_sources(None, str(self.kb.uuid), "link", [self.first.id], options)
+        result = index_knowledge_sources(None, str(self.kb.uuid), "link", [self.second.id], options)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(len(self.first.chunk_hashes), 1)
+        self.assertEqual(self.second.chunk_hashes, [])
+        self.assertEqual(list(self.second.chunk_refs.values()), [f"websitelink-{self.first.id}#{self.first.chunk_hashes[0]}"])
+        self.assertEqual(result["dedup"]["chunks_saved"], 1)
+        self.assertEqual(len(self.store.list_ids("", str(self.kb.uuid))), 1)
+
+
+class ChunkManifestCheckpointTestSuite(SimpleTestCase):
+    def test_checkpoint_keeps_stored_chunks_for_resumed_run(self):
+        link = WebsiteLink(id=4, url="https://example.com", chunk_hashes=["old"])
+        manifest = ChunkManifest(link)
+        batcher = mock.Mock()
+        for i in range(3):
+            manifest.add(Document(page_content=f"chunk {i}"))
+            manifest.checkpoint_after_flush(batcher, every=2)
+        batcher.after_flush.assert_called_once()
+        with mock.patch.object(WebsiteLink, "save") as save:
+            batcher.after_flush.call_args.args[0]()
+        save.assert_called_once_with(update_fields=["chunk_hashes"])
+        self.assertEqual(link.chunk_hashes, ["old"] + manifest.digests[:2])
+        self.assertFalse(link.indexed)
+
+        resumed = ChunkManifest(link)
+        self.assertIsNone(resumed.add(Document(page_content="chunk 0")))
+        self.assertIsNotNone(resumed.add(Document(page_content="chunk 2")))
+        self.assertIn("websitelink-4#old", resumed.vanished)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class IndexProgressTestSuite(SimpleTestCase):
+    def setUp(self):
+        django_cache.clear()
+        patcher = mock.patch("analytics.progress.AsyncResult")
+        self.backend = patcher.start().return_value.backend
+        self.addCleanup(patcher.stop)
+
+    def test_counters_are_published_as_task_meta(self):
+        progress = IndexProgress("job-1", publish_interval=0)
+        progress.start("kb", 4)
+        progress.add(sources_done=1, chunks_embedded=10)
+        IndexProgress("job-1", publish_interval=0).add(sources_done=1, chunks_upserted=10)
+        job_id, meta, state = self.backend.store_result.call_args.args
+        self.assertEqual((job_id, state), ("job-1", "PROGRESS"))
+        self.assertEqual(meta["sources_done"], 2)
+        self.assertEqual(meta["chunks_embedded"], 10)
+        self.assertEqual(meta["chunks_upserted"], 10)
+        self.assertIsNotNone(meta["eta_seconds"])
+
+    def test_redelivered_sources_are_counted_once(self):
+        progress = IndexProgress("job-2", publish_interval=0)
+        progress.start("kb", 2)
+        self.assertEqual(progress.mark_done(["file:1", "file:2"]), 2)
+        self.assertEqual(progress.mark_done(["file:1", "file:2"]), 0)
+        self.assertEqual(progress.snapshot()["sources_done"], 2)
+
+    def test_finish_stores_success_with_final_counters(self):
+        progress = IndexProgress("job-2")
+        progress.start("kb", 1)
+        result = progress.finish({"status": "success"})
+        self.backend.store_result.assert_called_with("job-2", result, "SUCCESS")
+        self.assertEqual(result["progress"]["sources_total"], 1)
+
+    def test_failed_jobs_release_their_lock(self):
+        django_cache.add(get_index_lock_key("kb"), "job-3")
+        error = ValueError("subtask lost")
+        fail_knowledge_base_index(mock.Mock(), error, None, "job-3", "kb")
+        self.backend.mark_as_failure.assert_called_with("job-3", error, traceback=None)
+        self.assertIsNone(django_cache.get(get_index_lock_key("kb")))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class EmbeddingCacheTestSuite(SimpleTestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.computed = []
+
+    def compute(self, texts):
+        self.computed.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    def test_repeated_texts_are_computed_once(self):
+        cache = EmbeddingCache("test-model", 1)
+        self.assertEqual(cache.get_or_compute(["a", "bb", "a"], self.compute), [[1.0], [2.0], [1.0]])
+        self.assertEqual(cache.get_or_compute(["bb", "ccc"], self.compute), [[2.0], [3.0]])
+        self.assertEqual(self.computed, [["a", "bb"], ["ccc"]])
+        self.assertEqual(cache.stats["local_hits"], 1)
+
+    def test_local_tier_evicts_and_falls_back_to_shared_cache(self):
+        cache = EmbeddingCache("test-model", 1, max_entries=1)
+        cache.get_or_compute(["a", "bb"], self.compute)
+        cache.get_or_compute(["a"], self.compute)
+        self.assertEqual(self.computed, [["a", "bb"]])
+        self.assertEqual(cache.stats["remote_hits"], 1)
+
+    def test_keys_depend_on_model_and_dimensions(self):
+        self.assertNotEqual(EmbeddingCache("m", 1024).key("text"), EmbeddingCache("m", 512).key("text"))
+
+
+class LinkCrawlerTestSuite(TestCase):
+    site = {
+        "https://example.com": ["https://example.com/a", "https://example.com/b"],
+        "https://example.com/a": ["https://example.com/a/1", "https://example.com/b"],
+        "https://example.com/b": ["https://example.com/b/1"],
+        "https://example.com/a/1": ["https://example.com/a/1/x"],
+    }
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(username="crawler", password="testpass123")
+        self.kb = KnowledgeBase.objects.create(user=user, name="KB", crawl_max_depth=2, crawl_max_pages=100)
+        WebsiteLink.objects.create(knowledge_base=self.kb, url="https://example.com", grabber_enabled=True)
+
+    def crawl(self):
+        return LinkCrawler(
+            self.kb,
+            fetch_links=lambda url: self.site.get(url, []),
+            max_workers=2,
+            rate_limiter=HostRateLimiter(delay=0)
+        ).run()
+
+    def test_crawl_respects_depth_and_persists_frontier(self):
+        self.assertEqual(self.crawl(), {"crawled": 3, "discovered": 4})
+        urls = dict(WebsiteLink.objects.filter(knowledge_base=self.kb).values_list("url", "crawl_depth"))
+        self.assertEqual(urls["https://example.com/a/1"], 2)
+        self.assertNotIn("https://example.com/a/1/x", urls)
+        self.assertEqual(self.crawl(), {"crawled": 0, "discovered": 0})
+
+    def test_crawl_respects_page_budget(self):
+        self.kb.crawl_max_pages = 1
+        self.assertEqual(self.crawl()["discovered"], 1)
+        self.assertEqual(WebsiteLink.objects.filter(knowledge_base=self.kb, grabbed=True).count(), 1)
+
+
+class ScrapeLinksTestSuite(SimpleTestCase):
+    def fake_scrape_link(self, url):
+        if url.endswith("broken"):
+            raise Exception("unreachable")
+        return f"content of {url}", f"hash of {url}"
+
+    def test_all_links_are_yielded_with_errors_reported(self):
+        urls = [f"https://example.com/{i}" for i in range(20)] + ["https://example.com/broken"]
+        with mock.patch("analytics.indexing.scrape_link", side_effect=self.fake_scrape_link):
+            results = {link: (content, error) for link, content, _, error in scrape_links(urls, kb_id="kb", max_workers=3)}
+        self.assertEqual(set(results), set(urls))
+        self.assertEqual(results["https://example.com/0"], ("content of https://example.com/0", None))
+        self.assertIsNone(results["https://example.com/broken"][0])
+        self.assertIsInstance(results["https://example.com/broken"][1], Exception)
+
+
+class LinkHasChangedTestSuite(SimpleTestCase):
+    def probe(self, link, status_code=200, headers=None, body=b"<html>page</html>"):
+        response = mock.MagicMock(status_code=status_code, headers=headers or {})
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [body]
+        session = mock.Mock()
+        session.get.return_value = response
+        with mock.patch("analytics.indexing.get_http_session", return_value=session):
+            changed = link_has_changed(link)
+        return changed, session.get.call_args.kwargs["headers"]
+
+    def test_not_modified_is_unchanged(self):
+        link = WebsiteLink(url="https://example.com", etag='"v1"', last_modified="Tue, 01 Oct 2024 00:00:00 GMT")
+        changed, headers = self.probe(link, status_code=304)
+        self.assertFalse(changed)
+        self.assertEqual(headers, {"If-None-Match": '"v1"', "If-Modified-Since": "Tue, 01 Oct 2024 00:00:00 GMT"})
+
+    def test_fingerprint_detects_change(self):
+        link = WebsiteLink(url="https://example.com")
+        changed, _ = self.probe(link, headers={"ETag": '"v2"'})
+        self.assertTrue(changed)
+        self.assertEqual(link.etag, '"v2"')
+        self.assertEqual(link.content_length, len(b"<html>page</html>"))
+        changed, _ = self.probe(link)
+        self.assertFalse(changed)
+
+
+class RefreshLinksBatchTestSuite(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username="refresh", password="pass")
+        self.kb = KnowledgeBase.objects.create(user=user, name="kb")
+        self.changed = WebsiteLink.objects.create(knowledge_base=self.kb, url="https://example.com/new", update_dynamically=True)
+        self.unchanged = WebsiteLink.objects.create(knowledge_base=self.kb, url="https://example.com/old", update_dynamically=True)
+
+    def fake_link_has_changed(self, link):
+        link.etag = f'"{link.id}"'
+        return link.id == self.changed.id
+
+    def test_batches_probe_their_links_and_index_only_changed_ones(self):
+        with mock.patch("analytics.indexing.link_has_changed", side_effect=self.fake_link_has_changed), \
+                mock.patch("analytics.tasks.index_scraped_links_with_jina", return_value=3) as index:
+            result = refresh_links_batch(str(self.kb.uuid), [self.changed.id, self.unchanged.id])
+        self.assertEqual(result, {"status": "success", "links": 2, "changed": 1, "chunks": 3})
+        self.assertEqual([link.id for link in index.call_args.args[1]], [self.changed.id])
+        self.unchanged.refresh_from_db()
+        self.assertEqual(self.unchanged.etag, f'"{self.unchanged.id}"')
+
+
+class DeleteSourceVectorsTestSuite(SimpleTestCase):
+    def test_deletes_manifest_and_listed_ids_in_batches(self):
+        link = WebsiteLink(id=7, url="https://example.com", indexed=True, chunk_hashes=[f"h{i}" for i in range(1500)])
+        index = mock.Mock()
+        index.list.return_value = iter([["websitelink-7#h0", "websitelink-7#extra"]])
+        self.assertEqual(delete_source_vectors(link, namespace="kb", store=PineconeVectorStore(index)), 1501)
+        index.list.assert_called_once_with(prefix="websitelink-7#", namespace="kb")
+        self.assertEqual([len(call.kwargs["ids"]) for call in index.delete.call_args_list], [1000, 501])
+        index.query.assert_not_called()
+
+    def test_legacy_sources_are_deleted_by_metadata_until_exhausted(self):
+        link = WebsiteLink(id=8, url="https://example.com", indexed=True)
+        index = mock.Mock()
+        index.list.side_effect = Exception("list is not supported")
+        index.query.side_effect = [
+            {"matches": [{"id": "8_0"}, {"id": "8_1"}]},
+            {"matches": [{"id": "8_1"}, {"id": "8_2"}]},
+            {"matches": [{"id": "8_2"}]},
+            {"matches": [{"id": "8_2"}, {"id": "8_3"}]},
+            {"matches": []},
+        ]
+        with mock.patch("analytics.vectorstore.time.sleep") as sleep:
+            self.assertEqual(delete_source_vectors(link, namespace="kb", store=PineconeVectorStore(index)), 4)
+        sleep.assert_called_once()
+        self.assertEqual(index.query.call_args.kwargs["filter"], {"doc_link": {"$eq": "https://example.com"}})
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ChunkReferenceRehomingTestSuite(TestCase):
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        self.store = LocalVectorStore(path)
+        user = get_user_model().objects.create_user(username="rehome", password="pass")
+        kb = KnowledgeBase.objects.create(user=user, name="kb")
+        self.namespace = str(kb.uuid)
+        self.canonical = WebsiteLink.objects.create(knowledge_base=kb, url="https://example.com/a", indexed=True, chunk_hashes=["a1"])
+        self.referrer = WebsiteLink.objects.create(
+            knowledge_base=kb, url="https://example.com/b", indexed=True, chunk_refs={"b1": f"websitelink-{self.canonical.pk}#a1"}
+        )
+        self.store.upsert([
+            {"id": f"websitelink-{self.canonical.pk}#a1", "values": [1.0, 0.0], "metadata": {"context": "shared text"}}
+        ], self.namespace)
+
+    def test_deleting_a_source_keeps_the_chunks_referencing_it(self):
+        delete_source_vectors(self.canonical, namespace=self.namespace, store=self.store)
+        self.referrer.refresh_from_db()
+        self.assertEqual(self.referrer.chunk_refs, {})
+        self.assertEqual(self.referrer.chunk_hashes, ["b1"])
+        self.assertTrue(self.referrer.indexed)
+        self.assertEqual(self.store.list_ids("", self.namespace), [f"websitelink-{self.referrer.pk}#b1"])
+        copy_id = f"websitelink-{self.referrer.pk}#b1"
+        self.assertEqual(self.store.fetch([copy_id], self.namespace)[copy_id]["metadata"]["context"], "shared text")
+
+    def test_references_to_missing_vectors_are_reindexed(self):
+        self.store.delete([f"websitelink-{self.canonical.pk}#a1"], self.namespace)
+        delete_source_vectors(self.canonical, namespace=self.namespace, store=self.store)
+        self.referrer.refresh_from_db()
+        self.assertEqual(self.referrer.chunk_refs, {})
+        self.assertEqual(self.referrer.chunk_hashes, [])
+        self.assertFalse(self.referrer.indexed)
+
+
+class LocalVectorStoreTestSuite(SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path, ignore_errors=True)
+        self.store = LocalVectorStore(self.path)
+        self.store.upsert([
+            {"id": "websitelink-1#a", "values": [1.0, 0.0], "metadata": {"context": "a", "doc_link": "x"}},
+            {"id": "websitelink-1#b", "values": [0.6, 0.8], "sparse_values": {"indices": [7], "values": [1.0]},
+             "metadata": {"context": "b", "doc_link": "x"}},
+            {"id": "websitelink-2#c", "values": [0.0, 1.0], "metadata": {"context": "c", "doc_link": "y"}},
+        ], "kb")
+
+    def ids(self, result):
+        return [match["id"] for match in result["matches"]]
+
+    def test_dense_and_hybrid_queries_rank_by_dot_product(self):
+        self.assertEqual(self.ids(self.store.query("kb", [1.0, 0.0], top_k=2)), ["websitelink-1#a", "websitelink-1#b"])
+        hybrid = self.store.query("kb", [1.0, 0.0], sparse_vector={"indices": [7], "values": [1.0]}, top_k=1)
+        self.assertEqual(self.ids(hybrid), ["websitelink-1#b"])
+        self.assertEqual(hybrid["matches"][0]["metadata"]["context"], "b")
+        filtered = self.store.query("kb", [1.0, 0.0], top_k=5, filter={"doc_link": {"$eq": "y"}})
+        self.assertEqual(self.ids(filtered), ["websitelink-2#c"])
+
+    def test_writes_are_persisted_and_seen_by_other_instances(self):
+        other = LocalVectorStore(self.path)
+        self.assertEqual(len(other.list_ids("", "kb")), 3)
+        self.assertEqual(self.store.delete_source("websitelink-1#", "kb"), 2)
+        self.assertEqual(other.list_ids("", "kb"), ["websitelink-2#c"])
+        self.store.upsert([{"id": "websitelink-2#c", "values": [1.0, 1.0], "metadata": {}}], "kb")
+        self.assertEqual(other.query("kb", [1.0, 0.0], top_k=1)["matches"][0]["score"], 1.0)
+
+    def test_upserts_append_segments_until_compacted(self):
+        other = LocalVectorStore(self.path)
+        other.list_ids("", "kb")
+        self.store.upsert([{"id": "websitelink-3#d", "values": [1.0, 1.0], "metadata": {}}], "kb")
+        namespace = self.store.namespace("kb")
+        self.assertEqual(len(namespace._state["segments"]), 1)
+        self.assertEqual(len(other.list_ids("", "kb")), 4)
+        self.store.upsert([{"id": f"websitelink-4#{i}", "values": [0.0, 1.0], "metadata": {}} for i in range(3)], "kb")
+        self.assertEqual(namespace._state["segments"], [])
+        self.assertEqual(len(other.list_ids("", "kb")), 7)
+
+    def test_drop_namespace(self):
+        self.store.drop_namespace("kb")
+        self.assertEqual(self.store.query("kb", [1.0, 0.0])["matches"], [])
+
+
+class HybridRetrievalTestSuite(SimpleTestCase):
+    def setUp(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        self.store = LocalVectorStore(path)
+        self.store.upsert([
+            {"id": "dense-match", "values": [1.0, 0.0], "sparse_values": {"indices": [3], "values": [0.2]}, "metadata": {}},
+            {"id": "sparse-match", "values": [0.5, 0.5], "sparse_values": {"indices": [7], "values": [2.0]}, "metadata": {}},
+        ], "kb")
+        encoder = mock.Mock()
+        encoder.encode_queries.return_value = [{"indices": [7], "values": [1.0]}]
+        for target, value in (("get_dense_vector", mock.Mock(return_value=[1.0, 0.0])),
+                              ("get_sparse_encoder", mock.Mock(return_value=encoder))):
+            patcher = mock.patch(f"analytics.indexing.{target}", value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def top(self, result):
+        return result["matches"][0]["id"]
+
+    def test_weight_hybrid_vectors(self):
+        dense, sparse = weight_hybrid_vectors([1.0, 2.0], {"indices": [1], "values": [4.0]}, 0.25)
+        self.assertEqual(dense, [0.75, 1.5])
+        self.assertEqual(sparse, {"indices": [1], "values": [1.0]})
+        self.assertIsNone(weight_hybrid_vectors([1.0], {"indices": [1], "values": [1.0]}, -1)[1])
+
+    def test_sparse_weightage_shifts_the_ranking(self):
+        self.assertEqual(self.top(retrieve("q", "kb", store=self.store, k=1, sparse_weightage=0.1)), "dense-match")
+        self.assertEqual(self.top(retrieve("q", "kb", store=self.store, k=1, sparse_weightage=0.9)), "sparse-match")
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([
+            {"matches": [{"id": "a"}, {"id": "b"}]},
+            {"matches": [{"id": "b"}, {"id": "c"}]},
+        ], top_k=2, rrf_k=0)
+        self.assertEqual([match["id"] for match in fused["matches"]], ["b", "a"])
+        self.assertAlmostEqual(fused["matches"][0]["score"], 1.5)
+        with mock.patch.object(self.store, "query", wraps=self.store.query) as query:
+            result = retrieve("q", "kb", store=self.store, k=2, retrieval_method="rrf")
+        self.assertEqual({match["id"] for match in result["matches"]}, {"dense-match", "sparse-match"})
+        self.assertTrue(all(any(call.args[1]) for call in query.call_args_list))
+        with self.assertRaises(ValueError):
+            retrieve("q", "kb", store=self.store, retrieval_method="sparse")
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class RerankingTestSuite(SimpleTestCase):
+    def setUp(self):
+        django_cache.clear()
+
+    def matches(self, *contexts):
+        return [
+            {"id": str(position), "score": 1.0 - position / 10, "metadata": {"context": context}}
+            for position, context in enumerate(contexts)
+        ]
+
+    def test_lexical_overlap_promotes_exact_terms(self):
+        matches = self.matches("general shipping information", "refund window for the X200 charger")
+        reranked = LexicalOverlapReranker().rerank("X200 charger refund", matches, top_k=1)
+        self.assertEqual(reranked[0]["id"], "1")
+
+    def test_mmr_skips_near_duplicates(self):
+        matches = self.matches("refund policy details", "refund policy details", "shipping times by region")
+        reranked = MMRReranker(lambda_=0.5).rerank("refund", matches, top_k=2)
+        self.assertEqual([match["id"] for match in reranked], ["0", "2"])
+
+    def test_pipeline_uses_knowledge_base_settings(self):
+        kb = mock.Mock(
+            uuid="kb", retrieval_method="dense", reranking_enabled=True, top_k=10, top_k_after_reranking=2,
+            sparse_weightage=0.5
+        )
+        retrieved = {"matches": self.matches("a", "b", "c charger")}
+        with mock.patch("analytics.retrieval.retrieve", return_value=retrieved) as retrieve:
+            result = retrieve_for_knowledge_base("charger", kb, reranker=LexicalOverlapReranker())
+        self.assertEqual(retrieve.call_args.kwargs["k"], 10)
+        self.assertEqual([match["id"] for match in result["matches"]], ["2", "0"])
+        self.assertEqual(result["reranker"], "lexical")
+        self.assertEqual(set(result["timings"]), {"retrieval_ms", "rerank_ms", "total_ms"})
+
+        kb.reranking_enabled = False
+        with mock.patch("analytics.retrieval.retrieve", return_value=retrieved) as retrieve:
+            result = retrieve_for_knowledge_base("charger", kb)
+        self.assertEqual(retrieve.call_args.kwargs["k"], 2)
+        self.assertIsNone(result["reranker"])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class RetrievalCacheTestSuite(SimpleTestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.kb = mock.Mock(
+            uuid="kb", retrieval_method="hybrid", reranking_enabled=False, top_k=10, top_k_after_reranking=2,
+            sparse_weightage=0.5
+        )
+        patcher = mock.patch("analytics.retrieval.retrieve", return_value={"matches": [{"id": "a", "score": 1.0}]})
+        self.retrieve = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeated_queries_are_served_from_cache(self):
+        self.assertFalse(retrieve_for_knowledge_base("What is the refund policy?", self.kb)["cached"])
+        result = retrieve_for_knowledge_base("what is the  REFUND policy", self.kb)
+        self.assertTrue(result["cached"])
+        self.assertEqual(result["matches"][0]["id"], "a")
+        self.assertEqual(self.retrieve.call_count, 1)
+        retrieve_for_knowledge_base("what is the refund policy", self.kb, retrieval_method="dense")
+        self.assertEqual(self.retrieve.call_count, 2)
+
+    def test_version_bump_invalidates(self):
+        retrieve_for_knowledge_base("refund", self.kb)
+        bump_namespace_version("kb")
+        self.assertFalse(retrieve_for_knowledge_base("refund", self.kb)["cached"])
+        self.assertEqual(self.retrieve.call_count, 2)
+
+    def test_failed_retrievals_are_not_cached(self):
+        self.retrieve.return_value = {}
+        retrieve_for_knowledge_base("refund", self.kb)
+        self.assertFalse(retrieve_for_knowledge_base("refund", self.kb)["cached"])
+
+
+class BM25SparseEncoderTestSuite(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username="sparse", password="pass")
+        self.kb = KnowledgeBase.objects.create(user=user, name="kb")
+        self.namespace = str(self.kb.uuid)
+
+    def score(self, query, document):
+        weights = dict(zip(query["indices"], query["values"]))
+        return sum(weights.get(index, 0.0) * value for index, value in zip(document["indices"], document["values"]))
+
+    def test_rare_terms_weigh_more_in_queries(self):
+        encoder = BM25SparseEncoder(self.namespace)
+        documents = encoder.encode_documents([
+            "refund policy for damaged items",
+            "shipping policy and delivery times",
+            "shipping policy for international orders",
+        ])
+        query = encoder.encode_queries(["refund policy"])[0]
+        scores = [self.score(query, document) for document in documents]
+        self.assertEqual(scores.index(max(scores)), 0)
+        self.assertAlmostEqual(sum(query["values"]), 1.0, places=5)
+
+    def test_statistics_are_saved_per_knowledge_base(self):
+        encoder = BM25SparseEncoder(self.namespace)
+        encoder.encode_documents(["alpha beta", "beta gamma"])
+        encoder.save()
+        BM25SparseEncoder(self.namespace).encode_documents(["beta"])
+        self.kb.refresh_from_db()
+        self.assertEqual(self.kb.sparse_doc_count, 2)
+        self.assertEqual(self.kb.sparse_total_length, 4)
+        frequencies = dict(self.kb.sparse_terms.values_list("index", "df"))
+        self.assertEqual(frequencies[token_index("beta")], 2)
+        self.assertEqual(frequencies[token_index("alpha")], 1)
+        other = BM25SparseEncoder(self.namespace)
+        other.encode_documents(["beta delta"])
+        other.save()
+        self.assertEqual(self.kb.sparse_terms.get(index=token_index("beta")).df, 3)
+        query = BM25SparseEncoder(self.namespace).encode_queries(["alpha beta"])[0]
+        weights = dict(zip(query["indices"], query["values"]))
+        self.assertGreater(weights[token_index("alpha")], weights[token_index("beta")])
+        with mock.patch.dict("os.environ", {"SPARSE_EMBEDDINGS_API_URL": "http://sparse"}):
+            self.assertIsInstance(get_sparse_encoder(self.namespace, for_query=True), BM25SparseEncoder)
+
+    def test_new_knowledge_bases_record_bm25_on_first_indexing(self):
+        self.assertIsInstance(get_sparse_encoder(self.namespace, for_query=True), BM25SparseEncoder)
+        self.assertIsInstance(get_sparse_encoder(self.namespace), BM25SparseEncoder)
+        self.kb.refresh_from_db()
+        self.assertEqual(self.kb.sparse_encoder, "bm25")
+        with mock.patch("analytics.sparse.SPARSE_ENCODER", "remote"):
+            self.assertIsInstance(get_sparse_encoder(self.namespace), BM25SparseEncoder)
+
+    def test_knowledge_bases_indexed_before_recording_keep_the_remote_encoder(self):
+        WebsiteLink.objects.create(knowledge_base=self.kb, url="https://example.com", indexed=True)
+        with mock.patch("analytics.sparse.SPARSE_ENCODER", "bm25"):
+            self.assertIsInstance(get_sparse_encoder(self.namespace, for_query=True), RemoteSparseEncoder)
+            self.assertIsInstance(get_sparse_encoder(self.namespace), RemoteSparseEncoder)
+        self.kb.refresh_from_db()
+        self.assertEqual(self.kb.sparse_encoder, "remote")
+
+
+class IngestTestSuite(SimpleTestCase):
+    def test_download_streams_to_unique_temp_files(self):
+        response = mock.MagicMock()
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [b"hello ", b"world"]
+        session = mock.Mock()
+        session.get.return_value = response
+        first = download_to_tempfile("https://example.com/a.txt", suffix=".txt", session=session)
+        second = download_to_tempfile("https://example.com/a.txt", suffix=".txt", session=session)
+        self.addCleanup(remove_tempfile, first)
+        self.addCleanup(remove_tempfile, second)
+        self.assertNotEqual(first, second)
+        with open(first, "rb") as f:
+            self.assertEqual(f.read(), b"hello world")
+        self.assertTrue(session.get.call_args.kwargs["stream"])
+
+    def test_text_is_yielded_in_line_aligned_blocks(self):
+        response = mock.MagicMock()
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [b"line one\nline two\nline three\n"]
+        session = mock.Mock(**{"get.return_value": response})
+        path = download_to_tempfile("https://example.com/a.txt", suffix=".txt", session=session)
+        self.addCleanup(remove_tempfile, path)
+        blocks = [doc.page_content for doc in iter_text_blocks(path, "a.txt", block_size=10)]
+        self.assertEqual(blocks, ["line one\nline two\n", "line three\n"])
+
+
+class ChunkingEngineTestSuite(SimpleTestCase):
+    def test_reused_engine_matches_per_page_splitting(self):
+        pages = [
+            Document(page_content=" ".join(f"word{i}" for i in range(page * 50, page * 50 + 300)), metadata={"source": "a/b.pdf", "page": page})
+            for page in range(3)
+        ]
+        engine = ChunkingEngine(chunk_size=100, chunk_overlap=10)
+        reused = list(engine.chunk_documents(pages, pdf_local=True))
+        per_page = [chunk for page in pages for chunk in chunk_splitter(page, chunk_size=100, chunk_overlap=10, pdf_local=True)]
+        self.assertEqual([c.page_content for c in reused], [c.page_content for c in per_page])
+        self.assertEqual(reused[0].metadata, {"source": "b.pdf", "page": 0})
+
+    def test_offline_semantic_splitting_breaks_between_topics(self):
+        text = (
+            "The cat sat on the mat. The cat chased a mouse. A cat sleeps all day. "
+            "Markets fell sharply. Markets sold bonds and stocks. Markets closed lower."
+        )
+        engine = ChunkingEngine(chunk_size=200, chunk_overlap=0, semantic=True, semantic_encoder="tfidf")
+        with mock.patch("analytics.chunking.TokenTextSplitter") as token_splitter:
+            chunks = [chunk.page_content for chunk in engine.split(Document(page_content=text, metadata={"source": "doc"}))]
+        token_splitter.assert_not_called()
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(("cat" in chunk) != ("arkets" in chunk) for chunk in chunks))
+
+    def test_token_splitting_estimates_tokens_without_the_tokenizer(self):
+        text = " ".join(f"word{i}" for i in range(300))
+        with mock.patch("analytics.chunking.TokenTextSplitter", side_effect=OSError("offline")):
+            chunks = chunk_splitter(Document(page_content=text, metadata={"source": "doc"}), chunk_size=100, chunk_overlap=0)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk.page_content) <= 400 for chunk in chunks))
+
+    def test_openai_sentence_vectors_are_batched_and_cached(self):
+        with mock.patch("analytics.indexing.get_dense_vectors", side_effect=lambda texts: [[1.0, 0.0]] * len(texts)) as get_vectors:
+            engine = ChunkingEngine(chunk_size=200, chunk_overlap=0, semantic=True, semantic_encoder="openai")
+            engine.split(Document(page_content="One. Two. Three. Four.", metadata={"source": "doc"}))
+        self.assertEqual(get_vectors.call_count, 1)
+        self.assertEqual(get_vectors.call_args.args[0], ["One.", "Two.", "Three.", "Four."])
+
+
+class AgentTurnTestSuite(SimpleTestCase):
+    def completion(self, content=None, tool_calls=None):
+        message = mock.Mock(content=content, tool_calls=tool_calls)
+        return mock.Mock(choices=[mock.Mock(message=message, finish_reason="tool_calls" if tool_calls else "stop")])
+
+    def tool_call(self, call_id):
+        tool_call = mock.Mock(id=call_id, type="function")
+        tool_call.function.name = "lookup_order"
+        tool_call.function.arguments = "{}"
+        return tool_call
+
+    def test_one_model_call_per_reasoning_step(self):
+        call_model = mock.Mock(side_effect=[
+            self.completion(tool_calls=[self.tool_call("a")]),
+            self.completion(tool_calls=[self.tool_call("b")]),
+            self.completion(content="done"),
+        ])
+        run_tools = mock.Mock(side_effect=lambda calls: [{"role": "tool", "tool_call_id": calls[0].id, "content": "ok"}])
+        messages = [{"role": "user", "content": "Where is my order?"}]
+        turn = AgentTurn(messages, call_model, run_tools)
+        self.assertEqual(turn.run(), "done")
+        self.assertEqual(call_model.call_count, 3)
+        self.assertEqual(turn.summary()["tool_rounds"], 2)
+        self.assertEqual([message["role"] for message in messages], ["user", "assistant", "tool", "assistant", "tool"])
+
+    def test_last_step_forces_a_reply(self):
+        call_model = mock.Mock(side_effect=[
+            self.completion(tool_calls=[self.tool_call("a")]),
+            self.completion(content="final"),
+        ])
+        turn = AgentTurn([], call_model, lambda calls: [], max_steps=2)
+        self.assertEqual(turn.run(), "final")
+        self.assertEqual([call.args[1] for call in call_model.call_args_list], ["auto", "none"])
+
+
+class ExecuteToolCallsTestSuite(SimpleTestCase):
+    def tool_call(self, call_id, name, seconds):
+        return {"id": call_id, "name": name, "arguments": json.dumps({"seconds": seconds})}
+
+    def handler(self, tool_call):
+        args = json.loads(tool_call["arguments"])
+        time.sleep(args["seconds"])
+        if tool_call["name"] == "broken":
+            raise ValueError("boom")
+        return [{"role": "tool", "tool_call_id": tool_call["id"], "content": tool_call["name"]}]
+
+    def test_tool_calls_run_concurrently_in_order(self):
+        tool_calls = [self.tool_call(f"call_{i}", "lookup", 0.2) for i in range(3)]
+        start = time.monotonic()
+        results = execute_tool_calls(tool_calls, self.handler)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual([result["tool_call_id"] for result in results], ["call_0", "call_1", "call_2"])
+
+    def test_failures_and_timeouts_become_error_results(self):
+        tool_calls = [
+            self.tool_call("slow", "slow", 0.5),
+            self.tool_call("broken", "broken", 0),
+            self.tool_call("fast", "lookup", 0),
+        ]
+        results = execute_tool_calls(tool_calls, self.handler, timeouts={"slow": 0.1})
+        self.assertEqual([result["tool_call_id"] for result in results], ["slow", "broken", "fast"])
+        self.assertIn("timed out", json.loads(results[0]["content"])["error"])
+        self.assertIn("boom", json.loads(results[1]["content"])["error"])
+        self.assertEqual(results[2]["content"], "lookup")
+
+    def test_timed_out_calls_do_not_delay_later_steps(self):
+        hung = [self.tool_call(f"hung_{i}", "slow", 0.5) for i in range(8)]
+        execute_tool_calls(hung, self.handler, timeouts={"slow": 0.05})
+        results = execute_tool_calls([self.tool_call("next", "lookup", 0.05)], self.handler, default_timeout=0.3)
+        self.assertEqual(results[0]["content"], "lookup")
+
+    def test_calls_without_a_free_worker_are_busy(self):
+        tool_calls = [self.tool_call("first", "lookup", 0.2), self.tool_call("second", "lookup", 0)]
+        with mock.patch("analytics.tool_calls._tool_slots", threading.BoundedSemaphore(1)), \
+                mock.patch("analytics.tool_calls.TOOL_CALL_SLOT_WAIT", 0):
+            results = execute_tool_calls(tool_calls, self.handler)
+        self.assertEqual(results[0]["content"], "lookup")
+        self.assertIn("busy", json.loads(results[1]["content"])["error"])
+
+    def test_calls_over_the_limit_are_not_executed(self):
+        handler = mock.Mock(side_effect=self.handler)
+        tool_calls = [self.tool_call(f"call_{i}", "lookup", 0) for i in range(3)]
+        with mock.patch("analytics.tool_calls.TOOL_CALLS_PER_TURN", 2):
+            results = execute_tool_calls(tool_calls, handler)
+        self.assertEqual(handler.call_count, 2)
+        self.assertEqual([result["tool_call_id"] for result in results], ["call_0", "call_1", "call_2"])
+        self.assertIn("not executed", json.loads(results[2]["content"])["error"])
+
+
+class ToolRegistryTestSuite(SimpleTestCase):
+    def tool_call(self, name, arguments):
+        return {"id": f"call_{name}", "name": name, "arguments": arguments}
+
+    def test_analytics_tools_dispatch_and_stream_events(self):
+        registry = build_tool_registry(kind="analytics")
+        context = ToolContext()
+        args = {"labels": ["a"], "values": [1]}
+        results = registry.dispatch(self.tool_call("make_bar_graph", json.dumps(args)), context)
+        self.assertEqual(json.loads(results[0]["content"]), args)
+        self.assertEqual(context.events, [{"type": "bar_graph_data", "data": args}])
+        self.assertEqual(registry.stats()["make_bar_graph"]["calls"], 1)
+
+    def test_unknown_tools_and_bad_arguments_become_errors(self):
+        registry = build_tool_registry(kind="analytics")
+        unknown = registry.dispatch(self.tool_call("drop_tables", "{}"), ToolContext())
+        self.assertIn("not implemented", json.loads(unknown[0]["content"])["error"])
+        invalid = registry.dispatch(self.tool_call("make_line_graph", "{"), ToolContext())
+        self.assertEqual(json.loads(invalid[0]["content"]), {"error": "Invalid args format."})
+        self.assertEqual(registry.stats()["make_line_graph"]["errors"], 1)
+
+    def test_chat_tools_require_a_user(self):
+        self.assertEqual(build_tool_registry(None, kind="chat").handlers, {})
+        self.assertEqual(ToolRegistry().stats(), {})
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ToolRegistryCacheTestSuite(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        invalidate_tool_registries()
+        self.user = get_user_model().objects.create_user(username="registry", password="pass")
+
+    def test_registries_are_reused_until_the_user_version_changes(self):
+        registry = get_tool_registry(self.user, agent_uuid="a", kind="chat")
+        with self.assertNumQueries(0):
+            self.assertIs(get_tool_registry(self.user, agent_uuid="a", kind="chat"), registry)
+        # Another worker saved a tool of the user: only the shared version changed
+        bump_config_version("user", self.user.pk)
+        self.assertIsNot(get_tool_registry(self.user, agent_uuid="a", kind="chat"), registry)
+
+
+class CaptureUserDataTestSuite(TestCase):
+    def setUp(self):
+        user = get_user_model().objects.create_user(username="capture", password="pass")
+        agent = AssistantConfiguration.objects.create(user=user, assistant_uuid=uuid.uuid4())
+        self.room = ChatRoom.objects.create(agent=agent, customer_id="c1", captured_data={"name": "Ada"})
+
+    def test_captures_merge_into_the_chat_room(self):
+        registry = build_tool_registry(self.room.agent.user, kind="webhook")
+        for field in ({"email": "ada@example.com"}, {"phone": "123"}):
+            arguments = json.dumps({"room_id": str(self.room.session_id), "data_to_capture": field})
+            registry.dispatch({"id": "call_capture", "name": "capture_user_data", "arguments": arguments}, ToolContext())
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.captured_data, {"name": "Ada", "email": "ada@example.com", "phone": "123"})
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CompiledAgentToolsTestSuite(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.user = get_user_model().objects.create_user(username="tools", password="pass")
+        self.tool = UserTool.objects.create(
+            user=self.user, name="Lookup Order", description="Finds an order",
+            endpoint_url="https://example.com/orders", http_method="GET"
+        )
+        self.agent = AssistantConfiguration.objects.create(
+            user=self.user, assistant_uuid=uuid.uuid4(), selected_tools=[str(self.tool.uuid)]
+        )
+
+    def tool_names(self):
+        tools = get_compiled_agent_tools(self.agent.assistant_uuid, self.user)
+        return [tool.get("function", {}).get("name") for tool in tools]
+
+    def test_tools_are_compiled_once(self):
+        self.assertIn("lookup_order", self.tool_names())
+        with self.assertNumQueries(0):
+            self.assertIn("lookup_order", self.tool_names())
+
+    def test_changes_invalidate_compiled_tools(self):
+        self.tool_names()
+        self.tool.name = "Track Order"
+        self.tool.save()
+        self.assertIn("track_order", self.tool_names())
+        self.agent.selected_tools = []
+        self.agent.save()
+        self.assertNotIn("track_order", self.tool_names())
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class AgentSnapshotTestSuite(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        self.user = get_user_model().objects.create_user(username="snapshot", password="pass")
+        self.agent = AssistantConfiguration.objects.create(
+            user=self.user, assistant_uuid=uuid.uuid4(), agent_name="Ada"
+        )
+
+    def test_warm_snapshots_need_no_queries(self):
+        snapshot = get_agent_snapshot(self.agent.assistant_uuid, self.user.pk)
+        self.assertEqual(snapshot.config.agent_name, "Ada")
+        self.assertEqual(snapshot.user, self.user)
+        self.assertIn("Ada", snapshot.prompt)
+        with self.assertNumQueries(0):
+            self.assertIs(get_agent_snapshot(self.agent.assistant_uuid, self.user.pk), snapshot)
+
+    def test_saving_the_config_invalidates(self):
+        get_agent_snapshot(self.agent.assistant_uuid, self.user.pk)
+        self.agent.agent_name = "Grace"
+        self.agent.save()
+        self.assertEqual(get_agent_snapshot(self.agent.assistant_uuid, self.user.pk).config.agent_name, "Grace")
+
+    def test_local_snapshots_are_bounded(self):
+        other = AssistantConfiguration.objects.create(user=self.user, assistant_uuid=uuid.uuid4(), agent_name="Grace")
+        with mock.patch("analytics.agent_snapshot.AGENT_SNAPSHOT_LOCAL_MAX_ENTRIES", 1):
+            get_agent_snapshot(self.agent.assistant_uuid, self.user.pk)
+            get_agent_snapshot(other.assistant_uuid, self.user.pk)
+        self.assertEqual(list(agent_snapshot._snapshots), [(str(other.assistant_uuid), self.user.pk)])
+
+    def test_unknown_agents_have_no_snapshot(self):
+        self.assertIsNone(get_agent_snapshot(uuid.uuid4()))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class PromptCacheTestSuite(TestCase):
+    def setUp(self):
+        django_cache.clear()
+        user = get_user_model().objects.create_user(username="prompt", password="pass")
+        self.agent = AssistantConfiguration.objects.create(user=user, assistant_uuid=uuid.uuid4(), agent_name="Ada")
+
+    def test_prompts_are_rendered_once_per_config_version(self):
+        prompt = build_final_prompt(self.agent)
+        self.assertIn("Ada", prompt)
+        with mock.patch("analytics.tasks.render_agent_prompt") as render:
+            self.assertEqual(build_final_prompt(self.agent), prompt)
+            render.assert_not_called()
+        self.agent.agent_name = "Grace"
+        self.agent.save()
+        self.assertIn("Grace", build_final_prompt(self.agent))
+
+    def test_webhook_prompt_adds_the_response_schema(self):
+        self.assertTrue(build_prompt_webhook(self.agent).startswith(build_final_prompt(self.agent)))
+        self.assertIn("Do not explain the schema", build_prompt_webhook(self.agent))
+
+    def test_dict_configs_are_not_cached(self):
+        self.assertIn("Ada", build_final_prompt({"agent_name": "Ada"}))
+        self.assertIn("Grace", build_final_prompt({"agent_name": "Grace"}))
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List
+from django.db import close_old_connections
+from backend.settings import logger
+
+
+TOOL_CALL_WORKERS = int(os.getenv("TOOL_CALL_WORKERS", 16))  # Tool calls running at once per process, timed-out ones included
+TOOL_CALLS_PER_TURN = int(os.getenv("TOOL_CALLS_PER_TURN", 8))  # Tool calls of one model step that are executed
+TOOL_CALL_SLOT_WAIT = float(os.getenv("TOOL_CALL_SLOT_WAIT", 1))  # Seconds a step waits for free workers before "busy"
+TOOL_CALL_TIMEOUT = float(os.getenv("TOOL_CALL_TIMEOUT", 30))  # Seconds a tool call may take once it runs
+# Per-tool overrides, e.g. TOOL_CALL_TIMEOUTS='{"product_recommendation": 60}'
+TOOL_CALL_TIMEOUTS = json.loads(os.getenv("TOOL_CALL_TIMEOUTS") or "{}")
+
+_tool_executor = None
+_tool_executor_lock = threading.Lock()
+_tool_slots = threading.BoundedSemaphore(TOOL_CALL_WORKERS)  # Held from submission until the call returns
+
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    """
+    Returns the process-wide thread pool tool calls run on. Calls are only submitted with a free slot of
+    _tool_slots, which has as many slots as the pool has threads, so a submitted call starts right away.
+    """
+    global _tool_executor
+    with _tool_executor_lock:
+        if _tool_executor is None:
+            _tool_executor = ThreadPoolExecutor(max_workers=TOOL_CALL_WORKERS, thread_name_prefix="tool-call")
+    return _tool_executor
+
+
+def tool_call_fields(tool_call) -> tuple:
+    """
+    Returns the (id, name, arguments) of a tool call given as an OpenAI object or as a dict.
+    """
+    if hasattr(tool_call, "id"):
+        return tool_call.id, tool_call.function.name, tool_call.function.arguments or ""
+    return tool_call.get("id", "unknown_id"), tool_call.get("name", "unknown_name"), tool_call.get("arguments", "")
+
+
+def tool_error_message(tool_call_id: str, error: str) -> dict:
+    return {"role": "tool", "tool_call_id": tool_call_id, "content": json.dumps({"error": error})}
+
+
+def run_tool_call(handler: Callable, tool_call, close_connections: bool = False) -> List[dict]:
+    """
+    Runs one tool call, turning an exception into an error result for the model.
+    With `close_connections`, the thread's database connection is released afterwards, like a request
+    thread's would be.
+    """
+    tool_call_id, tool_name, _ = tool_call_fields(tool_call)
+    start = time.perf_counter()
+    try:
+        return handler(tool_call)
+    except Exception as e:
+        logger.exception(f"Tool call {tool_call_id} ({tool_name}) failed: {e}")
+        return [tool_error_message(tool_call_id, f"Tool '{tool_name}' failed: {e}")]
+    finally:
+        logger.debug(f"[timing] tool call {tool_name} took {time.perf_counter() - start:0.3f}s")
+        if close_connections:
+            close_old_connections()
+
+
+def execute_tool_calls(
+    tool_calls,
+    handler: Callable,
+    timeouts: Dict[str, float] = None,
+    default_timeout: float = TOOL_CALL_TIMEOUT
+) -> List[dict]:
+    """
+    Executes the tool calls of one model step concurrently on the process-wide tool pool.
+    At most TOOL_CALLS_PER_TURN calls of a step are executed, and at most TOOL_CALL_WORKERS calls of the process
+    run at once. A call that gets no free worker within TOOL_CALL_SLOT_WAIT seconds is answered as busy instead
+    of queueing. A call's timeout starts when it starts running. A timed-out call can't be stopped: the step
+    answers without it, and the call keeps its worker until it returns.
+    Args:
+        tool_calls: The tool calls of the model message.
+        handler (Callable): Executes one tool call and returns its "tool" messages.
+        timeouts (dict): Seconds allowed per tool name; defaults to TOOL_CALL_TIMEOUTS.
+        default_timeout (float): Seconds allowed for tools without an entry in `timeouts`.
+    Returns:
+        List[dict]: The tool messages in the order of `tool_calls`. Every tool call gets a message; one that
+            fails, times out, is over the limit, finds the pool busy or returns nothing gets an error message, so
+            the model can still answer.
+    """
+    timeouts = TOOL_CALL_TIMEOUTS if timeouts is None else timeouts
+    tool_calls = list(tool_calls)
+    executed = tool_calls[:TOOL_CALLS_PER_TURN]
+    if len(tool_calls) > len(executed):
+        logger.warning(f"Executing {len(executed)} of {len(tool_calls)} tool calls; TOOL_CALLS_PER_TURN is {TOOL_CALLS_PER_TURN}")
+    start = time.monotonic()
+    started = [threading.Event() for _ in executed]
+    started_at = [None] * len(executed)
+
+    def run(index, tool_call):
+        try:
+            started_at[index] = time.monotonic()
+            started[index].set()
+            return run_tool_call(handler, tool_call, True)
+        finally:
+            _tool_slots.release()
+
+    executor = get_tool_executor()
+    futures = []
+    for index, tool_call in enumerate(executed):
+        if not _tool_slots.acquire(timeout=max(start + TOOL_CALL_SLOT_WAIT - time.monotonic(), 0)):
+            futures.append(None)
+            continue
+        try:
+            futures.append(executor.submit(run, index, tool_call))
+        except Exception:
+            _tool_slots.release()
+            raise
+
+    outcomes = []
+    for index, (tool_call, future) in enumerate(zip(executed, futures)):
+        tool_call_id, tool_name, _ = tool_call_fields(tool_call)
+        if future is None:
+            logger.error(f"Tool call {tool_call_id} ({tool_name}) not executed: all {TOOL_CALL_WORKERS} tool workers are busy")
+            outcomes.append([tool_error_message(tool_call_id, f"Tool '{tool_name}' is busy, try again later.")])
+            continue
+        timeout = timeouts.get(tool_name, default_timeout)
+        try:
+            # A submitted call has a free worker, so this only waits for the worker to pick it up
+            started[index].wait()
+            deadline = started_at[index] + timeout
+            outcomes.append(future.result(timeout=max(deadline - time.monotonic(), 0)))
+        except FutureTimeoutError:
+            logger.error(f"Tool call {tool_call_id} ({tool_name}) timed out after {timeout}s")
+            outcomes.append([tool_error_message(tool_call_id, f"Tool '{tool_name}' timed out.")])
+    for tool_call in tool_calls[len(executed):]:
+        tool_call_id, tool_name, _ = tool_call_fields(tool_call)
+        outcomes.append([tool_error_message(
+            tool_call_id, f"Tool '{tool_name}' was not executed: at most {TOOL_CALLS_PER_TURN} tool calls run per step."
+        )])
+
+    results = []
+    for tool_call, messages in zip(tool_calls, outcomes):
+        if not messages:
+            tool_call_id, tool_name, _ = tool_call_fields(tool_call)
+            messages = [tool_error_message(tool_call_id, f"Tool '{tool_name}' returned no result.")]
+        results.extend(messages)
+    logger.info(f"Executed {len(executed)} tool calls in {time.monotonic() - start:0.3f}s")
+    return results
@@ -0,0 +1,514 @@
+import os
+import json
+import time
+import threading
+from typing import Dict, List
+import requests
+from django.db import transaction
+from .config_versions import get_config_versions
+from .functions import execute_user_tool
+from .indexing import get_openai_client
+from .integrations import get_integration_details
+from .models import Board, ChatRoom, Integrations, UserTool
+from .tasks import (
+    fetch_all_products,
+    get_data_from_excel,
+    get_fulfillment_line_items_by_order_id,
+    get_order_id_by_name,
+    get_product_recommendation,
+    get_shopify_orders,
+    order_tracking_with_order_id,
+    refine_query,
+    remove_prefix_and_suffix,
+    return_processing,
+)
+from .tool_calls import tool_call_fields, tool_error_message
+from backend.settings import logger
+
+
+TOOL_REGISTRY_TTL = int(os.getenv("TOOL_REGISTRY_TTL", 300))  # Seconds a process reuses an agent's registry
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+class ToolContext:
+    """
+    What a tool handler may use besides its arguments: the user the agent acts for and the conversation.
+    Handlers of streaming views append events for the client to `events`.
+    """
+
+    def __init__(self, user=None, messages: List[dict] = None):
+        self.user = user
+        self.messages = messages if messages is not None else []
+        self.events = []
+
+
+class ToolHandler:
+    """
+    Executes one tool. run() returns the JSON-serializable content sent back to the model; an exception becomes
+    an {"error": ...} result. announce() returns the events a streaming view emits before the tool runs.
+    Calls, errors and latency are counted per handler in `stats`.
+    """
+
+    name = ""
+
+    def __init__(self):
+        self._stats = {"calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        self._stats_lock = threading.Lock()
+
+    def parse_arguments(self, arguments: str) -> dict:
+        return json.loads(arguments or "{}")
+
+    def announce(self, args: dict) -> List[dict]:
+        return []
+
+    def run(self, args: dict, context: ToolContext):
+        raise NotImplementedError
+
+    def record(self, seconds: float, error: bool) -> None:
+        with self._stats_lock:
+            self._stats["calls"] += 1
+            self._stats["errors"] += int(error)
+            self._stats["total_seconds"] += seconds
+            self._stats["max_seconds"] = max(self._stats["max_seconds"], seconds)
+
+    @property
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["mean_seconds"] = stats["total_seconds"] / stats["calls"] if stats["calls"] else 0.0
+        return stats
+
+
+class FunctionToolHandler(ToolHandler):
+    """
+    Handler backed by a function(args, context).
+    """
+
+    def __init__(self, name: str, function):
+        super().__init__()
+        self.name = name
+        self.function = function
+
+    def run(self, args: dict, context: ToolContext):
+        return self.function(args, context)
+
+
+class UserToolHandler(ToolHandler):
+    """
+    Executes a preloaded UserTool, so dispatch needs no lookup query. Unparseable arguments are sent as {}.
+    """
+
+    def __init__(self, tool: UserTool):
+        super().__init__()
+        self.name = tool.name
+        self.tool = tool
+
+    def parse_arguments(self, arguments: str) -> dict:
+        try:
+            return json.loads(arguments)
+        except Exception as e:
+            logger.error(f"Error parsing arguments for user tool {self.name}: {e}")
+            return {}
+
+    def run(self, args: dict, context: ToolContext):
+        return {"result": execute_user_tool(self.name, context.user, args, tool=self.tool)}
+
+
+class GraphToolHandler(ToolHandler):
+    """
+    Analytics chart tool: streams its arguments to the client as an event of `event_type` and echoes them to the
+    model.
+    """
+
+    def __init__(self, name: str, event_type: str):
+        super().__init__()
+        self.name = name
+        self.event_type = event_type
+
+    def run(self, args: dict, context: ToolContext):
+        context.events.append({"type": self.event_type, "data": args})
+        return args
+
+
+class ToolRegistry:
+    """
+    Maps tool names to handlers for O(1) dispatch. Built once per agent (see get_tool_registry), with the user's
+    tools preloaded; a user tool shadows a built-in tool of the same name.
+    """
+
+    def __init__(self, handlers: List[ToolHandler] = ()):
+        self.handlers: Dict[str, ToolHandler] = {}
+        for handler in handlers:
+            self.register(handler)
+
+    def register(self, handler: ToolHandler) -> None:
+        self.handlers[handler.name] = handler
+
+    def announce(self, tool_call) -> List[dict]:
+        _, tool_name, arguments = tool_call_fields(tool_call)
+        handler = self.handlers.get(tool_name)
+        if handler is None:
+            return []
+        try:
+            return handler.announce(handler.parse_arguments(arguments))
+        except Exception:
+            return []
+
+    def dispatch(self, tool_call, context: ToolContext) -> List[dict]:
+        """
+        Executes a tool call.
+        Returns:
+            List[dict]: The "tool" message for the call.
+        """
+        tool_call_id, tool_name, arguments = tool_call_fields(tool_call)
+        handler = self.handlers.get(tool_name)
+        if handler is None:
+            logger.warning(f"Unhandled tool call: id={tool_call_id}, name={tool_name}")
+            return [tool_error_message(tool_call_id, f"Tool '{tool_name}' not implemented.")]
+        start = time.perf_counter()
+        error = False
+        try:
+            args = handler.parse_arguments(arguments)
+            content = handler.run(args, context)
+            if content is None:
+                error = True
+                content = {"error": f"Tool '{tool_name}' returned no result."}
+        except json.JSONDecodeError as e:
+            logger.error(f"Error decoding args for {tool_call_id}: '{arguments}'. Err: {e}")
+            error = True
+            content = {"error": "Invalid args format."}
+        except Exception as e:
+            logger.error(f"Error in {tool_name} tool call {tool_call_id}: {e}", exc_info=True)
+            error = True
+            content = {"error": str(e)}
+        seconds = time.perf_counter() - start
+        handler.record(seconds, error)
+        logger.debug(f"[timing] tool {tool_name} took {seconds:0.3f}s")
+        return [{
+            "role": "tool",
+            "tool_call_id": tool_call_id,
+            "content": content if isinstance(content, str) else json.dumps(content)
+        }]
+
+    def stats(self) -> Dict[str, dict]:
+        return {name: handler.stats for name, handler in self.handlers.items()}
+
+
+# ------------------  built-in tool handlers -------------
+
+def shopify_credentials(user) -> tuple:
+    technology = get_integration_details(user.email if user else None, technology='shopify', api_key=user.api_key)
+    return technology.get('api_domain'), technology.get('access_token')
+
+
+def handle_refine_query(args: dict, context: ToolContext):
+    query = args.get("query")
+    if not query:
+        return None
+    return {"refined_query": refine_query(query, context.messages)}
+
+
+def handle_get_data_from_excel(args: dict, context: ToolContext):
+    file_id = args.get("file_id")
+    if not file_id:
+        raise ValueError("file_id is required")
+    excel_data = get_data_from_excel(file_id)
+    if not excel_data:
+        logger.warning(f"No data found in Excel for file_id: {file_id}")
+        return {"error": "No data found in Excel."}
+    return excel_data
+
+
+def handle_order_tracking_with_order_id(args: dict, context: ToolContext):
+    user = context.user
+    order_number = args.get("order_id")
+    shopify_config = Integrations.objects.filter(user=user, name='shopify', feature_name='order_tracking').first()
+    prefix = shopify_config.details.get("prefix") if shopify_config and shopify_config.details else None
+    suffix = shopify_config.details.get("suffix") if shopify_config and shopify_config.details else None
+    order_id = remove_prefix_and_suffix(order_number=order_number, prefix=prefix, suffix=suffix)
+    if not order_id:
+        raise ValueError("order_id is required")
+    Integrations.objects.get(user=user, name='shopify', feature_name='order_tracking')
+    shopify_domain, access_token = shopify_credentials(user)
+    shopify_id = get_order_id_by_name(order_number, shopify_domain, access_token)
+    order_status = order_tracking_with_order_id(order_id=shopify_id, shopify_domain=shopify_domain, access_token=access_token)
+    if not order_status:
+        logger.warning(f"No order status found for order : {order_id}")
+        return {"error": "No order status found."}
+    return order_status
+
+
+def handle_get_shopify_orders(args: dict, context: ToolContext):
+    user = context.user
+    if not user.email:
+        raise ValueError("User email is required.")
+    Integrations.objects.get(user=user, name='shopify', feature_name='list_orders')
+    shopify_domain, access_token = shopify_credentials(user)
+    orders = get_shopify_orders(shopify_api_domain=shopify_domain, shopify_access_token=access_token, email=user.email)
+    return orders or {"error": "No orders found."}
+
+
+def handle_return_processing(args: dict, context: ToolContext):
+    user = context.user
+    if not Integrations.objects.filter(user=user, name='shopify', feature_name='return_processing').exists():
+        raise ValueError("Shopify integration for return processing not found.")
+    order_name = args.get("order_name")
+    return_reason = args.get("reason") or "OTHER"
+    if not order_name:
+        raise ValueError("Order name is required.")
+    shopify_domain, access_token = shopify_credentials(user)
+    logger.info(f"Initiating return for order: {order_name} | reason: {return_reason}")
+    order_gid = get_order_id_by_name(order_name, shopify_domain, access_token, return_gid=True)
+    if not order_gid:
+        raise ValueError(f"Order not found for name {order_name}")
+    fulfillment_line_items = get_fulfillment_line_items_by_order_id(order_gid, shopify_domain, access_token)
+    if not fulfillment_line_items:
+        raise ValueError(f"No fulfillment line items found for order {order_name}")
+    # We'll assume return is for the first fulfilled item
+    return_response = return_processing(
+        shop_domain=shopify_domain,
+        access_token=access_token,
+        order_id=order_gid,
+        fulfillment_line_item_id=fulfillment_line_items[0]["fulfillmentLineItemId"],
+        quantity=1,
+        return_reason=return_reason,
+        notify_customer=True,
+        restock=True
+    )
+    logger.info(f"Return processed successfully: {return_response}")
+    return {"success": True, "return": return_response}
+
+
+def handle_get_product_recommendations(args: dict, context: ToolContext):
+    user = context.user
+    if not Integrations.objects.filter(user=user, name='shopify', feature_name='product_recommendation').exists():
+        raise ValueError("Shopify integration for product recommendation not found.")
+    shopify_domain, access_token = shopify_credentials(user)
+    products_data = fetch_all_products(shopify_domain=shopify_domain, access_token=access_token)
+    if not products_data:
+        raise ValueError("No product data available")
+    recommendations = get_product_recommendation(products=products_data, query=args.get("query"))
+    if not recommendations:
+        return {"error": "No recommendations found."}
+    return {"recommendations": recommendations}
+
+
+def select_with_model(system_prompt: str, prompt: str):
+    completion = get_openai_client().chat.completions.create(
+        model="gpt-4.1",
+        messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}],
+        temperature=0,
+    )
+    content = completion.choices[0].message.content
+    try:
+        return json.loads(content)
+    except Exception:
+        logger.info(f"WebhookComponent: no url selected--- {content}")
+        return []
+
+
+def handle_get_relevant_images(args: dict, context: ToolContext):
+    query = args.get("context", "")
+    board_id = args.get("board_id")
+    max_results = int(args.get("max_results", 5))
+    boards = Board.objects.filter(user=context.user)
+    board = boards.filter(id=board_id).first() if board_id else boards.first()
+    images = board.images if board and board.images else []
+    prompt = (
+        f"""Given the following context of conversation: '{query}', and the following images with metadata:{images} +
+        Return a JSON array of up to {max_results} image URLs that should be shown in the bot reply .
+        the response should be in the format:
+        {{
+            "number_of_images": <number_of_images>,
+            "image1": "<image_url_1>",
+            "image2": "<image_url_2>",
+            "image3": "<image_url_3>",
+            "image4": "<image_url_4>",
+            "image5": "<image_url_5>",
+        }}
+        """
+    )
+    return select_with_model("You are an assistant that selects relevant images.", prompt)
+
+
+def handle_get_buttons(args: dict, context: ToolContext):
+    query = args.get("context", "")
+    max_results = int(args.get("max_results", 10))
+    prompt = (
+        f"""Given the following context of conversation: '{query}', +
+        Return a JSON array of up to {max_results} buttons content that should be shown in the bot reply .
+        the response should be in the format:
+        {{
+            "number_of_buttons": <number_of_buttons>,
+            "button1": "<button_content_1>",
+            "button2": "<button_content_2>",
+            "button3": "<button_content_3>",
+            "button4": "<button_content_4>",
+            "button5": "<button_content_5>",
+        }}
+        here is an example:
+        """
+    )
+    return select_with_model("You are an assistant that selects relevant buttons.", prompt)
+
+
+def handle_capture_user_data(args: dict, context: ToolContext):
+    data_to_capture = args.get("data_to_capture", "") or args
+    room_id = args.get("room_id") or args.get("session_id") or args.get("@room_id")
+    if not room_id:
+        # Try to get from messages context if not in args
+        room_id = next(
+            (
+                msg.get("room_id") for msg in context.messages
+                if isinstance(msg, dict) and msg.get("role") == "user" and msg.get("room_id")
+            ),
+            None
+        )
+    if not room_id:
+        raise ValueError("room_id is required to capture user data")
+    # Merge new data with existing captured_data; the row lock keeps parallel calls of one turn from
+    # overwriting each other's fields
+    with transaction.atomic():
+        try:
+            chat_room = ChatRoom.objects.select_for_update().only("id", "captured_data", "last_message_time").get(session_id=room_id)
+        except ChatRoom.DoesNotExist:
+            raise ValueError(f"ChatRoom with session_id {room_id} does not exist")
+        captured_data = chat_room.captured_data or {}
+        if isinstance(data_to_capture, dict):
+            captured_data.update(data_to_capture)
+        else:
+            captured_data["data"] = data_to_capture
+        chat_room.captured_data = captured_data
+        chat_room.save(update_fields=["captured_data", "last_message_time"])
+    return {"captured_data": captured_data}
+
+
+class DatabaseQueryToolHandler(ToolHandler):
+    """
+    get_data_from_database of the analytics chat: runs a query through WHATSAPP_ANALYTICS_URL and streams any
+    table or graph in the answer to the client.
+    """
+
+    name = "get_data_from_database"
+
+    def announce(self, args: dict) -> List[dict]:
+        return [{"type": "thinking", "description": args.get("description", "Fetching data from database...")}]
+
+    def run(self, args: dict, context: ToolContext):
+        query = args.get("query")
+        if not query:
+            logger.warning(f"Tool {self.name} missing 'query'.")
+            return {"error": "Missing query argument"}
+        api_url = os.getenv("WHATSAPP_ANALYTICS_URL")
+        headers = {'Content-Type': 'application/json', 'Cookie': 'multidb_pin_writes=y'}
+        logger.info(f"Executing API call for {self.name} to {api_url}")
+        try:
+            response = requests.post(api_url, headers=headers, json={"query": query}, timeout=30)
+            logger.info(f"API call to {api_url} completed with status code: {response.status_code}")
+            result_data = response.json()
+            response.raise_for_status()
+        except requests.exceptions.Timeout:
+            logger.error(f"API call to {api_url} timed out.", exc_info=True)
+            return {"error": "API call timed out."}
+        except requests.exceptions.RequestException as e:
+            logger.error(f"API call to {api_url} failed: {e}", exc_info=True)
+            return {"error": "API call failed."}
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to decode JSON from {api_url}: {e}", exc_info=True)
+            return {"error": "Invalid API JSON response."}
+        if isinstance(result_data, dict) and "table_data" in result_data:
+            context.events.append({"type": "table_data", "data": result_data.get("table") or result_data.get("table_data")})
+        if isinstance(result_data, dict) and "graph_data" in result_data:
+            context.events.append({"type": "graph_data", "data": result_data.get("graph") or result_data.get("graph_data")})
+        return result_data
+
+
+def handle_make_graph(args: dict, context: ToolContext):
+    data = {
+        "x_label": args.get("x_label", "X Axis"),
+        "y_label": args.get("y_label", "Y Axis"),
+        "x_coordinates": args.get("x_coordinates", []),
+        "y_coordinates": args.get("y_coordinates", []),
+    }
+    context.events.append({"type": "graph_data", "data": data})
+    return data
+
+
+CHAT_TOOL_HANDLERS = [
+    FunctionToolHandler("refine_query", handle_refine_query),
+    FunctionToolHandler("get_data_from_excel", handle_get_data_from_excel),
+    FunctionToolHandler("order_tracking_with_order_id", handle_order_tracking_with_order_id),
+    FunctionToolHandler("get_shopify_orders", handle_get_shopify_orders),
+    FunctionToolHandler("return_processing", handle_return_processing),
+    FunctionToolHandler("get_product_recommendations", handle_get_product_recommendations),
+]
+WEBHOOK_TOOL_HANDLERS = CHAT_TOOL_HANDLERS + [
+    FunctionToolHandler("get_relevant_images", handle_get_relevant_images),
+    FunctionToolHandler("get_buttons", handle_get_buttons),
+    FunctionToolHandler("capture_user_data", handle_capture_user_data),
+]
+ANALYTICS_TOOL_HANDLERS = [
+    DatabaseQueryToolHandler(),
+    FunctionToolHandler("make_graph", handle_make_graph),
+    GraphToolHandler("make_bar_graph", "bar_graph_data"),
+    GraphToolHandler("make_line_graph", "line_graph_data"),
+    GraphToolHandler("make_area_graph", "area_graph_data"),
+    GraphToolHandler("make_doughnut_graph", "doughnut_graph_data"),
+]
+TOOL_HANDLERS = {
+    "chat": CHAT_TOOL_HANDLERS,
+    "webhook": WEBHOOK_TOOL_HANDLERS,
+    "analytics": ANALYTICS_TOOL_HANDLERS,
+}
+
+
+def build_tool_registry(user=None, kind: str = "chat") -> ToolRegistry:
+    """
+    Builds the registry of a view kind ("chat", "webhook" or "analytics").
+    Chat and webhook agents only act for a known user: they get the built-in tools and every tool of the user,
+    loaded in one query. Without a user only unknown-tool errors are returned.
+    """
+    if kind == "analytics":
+        return ToolRegistry(ANALYTICS_TOOL_HANDLERS)
+    if not user or not getattr(user, "is_authenticated", True):
+        return ToolRegistry()
+    registry = ToolRegistry(TOOL_HANDLERS[kind])
+    for tool in UserTool.objects.filter(user=user):
+        registry.register(UserToolHandler(tool))
+    return registry
+
+
+def get_tool_registry(user=None, agent_uuid=None, kind: str = "chat") -> ToolRegistry:
+    """
+    Returns the registry of an agent acting for `user`, built once and reused for TOOL_REGISTRY_TTL seconds.
+    Registries of a user are kept under the user's config version, so saving or deleting a UserTool or an
+    integration in any process rebuilds them on the next turn. Without a reachable cache they are built per call.
+    """
+    user_id = getattr(user, "pk", None)
+    version = None
+    if kind != "analytics" and user_id is not None:
+        versions = get_config_versions(("user", user_id))
+        if versions is None:
+            return build_tool_registry(user, kind)
+        version = versions[0]
+    key = (str(agent_uuid), user_id, kind)
+    now = time.monotonic()
+    with _registries_lock:
+        cached = _registries.get(key)
+        if cached is not None and cached[0] > now and cached[1] == version:
+            return cached[2]
+    registry = build_tool_registry(user, kind)
+    with _registries_lock:
+        _registries[key] = (now + TOOL_REGISTRY_TTL, version, registry)
+    return registry
+
+
+def invalidate_tool_registries(user_id=None) -> None:
+    """
+    Drops the cached registries of a user, or all of them.
+    """
+    with _registries_lock:
+        for key in [key for key in _registries if user_id is None or key[1] == user_id]:
+            del _registries[key]
@@ -0,0 +1,73 @@
+import os
+from typing import List
+from django.core.cache import cache
+from .config_versions import get_config_versions
+from .functions import user_tool_to_openai_tool
+from .models import AssistantConfiguration, IntegrationFeature, UserTool
+from .tools import AGENT_TOOLS, INTEGRATION_TOOLS, WEBHOOK_TOOLS
+from backend.settings import logger
+
+
+TOOL_SCHEMA_CACHE_ENABLED = os.getenv("TOOL_SCHEMA_CACHE_ENABLED", "true").lower() != "false"
+TOOL_SCHEMA_CACHE_TTL = int(os.getenv("TOOL_SCHEMA_CACHE_TTL", 24 * 3600))  # 24 hours
+
+
+def compile_agent_tools(agent_uuid, user=None, webhook: bool = False, agent=None) -> List[dict]:
+    """
+    Builds the OpenAI tool list of an agent for a user: the static agent tools (and webhook tools), the user
+    tools the agent selected, in selection order, and the integration tools whose feature is active for the user.
+    The user tools and the active features are each loaded with one query; pass `agent` if it is already loaded.
+    """
+    tools = list(AGENT_TOOLS) + (list(WEBHOOK_TOOLS) if webhook else [])
+    agent = agent or AssistantConfiguration.objects.filter(assistant_uuid=agent_uuid).first()
+    if not agent:
+        logger.warning(f"No agent found for UUID: {agent_uuid}")
+        return tools
+    if not user:
+        return tools
+
+    selected_tools = agent.selected_tools or []
+    user_tools = {str(tool.uuid): tool for tool in UserTool.objects.filter(user=user, uuid__in=selected_tools)}
+    for tool_uuid in selected_tools:
+        user_tool = user_tools.get(str(tool_uuid))
+        if user_tool:
+            tools.append(user_tool_to_openai_tool(user_tool))
+
+    integration_tools = agent.integration_tools or []
+    active_features = set(IntegrationFeature.objects.filter(
+        integration__user=user, is_active=True, hash__in=integration_tools
+    ).values_list("hash", flat=True))
+    for feature in integration_tools:
+        if feature not in active_features:
+            logger.warning(f"Feature '{feature}' not active for user: {user}")
+        elif feature not in INTEGRATION_TOOLS:
+            logger.warning(f"No static tool definition found for feature: {feature}")
+        else:
+            tools.append(INTEGRATION_TOOLS[feature])
+    return tools
+
+
+def get_compiled_agent_tools(agent_uuid, user=None, webhook: bool = False) -> List[dict]:
+    """
+    Returns the tool list of an agent for a user from the Django cache (Redis), compiling it on a miss.
+    Entries are keyed by the agent's and the user's config versions, which signals bump whenever an
+    AssistantConfiguration, UserTool, Integrations or IntegrationFeature row changes.
+    """
+    user_id = getattr(user, "pk", None) if user else None
+    versions = get_config_versions(("agent", agent_uuid), ("user", user_id)) if TOOL_SCHEMA_CACHE_ENABLED else None
+    if versions is None:
+        return compile_agent_tools(agent_uuid, user, webhook)
+    key = f"agent_tools:{agent_uuid}:{versions[0]}:{user_id}:{versions[1]}:{int(webhook)}"
+    try:
+        tools = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Tool schema cache lookup failed: {e}")
+        tools = None
+    if tools is not None:
+        return tools
+    tools = compile_agent_tools(agent_uuid, user, webhook)
+    try:
+        cache.set(key, tools, timeout=TOOL_SCHEMA_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"Tool schema cache store failed: {e}")
+    return tools
@@ -34,7 +34,7 @@ urlpatterns = [
     path('assistant/config/', AssistantConfigurationView.as_view(), name='assistant-config'),
     path('knowledgebase/upload/', knowledgebase.knowledgebase_upload_file, name='knowledgebase-upload-file'),
     path('knowledgebase/list/', knowledgebase.knowledgebase_list_files, name='knowledgebase-list-files'),
-    path('knowledgebase/delete/<int:excel_id>/', knowledgebase.knowledgebase_delete_file, name='knowledgebase-delete-file'),
+    path('knowledgebase/delete/<int:file_id>/', knowledgebase.knowledgebase_delete_file, name='knowledgebase-delete-file'),
     path('knowledgebase/links/', knowledgebase.knowledgebase_list_links, name='knowledgebase-list-links'),
     path('knowledgebase/add-link/', knowledgebase.knowledgebase_add_link, name='knowledgebase-add-link'),
     path('knowledgebase/add-excel/', knowledgebase.knowledgebase_add_excel, name='knowledgebase_add_excel'),
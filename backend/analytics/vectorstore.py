@@ -0,0 +1,556 @@
+import os
+import re
+import json
+import fcntl
+import time
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+import numpy as np
+from pinecone import Pinecone
+from backend.settings import BASE_DIR, logger
+
+
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "pinecone")  # "pinecone" or "local"
+LOCAL_VECTOR_STORE_PATH = os.getenv("LOCAL_VECTOR_STORE_PATH", os.path.join(BASE_DIR, "vectorstore"))
+# Pinecone accepts at most 1000 IDs per delete request
+PINECONE_DELETE_BATCH_SIZE = 1000
+PINECONE_FETCH_BATCH_SIZE = 100  # IDs per fetch request, which passes them in the URL
+PINECONE_DELETE_STALE_RETRIES = 5  # Re-queries of a filter that only matches already deleted IDs
+PINECONE_DELETE_RETRY_DELAY = 0.5  # Seconds before the first re-query, doubled per retry
+
+_pinecone_indexes = {}
+_pinecone_lock = threading.Lock()
+_vector_stores = {}
+_vector_stores_lock = threading.Lock()
+
+
+def get_pinecone_index(index_name: str = None):
+    """
+    Returns a Pinecone index handle for the given index name (defaults to PINECONE_INDEX).
+    Handles are created once per process and reused, so callers do not pay for a new client on every write.
+    """
+    index_name = index_name or os.getenv('PINECONE_INDEX')
+    with _pinecone_lock:
+        index = _pinecone_indexes.get(index_name)
+        if index is None:
+            pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+            index = pc.Index(index_name)
+            _pinecone_indexes[index_name] = index
+    return index
+
+
+class VectorStore:
+    """
+    Vector index the RAG pipeline writes chunks to and retrieves them from.
+    Records are Pinecone-shaped dicts: {"id", "values", "sparse_values": {"indices", "values"}, "metadata"}.
+    query() returns {"matches": [{"id", "score", "metadata"}, ...]} ordered by descending dot-product score,
+    where a hybrid query adds the sparse dot product to the dense one.
+    Each knowledge base lives in its own namespace.
+    """
+
+    def upsert(self, vectors: List[dict], namespace: str) -> None:
+        raise NotImplementedError
+
+    def query(
+        self,
+        namespace: str,
+        vector: List[float],
+        sparse_vector: dict = None,
+        top_k: int = 10,
+        filter: dict = None,
+        include_metadata: bool = True
+    ):
+        raise NotImplementedError
+
+    def delete(self, ids: List[str], namespace: str) -> None:
+        raise NotImplementedError
+
+    def fetch(self, ids: List[str], namespace: str) -> Dict[str, dict]:
+        """
+        Returns the stored records of the given IDs, keyed by ID; missing IDs are left out.
+        """
+        raise NotImplementedError
+
+    def list_ids(self, prefix: str, namespace: str) -> List[str]:
+        raise NotImplementedError
+
+    def delete_by_filter(self, filter: dict, namespace: str) -> int:
+        raise NotImplementedError
+
+    def create_namespace(self, namespace: str) -> None:
+        pass
+
+    def drop_namespace(self, namespace: str) -> None:
+        raise NotImplementedError
+
+    def delete_source(self, prefix: str, namespace: str, ids: List[str] = ()) -> int:
+        """
+        Deletes the vectors of one source: the given IDs plus every ID starting with `prefix`.
+        Returns:
+            int: The number of IDs deleted.
+        """
+        ids = set(ids)
+        ids.update(self.list_ids(prefix, namespace))
+        ids = sorted(ids)
+        self.delete(ids, namespace)
+        return len(ids)
+
+
+class PineconeVectorStore(VectorStore):
+    """
+    VectorStore backed by a Pinecone index (PINECONE_INDEX unless an index handle is given).
+    """
+
+    def __init__(self, index=None):
+        self.index = index if index is not None else get_pinecone_index()
+
+    def upsert(self, vectors: List[dict], namespace: str) -> None:
+        self.index.upsert(vectors=vectors, namespace=namespace)
+
+    def query(self, namespace, vector, sparse_vector=None, top_k=10, filter=None, include_metadata=True):
+        kwargs = {"vector": vector, "top_k": top_k, "include_metadata": include_metadata, "namespace": namespace}
+        if sparse_vector is not None:
+            kwargs["sparse_vector"] = sparse_vector
+        if filter:
+            kwargs["filter"] = filter
+        return self.index.query(**kwargs)
+
+    def delete(self, ids: List[str], namespace: str) -> None:
+        for start in range(0, len(ids), PINECONE_DELETE_BATCH_SIZE):
+            self.index.delete(ids=ids[start:start + PINECONE_DELETE_BATCH_SIZE], namespace=namespace)
+
+    def fetch(self, ids: List[str], namespace: str) -> Dict[str, dict]:
+        records = {}
+        for start in range(0, len(ids), PINECONE_FETCH_BATCH_SIZE):
+            response = self.index.fetch(ids=ids[start:start + PINECONE_FETCH_BATCH_SIZE], namespace=namespace)
+            for id, vector in (response.get("vectors") or {}).items():
+                sparse = vector.get("sparse_values")
+                record = {"id": id, "values": list(vector.get("values") or []), "metadata": dict(vector.get("metadata") or {})}
+                if sparse:
+                    record["sparse_values"] = {"indices": list(sparse.get("indices")), "values": list(sparse.get("values"))}
+                records[id] = record
+        return records
+
+    def list_ids(self, prefix: str, namespace: str) -> List[str]:
+        """
+        Lists the IDs starting with `prefix`, page by page. Returns an empty list on indexes that cannot list IDs.
+        """
+        ids = []
+        try:
+            for page in self.index.list(prefix=prefix, namespace=namespace):
+                ids.extend(page)
+        except Exception as e:
+            logger.debug(f"Listing vector IDs with prefix {prefix} is not supported: {e}")
+        return ids
+
+    def delete_by_filter(self, filter: dict, namespace: str) -> int:
+        """
+        Deletes the vectors matching a metadata filter.
+        Pinecone caps a query at 10000 matches, so the query is repeated until it matches nothing. Deletes are
+        eventually consistent: while a query only returns already deleted IDs, it is retried with backoff, up to
+        PINECONE_DELETE_STALE_RETRIES times, before giving up.
+        Returns:
+            int: The number of vectors deleted.
+        """
+        from .indexing import EMBEDDING_DIMENSIONS
+        seen = set()
+        stale = 0
+        while True:
+            query_result = self.index.query(
+                vector=[0.0] * EMBEDDING_DIMENSIONS,
+                filter=filter,
+                namespace=namespace,
+                top_k=10000,
+                include_values=False
+            )
+            matches = [match["id"] for match in query_result.get("matches", [])]
+            if not matches:
+                return len(seen)
+            ids = [id for id in matches if id not in seen]
+            if ids:
+                stale = 0
+                self.delete(ids, namespace)
+                seen.update(ids)
+                continue
+            stale += 1
+            if stale > PINECONE_DELETE_STALE_RETRIES:
+                logger.warning(f"Filter {filter} in namespace {namespace} still matches {len(matches)} deleted vectors")
+                return len(seen)
+            time.sleep(PINECONE_DELETE_RETRY_DELAY * 2 ** (stale - 1))
+
+    def create_namespace(self, namespace: str) -> None:
+        # Pinecone creates namespaces on first write; a marker vector makes the namespace visible right away.
+        from .indexing import EMBEDDING_DIMENSIONS
+        self.index.upsert(
+            vectors=[{"id": f"init-{namespace}", "values": [0.1] * EMBEDDING_DIMENSIONS, "metadata": {"init": True}}],
+            namespace=namespace
+        )
+
+    def drop_namespace(self, namespace: str) -> None:
+        self.index.delete(delete_all=True, namespace=namespace)
+
+
+def metadata_matches(metadata: dict, filter: dict) -> bool:
+    """
+    Evaluates the subset of Pinecone's metadata filter language used by this app:
+    {"field": value}, {"field": {"$eq"|"$ne"|"$in"|"$nin": ...}}, "$and" and "$or".
+    """
+    for field, condition in filter.items():
+        if field == "$and":
+            if not all(metadata_matches(metadata, clause) for clause in condition):
+                return False
+            continue
+        if field == "$or":
+            if not any(metadata_matches(metadata, clause) for clause in condition):
+                return False
+            continue
+        value = metadata.get(field)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, argument in condition.items():
+            if operator == "$eq":
+                matched = value == argument
+            elif operator == "$ne":
+                matched = value != argument
+            elif operator == "$in":
+                matched = value in argument
+            elif operator == "$nin":
+                matched = value not in argument
+            else:
+                raise ValueError(f"Unsupported metadata filter operator: {operator}")
+            if not matched:
+                return False
+    return True
+
+
+class LocalNamespace:
+    """
+    One namespace of a LocalVectorStore, stored in its own directory as a compacted base plus append-only segments.
+    A base is a float32 dense matrix (base-<n>.npy, memory-mapped for queries) and its records (base-<n>.json:
+    IDs, sparse vectors and metadata); each upsert appends only its own records as segment-<n>.npy/.json.
+    state.json names the current base and segments and is replaced atomically on every write, so readers reload
+    when it changes and only read the segments they have not seen. Once the segments hold more rows than the base,
+    they are compacted into a new base, which keeps the cost of a stream of upserts linear; deletes compact too.
+    Writers from several processes are serialized with an exclusive lock on the directory's lock file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._version = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self.ids = []
+        self.rows = {}
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self.sparse = []
+        self.metadata = []
+        self._postings = None
+        self._state = {"base": None, "segments": [], "next": 0}
+        self._base_rows = 0
+        self._segment_rows = 0
+
+    @property
+    def dense(self) -> np.ndarray:
+        return self._matrix[:len(self.ids)]
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.path, "state.json")
+
+    def file_path(self, name: str, extension: str) -> str:
+        return os.path.join(self.path, f"{name}.{extension}")
+
+    def refresh(self) -> None:
+        """
+        Reloads the namespace if another process or instance has written it since it was loaded.
+        Only new segments are read if the base is unchanged.
+        """
+        for attempt in range(2):
+            try:
+                stat = os.stat(self.state_path)
+                version = (stat.st_ino, stat.st_mtime_ns)
+            except FileNotFoundError:
+                version = None
+            if version == self._version:
+                return
+            try:
+                self._load(version)
+                return
+            except FileNotFoundError:
+                # A concurrent compaction removed a file this state referred to; read the new state
+                self._version = None
+                self._reset()
+
+    def _load(self, version) -> None:
+        if version is None:
+            self._reset()
+            self._version = None
+            return
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        loaded = self._state["segments"]
+        if state["base"] != self._state["base"] or state["segments"][:len(loaded)] != loaded:
+            self._reset()
+            if state["base"] is not None:
+                with open(self.file_path(state["base"], "json"), "r", encoding="utf-8") as f:
+                    records = json.load(f)
+                self.ids = records["ids"]
+                self.sparse = records["sparse"]
+                self.metadata = records["metadata"]
+                self.rows = {id: row for row, id in enumerate(self.ids)}
+                self._matrix = np.load(self.file_path(state["base"], "npy"), mmap_mode="r")
+                self._base_rows = len(self.ids)
+            loaded = []
+        for segment in state["segments"][len(loaded):]:
+            with open(self.file_path(segment, "json"), "r", encoding="utf-8") as f:
+                records = json.load(f)
+            dense = np.load(self.file_path(segment, "npy"))
+            self._apply(records["ids"], dense, records["sparse"], records["metadata"])
+            self._segment_rows += len(records["ids"])
+        self._state = state
+        self._version = version
+
+    @contextmanager
+    def writing(self):
+        """
+        Holds the namespace's write lock around a mutation, loading the latest state first.
+        upsert() and delete() persist their own changes.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_state(self, state: dict) -> None:
+        state_tmp = self.state_path + ".tmp"
+        with open(state_tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(state_tmp, self.state_path)
+        stat = os.stat(self.state_path)
+        self._state = state
+        self._version = (stat.st_ino, stat.st_mtime_ns)
+
+    def _write_records(self, name: str, ids: List[str], dense: np.ndarray, sparse: list, metadata: list) -> None:
+        np.save(self.file_path(name, "npy"), np.ascontiguousarray(dense, dtype=np.float32))
+        with open(self.file_path(name, "json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "sparse": sparse, "metadata": metadata}, f)
+
+    def _apply(self, ids: List[str], dense: np.ndarray, sparse: list, metadata: list) -> None:
+        """
+        Applies upserted records in memory, growing the dense matrix geometrically.
+        """
+        new = sum(1 for id in dict.fromkeys(ids) if id not in self.rows)
+        needed = len(self.ids) + new
+        if not self._matrix.flags.writeable or needed > self._matrix.shape[0] or self._matrix.shape[1] != dense.shape[1]:
+            matrix = np.empty((max(needed, 2 * len(self.ids), 16), dense.shape[1]), dtype=np.float32)
+            if self.ids:
+                matrix[:len(self.ids)] = self.dense
+            self._matrix = matrix
+        for id, values, sparse_values, meta in zip(ids, dense, sparse, metadata):
+            row = self.rows.get(id)
+            if row is None:
+                row = len(self.ids)
+                self.rows[id] = row
+                self.ids.append(id)
+                self.sparse.append(None)
+                self.metadata.append(None)
+            self._matrix[row] = values
+            self.sparse[row] = sparse_values
+            self.metadata[row] = meta
+        self._postings = None
+
+    def compact(self) -> None:
+        """
+        Writes the whole namespace as a new base and removes the previous base and segments.
+        """
+        name = f"base-{self._state['next']:06d}"
+        self._write_records(name, self.ids, self.dense, self.sparse, self.metadata)
+        obsolete = [self._state["base"]] + self._state["segments"]
+        self._write_state({"base": name, "segments": [], "next": self._state["next"] + 1})
+        self._base_rows = len(self.ids)
+        self._segment_rows = 0
+        for old in obsolete:
+            for extension in ("npy", "json"):
+                if old is not None:
+                    try:
+                        os.remove(self.file_path(old, extension))
+                    except FileNotFoundError:
+                        pass
+
+    def upsert(self, vectors: List[dict]) -> None:
+        dimensions = len(vectors[0]["values"])
+        if self.ids and self.dense.shape[1] != dimensions:
+            raise ValueError(f"Vector dimension {dimensions} does not match the namespace dimension {self.dense.shape[1]}")
+        ids = [vector["id"] for vector in vectors]
+        dense = np.asarray([vector["values"] for vector in vectors], dtype=np.float32)
+        sparse = [vector.get("sparse_values") for vector in vectors]
+        metadata = [vector.get("metadata") or {} for vector in vectors]
+        self._apply(ids, dense, sparse, metadata)
+        if self._segment_rows + len(ids) > self._base_rows:
+            self.compact()
+            return
+        name = f"segment-{self._state['next']:06d}"
+        self._write_records(name, ids, dense, sparse, metadata)
+        self._write_state({
+            "base": self._state["base"],
+            "segments": self._state["segments"] + [name],
+            "next": self._state["next"] + 1,
+        })
+        self._segment_rows += len(ids)
+
+    def delete(self, ids: List[str]) -> int:
+        doomed = {self.rows[id] for id in ids if id in self.rows}
+        if not doomed:
+            return 0
+        keep = [row for row in range(len(self.ids)) if row not in doomed]
+        self._matrix = np.array(self.dense[keep], dtype=np.float32)
+        self.ids = [self.ids[row] for row in keep]
+        self.sparse = [self.sparse[row] for row in keep]
+        self.metadata = [self.metadata[row] for row in keep]
+        self.rows = {id: row for row, id in enumerate(self.ids)}
+        self._postings = None
+        self.compact()
+        return len(doomed)
+
+    def sparse_scores(self, sparse_vector: dict) -> np.ndarray:
+        """
+        Sparse dot products of the query with every record, through a term -> (rows, values) inverted index.
+        """
+        if self._postings is None:
+            postings = {}
+            for row, sparse in enumerate(self.sparse):
+                for index, value in zip((sparse or {}).get("indices", []), (sparse or {}).get("values", [])):
+                    postings.setdefault(index, ([], []))
+                    postings[index][0].append(row)
+                    postings[index][1].append(value)
+            self._postings = {
+                index: (np.asarray(rows), np.asarray(values, dtype=np.float32))
+                for index, (rows, values) in postings.items()
+            }
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for index, value in zip(sparse_vector.get("indices", []), sparse_vector.get("values", [])):
+            posting = self._postings.get(index)
+            if posting is not None:
+                np.add.at(scores, posting[0], value * posting[1])
+        return scores
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process VectorStore on NumPy, for small tenants, benchmarks and offline tests.
+    Each namespace is a directory under `path` (LOCAL_VECTOR_STORE_PATH) whose dense matrix is memory-mapped,
+    so queries are one matrix-vector product over the page cache plus an inverted-index pass for hybrid queries.
+    """
+
+    def __init__(self, path: str = LOCAL_VECTOR_STORE_PATH):
+        self.path = path
+        self._namespaces: Dict[str, LocalNamespace] = {}
+        self._lock = threading.RLock()
+
+    def namespace(self, namespace: str) -> LocalNamespace:
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]", "_", namespace)
+        with self._lock:
+            local = self._namespaces.get(safe_name)
+            if local is None:
+                local = self._namespaces[safe_name] = LocalNamespace(os.path.join(self.path, safe_name))
+            return local
+
+    def upsert(self, vectors: List[dict], namespace: str) -> None:
+        if not vectors:
+            return
+        local = self.namespace(namespace)
+        with self._lock, local.writing():
+            local.upsert(vectors)
+
+    def query(self, namespace, vector, sparse_vector=None, top_k=10, filter=None, include_metadata=True) -> dict:
+        local = self.namespace(namespace)
+        with self._lock:
+            local.refresh()
+            if not local.ids:
+                return {"matches": [], "namespace": namespace}
+            scores = np.asarray(local.dense @ np.asarray(vector, dtype=np.float32), dtype=np.float32)
+            if sparse_vector:
+                scores = scores + local.sparse_scores(sparse_vector)
+            if filter:
+                allowed = np.array([metadata_matches(metadata or {}, filter) for metadata in local.metadata])
+                scores = np.where(allowed, scores, -np.inf)
+            top_k = min(top_k, int(np.isfinite(scores).sum()))
+            if top_k <= 0:
+                return {"matches": [], "namespace": namespace}
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            matches = []
+            for row in top:
+                match = {"id": local.ids[row], "score": float(scores[row])}
+                if include_metadata:
+                    match["metadata"] = local.metadata[row]
+                matches.append(match)
+        return {"matches": matches, "namespace": namespace}
+
+    def delete(self, ids: List[str], namespace: str) -> None:
+        if not ids:
+            return
+        local = self.namespace(namespace)
+        with self._lock, local.writing():
+            local.delete(ids)
+
+    def fetch(self, ids: List[str], namespace: str) -> Dict[str, dict]:
+        local = self.namespace(namespace)
+        with self._lock:
+            local.refresh()
+            return {
+                id: {
+                    "id": id,
+                    "values": local.dense[local.rows[id]].tolist(),
+                    "sparse_values": local.sparse[local.rows[id]],
+                    "metadata": local.metadata[local.rows[id]],
+                }
+                for id in ids if id in local.rows
+            }
+
+    def list_ids(self, prefix: str, namespace: str) -> List[str]:
+        local = self.namespace(namespace)
+        with self._lock:
+            local.refresh()
+            return [id for id in local.ids if id.startswith(prefix)]
+
+    def delete_by_filter(self, filter: dict, namespace: str) -> int:
+        local = self.namespace(namespace)
+        with self._lock, local.writing():
+            return local.delete([
+                id for id, metadata in zip(local.ids, local.metadata) if metadata_matches(metadata or {}, filter)
+            ])
+
+    def create_namespace(self, namespace: str) -> None:
+        os.makedirs(self.namespace(namespace).path, exist_ok=True)
+
+    def drop_namespace(self, namespace: str) -> None:
+        local = self.namespace(namespace)
+        with self._lock:
+            shutil.rmtree(local.path, ignore_errors=True)
+            local.refresh()
+
+
+VECTOR_STORES = {
+    "pinecone": PineconeVectorStore,
+    "local": LocalVectorStore,
+}
+
+
+def get_vector_store(backend: str = None) -> VectorStore:
+    """
+    Returns the process-wide VectorStore of a backend (defaults to VECTOR_STORE_BACKEND).
+    """
+    backend = backend or VECTOR_STORE_BACKEND
+    with _vector_stores_lock:
+        store = _vector_stores.get(backend)
+        if store is None:
+            store = _vector_stores[backend] = VECTOR_STORES[backend]()
+    return store
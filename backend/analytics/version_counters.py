@@ -0,0 +1,29 @@
+import time
+from typing import List
+from django.core.cache import cache
+
+
+def get_version_counters(keys: List[str]) -> tuple:
+    """
+    Returns the values of version counters in the Django cache, read with one round trip when they all exist.
+    A missing counter starts at the current time in microseconds rather than 0, so a counter lost to eviction
+    never comes back at a version older entries were stored under. Cache errors are raised to the caller.
+    """
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns() // 1000, timeout=None)
+            versions[key] = cache.get(key)
+    return tuple(versions[key] for key in keys)
+
+
+def bump_version_counter(key: str) -> None:
+    """
+    Increments a version counter, starting it like get_version_counters() if it is missing.
+    Cache errors are raised to the caller.
+    """
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns() // 1000, timeout=None)
+        cache.incr(key)
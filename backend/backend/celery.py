@@ -11,7 +11,7 @@ app.autodiscover_tasks()
 app.conf.beat_schedule = {
     'dynamically_update_links_every_15minutes': {
         'task': 'analytics.tasks.update_links',
-        'schedule': 18000.0,  # Every five hours
+        'schedule': 900.0,  # Every 15 minutes; only knowledge bases whose update interval elapsed are refreshed
         'options': {'queue': 'update_links'},
     },
 }